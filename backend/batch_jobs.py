@@ -0,0 +1,313 @@
+import asyncio
+import csv
+import io
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from .config import BATCH_CHUNK_SIZE, BATCH_JOB_WORKERS, BATCH_JOBS_DB_PATH
+from .db_utils import get_db_connection
+from .input_parser import detect_language
+from .metrics import instrument_node
+from .nodes import analyze_product_match, retrieve_documents_for_items
+from .state import Analyze, AgentState
+
+logger = logging.getLogger(__name__)
+
+# Job states; queued and running jobs are picked up again when the server restarts
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+FINISHED_JOB_STATES = (JOB_COMPLETED, JOB_FAILED)
+
+# Columns of the downloadable results
+RESULT_COLUMNS = ["Product", "Language", "Listed", "Content_Certificate", "reasoning", "dataset_version"]
+
+# The graph nodes a chunk goes through, timed under the same names as in the agent graph
+_retrieve_documents = instrument_node("retrieve_documents", retrieve_documents_for_items)
+_analyze_products = instrument_node("analyze_products", analyze_product_match)
+
+
+class BatchJobStore:
+    """
+    SQLite persistence of batch jobs: one row per job and one row per product, filled in with
+    its decision once the chunk holding it has been analyzed. Products without a decision
+    are what a resumed job still has to process.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._tables_ready = False
+        self._lock = threading.Lock()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """Returns the calling thread's connection to the jobs database, creating the tables on first use."""
+        conn = get_db_connection(self.db_path)
+        if not self._tables_ready:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS batch_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    session_id TEXT NOT NULL,
+                    file_name TEXT,
+                    status TEXT NOT NULL,
+                    total INTEGER NOT NULL,
+                    processed INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS batch_job_items (
+                    job_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    item TEXT NOT NULL,
+                    language TEXT NOT NULL,
+                    decision TEXT,
+                    PRIMARY KEY (job_id, position)
+                )
+                """
+            )
+            conn.commit()
+            self._tables_ready = True
+        return conn
+
+    def create(self, session_id: str, file_name: Optional[str], items: Iterable[str]) -> Dict[str, Any]:
+        """
+        Stores a new queued job with its products (in file order) and returns it.
+        'items' is consumed once, as a stream; a ValueError raised while reading it (or an empty stream) stores nothing.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        total = 0
+
+        def rows():
+            nonlocal total
+            for position, item in enumerate(items):
+                total = position + 1
+                yield job_id, position, item, detect_language(item)
+
+        with self._lock:
+            conn = self._get_connection()
+            try:
+                conn.executemany(
+                    "INSERT INTO batch_job_items (job_id, position, item, language) VALUES (?, ?, ?, ?)",
+                    rows()
+                )
+                if total == 0:
+                    raise ValueError("No products found in the file.")
+                conn.execute(
+                    "INSERT INTO batch_jobs (job_id, session_id, file_name, status, total, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, session_id, file_name, JOB_QUEUED, total, now, now)
+                )
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Returns the job's status and progress, or None if it does not exist."""
+        with self._lock:
+            conn = self._get_connection()
+            row = conn.execute(
+                "SELECT job_id, session_id, file_name, status, total, processed, error, created_at, updated_at "
+                "FROM batch_jobs WHERE job_id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(
+            ("job_id", "session_id", "file_name", "status", "total", "processed", "error", "created_at", "updated_at"),
+            row
+        ))
+        job["progress"] = job["processed"] / job["total"] if job["total"] else 1.0
+        return job
+
+    def set_status(self, job_id: str, status: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            conn = self._get_connection()
+            conn.execute(
+                "UPDATE batch_jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ?",
+                (status, error, time.time(), job_id)
+            )
+            conn.commit()
+
+    def unfinished_job_ids(self) -> List[str]:
+        """Returns the queued and running jobs, oldest first."""
+        with self._lock:
+            conn = self._get_connection()
+            rows = conn.execute(
+                "SELECT job_id FROM batch_jobs WHERE status IN (?, ?) ORDER BY created_at",
+                (JOB_QUEUED, JOB_RUNNING)
+            ).fetchall()
+        return [job_id for job_id, in rows]
+
+    def pending_items(self, job_id: str, limit: int) -> List[Tuple[int, str, str]]:
+        """Returns up to 'limit' (position, item, language) of the job that have no decision yet, in file order."""
+        with self._lock:
+            conn = self._get_connection()
+            return conn.execute(
+                "SELECT position, item, language FROM batch_job_items "
+                "WHERE job_id = ? AND decision IS NULL ORDER BY position LIMIT ?",
+                (job_id, limit)
+            ).fetchall()
+
+    def save_decisions(self, job_id: str, decisions: List[Tuple[int, Analyze]]) -> None:
+        """Stores the decisions of a processed chunk and advances the job's progress, in one transaction."""
+        with self._lock:
+            conn = self._get_connection()
+            conn.executemany(
+                "UPDATE batch_job_items SET decision = ? WHERE job_id = ? AND position = ?",
+                ((decision.model_dump_json(), job_id, position) for position, decision in decisions)
+            )
+            conn.execute(
+                "UPDATE batch_jobs SET processed = ("
+                "SELECT COUNT(*) FROM batch_job_items WHERE job_id = ? AND decision IS NOT NULL"
+                "), updated_at = ? WHERE job_id = ?",
+                (job_id, time.time(), job_id)
+            )
+            conn.commit()
+
+    def results(self, job_id: str) -> List[Dict[str, Any]]:
+        """Returns one result row per product of the job, in file order (empty decision fields while pending)."""
+        with self._lock:
+            conn = self._get_connection()
+            rows = conn.execute(
+                "SELECT item, language, decision FROM batch_job_items WHERE job_id = ? ORDER BY position",
+                (job_id,)
+            ).fetchall()
+
+        results = []
+        for item, language, decision_json in rows:
+            decision = Analyze.model_validate_json(decision_json) if decision_json else None
+            results.append({
+                "Product": item,
+                "Language": language,
+                "Listed": decision.Listed if decision else None,
+                "Content_Certificate": decision.Content_Certificate if decision else None,
+                "reasoning": decision.reasoning if decision else None,
+                "dataset_version": decision.dataset_version if decision else None
+            })
+        return results
+
+
+class BatchJobRunner:
+    """
+    Processes batch jobs on a pool of background workers (asyncio tasks on the server's event loop).
+
+    A job's products go through the retrieve and analyze nodes of the agent graph 'chunk_size' at a time,
+    and each chunk's decisions are persisted before the next one starts, so a job interrupted by a
+    restart resumes from its first undecided product. Progress subscribers are woken after every chunk.
+    """
+
+    def __init__(self, store: BatchJobStore, workers: int, chunk_size: int):
+        self.store = store
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        # job_id -> event set (and replaced) whenever the job's progress changes
+        self._updates: Dict[str, asyncio.Event] = {}
+
+    async def start(self) -> None:
+        """Starts the workers and queues the jobs left unfinished by a previous run."""
+        self._queue = asyncio.Queue()
+        for job_id in await asyncio.to_thread(self.store.unfinished_job_ids):
+            logger.info("Resuming batch job %s", job_id)
+            self._queue.put_nowait(job_id)
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """Stops the workers; jobs in progress are resumed by the next start()."""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def submit(self, session_id: str, file_name: Optional[str], items: Iterable[str]) -> Dict[str, Any]:
+        """Persists a new job for the products (streamed from 'items' in a worker thread) and queues it. Returns the job."""
+        if self._queue is None:
+            raise RuntimeError("The batch job workers are not running.")
+        job = await asyncio.to_thread(self.store.create, session_id, file_name, items)
+        self._queue.put_nowait(job["job_id"])
+        return job
+
+    def update_event(self, job_id: str) -> asyncio.Event:
+        """Returns an event set at the job's next progress change (take it before reading the job, so no change is missed)."""
+        return self._updates.setdefault(job_id, asyncio.Event())
+
+    def _notify(self, job_id: str) -> None:
+        event = self._updates.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run_job(job_id)
+            except Exception as e:
+                logger.exception("Batch job %s failed", job_id)
+                await asyncio.to_thread(self.store.set_status, job_id, JOB_FAILED, str(e))
+            finally:
+                self._notify(job_id)
+                self._queue.task_done()
+
+    async def _run_job(self, job_id: str) -> None:
+        started = time.perf_counter()
+        await asyncio.to_thread(self.store.set_status, job_id, JOB_RUNNING)
+        self._notify(job_id)
+
+        while True:
+            chunk = await asyncio.to_thread(self.store.pending_items, job_id, self.chunk_size)
+            if not chunk:
+                break
+            decisions = await self._process_chunk(chunk)
+            await asyncio.to_thread(self.store.save_decisions, job_id, decisions)
+            self._notify(job_id)
+
+        await asyncio.to_thread(self.store.set_status, job_id, JOB_COMPLETED)
+        logger.info("Batch job %s completed in %.1fs", job_id, time.perf_counter() - started)
+
+    async def _process_chunk(self, chunk: List[Tuple[int, str, str]]) -> List[Tuple[int, Analyze]]:
+        """Runs a chunk of products through the retrieve and analyze nodes; repeated products are analyzed once."""
+        state: AgentState = {
+            "messages": [],
+            "product_items": {item: language for _, item, language in chunk},
+            "items_retrieved_docs": {},
+            "items_decisions": {}
+        }
+        state.update(await _retrieve_documents(state))
+        state.update(await _analyze_products(state))
+        return [(position, state["items_decisions"][item]) for position, item, _ in chunk]
+
+
+def export_results(results: List[Dict[str, Any]], file_format: str) -> bytes:
+    """Renders job results as an .xlsx workbook or a UTF-8 CSV (with a BOM, so Excel shows Arabic correctly)."""
+    if file_format == "xlsx":
+        buffer = io.BytesIO()
+        pd.DataFrame(results, columns=RESULT_COLUMNS).to_excel(buffer, index=False)
+        return buffer.getvalue()
+
+    if file_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(results)
+        return buffer.getvalue().encode("utf-8-sig")
+
+    raise ValueError(f"Unsupported results format '{file_format}', expected 'xlsx' or 'csv'.")
+
+
+batch_jobs = BatchJobRunner(BatchJobStore(BATCH_JOBS_DB_PATH), workers=BATCH_JOB_WORKERS, chunk_size=BATCH_CHUNK_SIZE)
@@ -0,0 +1,336 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .config import CHROMA_PATHS_BY_LANG, CHROMA_PATH_UNIFIED, EMBEDDING_MODEL_NAME, UNIFIED_INDEX
+from .embeddings import load_embeddings
+from .index_manifest import read_index_manifest, write_index_manifest
+from .index_registry import (
+    INDEX_ROOT,
+    index_version_paths,
+    prune_index_versions,
+    publish_index_version,
+    read_current_index_version
+)
+from .matcher import BASELINE_FIELD, TITLE_FIELDS
+
+# The latest mandatory list published by the ministry
+DEFAULT_SOURCE = os.path.join("Preparing Data", "القائمة الالزامية يونيو 2025.xlsx")
+
+# Rows written to (or deleted from) Chroma per call
+_CHROMA_WRITE_BATCH = 1000
+
+
+def load_mandatory_list(source: str) -> pd.DataFrame:
+    """
+    Reads the mandatory-list workbook. The first four columns (segment) are only filled
+    on the first row of each segment, so they are forward-filled.
+    """
+    df = pd.read_excel(source)
+    columns_to_fill = list(df.columns[:4])
+    df[columns_to_fill] = df[columns_to_fill].ffill()
+    return df
+
+
+def _metadata_value(value: Any) -> Any:
+    """Converts a cell to a value Chroma can store as metadata (None for empty cells)."""
+    if pd.isna(value):
+        return None
+    if isinstance(value, (str, bool, int, float)):
+        return value.strip() if isinstance(value, str) else value
+    if hasattr(value, "item"):
+        # numpy scalars
+        return value.item()
+    return str(value)
+
+
+def _record(document: str, metadata: Dict[str, Any], titles: List[str]) -> Dict[str, Any]:
+    """
+    Builds an index record. Its id is a hash of the stored content, so unchanged rows keep
+    their id across builds and only added or changed rows need to be embedded.
+    """
+    # Chroma does not store empty metadata values
+    metadata = {field: value for field, value in metadata.items() if value not in (None, "")}
+    content = json.dumps([document, metadata], sort_keys=True, ensure_ascii=False, default=str)
+    return {
+        "id": hashlib.sha256(content.encode("utf-8")).hexdigest()[:32],
+        "document": document,
+        "metadata": metadata,
+        "titles": titles
+    }
+
+
+def prepare_records(df: pd.DataFrame, mode: str) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Turns the mandatory list into index records, by store name.
+
+    'per_language': an 'en' and an 'ar' store holding one title per row, with the baseline
+    under its full column header (the layout of the original notebook).
+    'unified': a single store holding each row once, with both titles and the baseline.
+    Rows without a title are skipped, and identical rows are stored once.
+    """
+    col_ar, col_en, col_baseline = df.columns[5], df.columns[6], df.columns[-1]
+
+    titles_en = df[col_en].fillna("").astype(str).str.strip()
+    titles_ar = df[col_ar].fillna("").astype(str).str.strip()
+    baselines = df[col_baseline].map(_metadata_value)
+
+    records: Dict[str, List[Dict[str, Any]]] = {}
+    if mode == "unified":
+        has_title = (titles_en != "") | (titles_ar != "")
+        records[UNIFIED_INDEX] = [
+            _record(
+                title_en or title_ar,
+                {TITLE_FIELDS[0]: title_en, TITLE_FIELDS[1]: title_ar, BASELINE_FIELD: baseline},
+                [title for title in (title_en, title_ar) if title]
+            )
+            for title_en, title_ar, baseline in zip(titles_en[has_title], titles_ar[has_title], baselines[has_title])
+        ]
+    else:
+        for lang, titles in (("en", titles_en), ("ar", titles_ar)):
+            has_title = titles != ""
+            records[lang] = [
+                _record(title, {col_baseline: baseline}, [title])
+                for title, baseline in zip(titles[has_title], baselines[has_title])
+            ]
+
+    # Identical rows share an id; keep the first
+    unique_records = {}
+    for name, store_records in records.items():
+        by_id = {}
+        for record in store_records:
+            by_id.setdefault(record["id"], record)
+        unique_records[name] = list(by_id.values())
+    return unique_records
+
+
+def embed_records(embeddings, records: List[Dict[str, Any]], batch_size: int, combine: bool) -> List[List[float]]:
+    """
+    Embeds the records in batches of 'batch_size' titles.
+    With 'combine' (unified index) each record gets the normalized mean of its normalized title
+    embeddings; otherwise the raw embedding of its single title, as the notebook stored it.
+    """
+    titles = [title for record in records for title in record["titles"]]
+    vectors = []
+    for start in range(0, len(titles), batch_size):
+        vectors.extend(embeddings.embed_documents(titles[start:start + batch_size]))
+    vectors = np.asarray(vectors, dtype=np.float32)
+
+    if not combine:
+        return vectors.tolist()
+
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    combined, offset = [], 0
+    for record in records:
+        mean = vectors[offset:offset + len(record["titles"])].mean(axis=0)
+        combined.append(mean / max(float(np.linalg.norm(mean)), 1e-12))
+        offset += len(record["titles"])
+    return np.asarray(combined).tolist()
+
+
+def index_version(record_ids) -> str:
+    """Version of an index: a fingerprint of its content (the record ids) and the embedding model."""
+    digest = hashlib.sha256(EMBEDDING_MODEL_NAME.encode("utf-8"))
+    for record_id in sorted(record_ids):
+        digest.update(record_id.encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def sync_store(
+    index_dir: str,
+    records: List[Dict[str, Any]],
+    get_embeddings: Callable[[], Any],
+    batch_size: int,
+    combine: bool,
+    manifest_extra: Dict[str, Any],
+    full_rebuild: bool = False,
+    base_dir: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Brings the Chroma store in 'index_dir' in line with 'records': only records whose content hash
+    is not stored yet are embedded and added, and stored records that are no longer in the list are deleted.
+    A store without a manifest, built with another embedding model, or 'full_rebuild' is rebuilt from scratch.
+    The embedding model is only requested (via 'get_embeddings') when there are records to add.
+
+    The store is updated in a copy that replaces 'index_dir' once complete, with its manifest.
+    With 'base_dir' the update starts from the store in that directory instead of 'index_dir' (e.g. the
+    previous index version), which is left untouched. Returns the manifest.
+    """
+    from langchain_chroma import Chroma
+
+    base_dir = base_dir or index_dir
+    previous_manifest = read_index_manifest(base_dir) if os.path.isdir(base_dir) else None
+    incremental = (
+        not full_rebuild
+        and previous_manifest is not None
+        and previous_manifest.get("embedding_model") == EMBEDDING_MODEL_NAME
+    )
+
+    # A fresh staging path per build: Chroma caches its clients by path
+    staging_dir = index_dir.rstrip("/\\") + f".building-{uuid.uuid4().hex[:8]}"
+    if incremental:
+        shutil.copytree(base_dir, staging_dir)
+
+    # Unified rows are compared by cosine similarity; the per-language stores keep Chroma's default (L2)
+    collection_metadata = {"hnsw:space": "cosine"} if combine else None
+    vector_store = Chroma(persist_directory=staging_dir, collection_metadata=collection_metadata)
+    collection = vector_store._collection
+
+    stored_ids = set(collection.get(include=[])["ids"])
+    wanted = {record["id"]: record for record in records}
+    ids_to_delete = sorted(stored_ids - wanted.keys())
+    records_to_add = [record for record_id, record in wanted.items() if record_id not in stored_ids]
+
+    for start in range(0, len(ids_to_delete), _CHROMA_WRITE_BATCH):
+        collection.delete(ids=ids_to_delete[start:start + _CHROMA_WRITE_BATCH])
+
+    vectors = embed_records(get_embeddings(), records_to_add, batch_size, combine) if records_to_add else []
+    for start in range(0, len(records_to_add), _CHROMA_WRITE_BATCH):
+        batch = records_to_add[start:start + _CHROMA_WRITE_BATCH]
+        collection.add(
+            ids=[record["id"] for record in batch],
+            embeddings=vectors[start:start + _CHROMA_WRITE_BATCH],
+            documents=[record["document"] for record in batch],
+            metadatas=[record["metadata"] for record in batch]
+        )
+
+    manifest = {
+        "version": index_version(wanted),
+        "embedding_model": EMBEDDING_MODEL_NAME,
+        "built_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "rows": len(wanted),
+        "added": len(records_to_add),
+        "deleted": len(ids_to_delete),
+        "incremental": incremental,
+        **manifest_extra
+    }
+    write_index_manifest(staging_dir, manifest)
+
+    # Release the files before moving them (Client.close is only available in recent chromadb versions)
+    close_client = getattr(vector_store._client, "close", None)
+    if close_client is not None:
+        close_client()
+
+    # Swap the finished store into place
+    previous_dir = index_dir.rstrip("/\\") + ".previous"
+    shutil.rmtree(previous_dir, ignore_errors=True)
+    if os.path.exists(index_dir):
+        os.replace(index_dir, previous_dir)
+    os.replace(staging_dir, index_dir)
+    shutil.rmtree(previous_dir, ignore_errors=True)
+
+    return manifest
+
+
+def build_index(
+    source: str,
+    mode: str,
+    output_dirs: Optional[Dict[str, str]] = None,
+    batch_size: int = 64,
+    full_rebuild: bool = False,
+    publish: bool = False,
+    keep_versions: int = 3
+) -> Dict[str, Any]:
+    """
+    Builds or incrementally updates every store of an index layout from the mandatory-list workbook.
+
+    With 'publish' the stores are built into a new index version directory (INDEX_ROOT/<UTC timestamp>),
+    starting from the published version, which is then replaced by the new one: running servers swap to
+    it without a restart. Only the newest 'keep_versions' versions are kept.
+    """
+    started = time.perf_counter()
+
+    if output_dirs is None:
+        output_dirs = {UNIFIED_INDEX: CHROMA_PATH_UNIFIED} if mode == "unified" else dict(CHROMA_PATHS_BY_LANG)
+
+    # Start from the published version, or from the fixed store directories before the first publication
+    base_dirs = dict(output_dirs)
+    version_name = None
+    if publish:
+        current_version = read_current_index_version()
+        if current_version:
+            base_dirs = index_version_paths(current_version, output_dirs)
+        version_name = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        if os.path.exists(os.path.join(INDEX_ROOT, version_name)):
+            raise FileExistsError(f"Index version '{version_name}' already exists in {INDEX_ROOT}")
+        output_dirs = index_version_paths(version_name, output_dirs)
+
+    with open(source, "rb") as source_file:
+        source_sha256 = hashlib.sha256(source_file.read()).hexdigest()
+
+    records_by_store = prepare_records(load_mandatory_list(source), mode)
+
+    # The model is only loaded when there is something to embed
+    loaded_embeddings = {}
+
+    def get_embeddings():
+        if "model" not in loaded_embeddings:
+            loaded_embeddings["model"], _ = load_embeddings(EMBEDDING_MODEL_NAME)
+        return loaded_embeddings["model"]
+
+    manifests = {}
+    for name, records in records_by_store.items():
+        manifests[name] = sync_store(
+            output_dirs[name],
+            records,
+            get_embeddings,
+            batch_size,
+            combine=(mode == "unified"),
+            manifest_extra={
+                "index": name,
+                "mode": mode,
+                "source": os.path.basename(source),
+                "source_sha256": source_sha256
+            },
+            full_rebuild=full_rebuild,
+            base_dir=base_dirs[name]
+        )
+
+    result = {"seconds": round(time.perf_counter() - started, 1), "stores": manifests}
+    if publish:
+        publish_index_version(version_name)
+        result["published_version"] = version_name
+        result["pruned_versions"] = prune_index_versions(keep_versions)
+    return result
+
+
+def main():
+    """Command-line entry point: python -m backend.build_index [--source XLSX] [--mode per_language|unified]"""
+    parser = argparse.ArgumentParser(description="Build or incrementally update the vector indexes from the mandatory-list workbook.")
+    parser.add_argument("--source", default=DEFAULT_SOURCE, help="Mandatory-list .xlsx file.")
+    parser.add_argument("--mode", choices=("per_language", "unified"), default="per_language",
+                        help="Build the English and Arabic stores, or the unified bilingual store.")
+    parser.add_argument("--output", help="Directory of the unified store (default: CHROMA_PATH_UNIFIED).")
+    parser.add_argument("--output-en", help="Directory of the English store (default: CHROMA_PATH_EN).")
+    parser.add_argument("--output-ar", help="Directory of the Arabic store (default: CHROMA_PATH_AR).")
+    parser.add_argument("--batch-size", type=int, default=64, help="Titles embedded per call.")
+    parser.add_argument("--full", action="store_true", help="Re-embed every row instead of only added or changed rows.")
+    parser.add_argument("--publish", action="store_true",
+                        help="Build a new index version in INDEX_ROOT and publish it to running servers "
+                             "(the --output* stores are only the starting point of the first version).")
+    parser.add_argument("--keep-versions", type=int, default=3, help="Index versions kept in INDEX_ROOT with --publish.")
+    args = parser.parse_args()
+
+    if args.mode == "unified":
+        output_dirs = {UNIFIED_INDEX: args.output or CHROMA_PATH_UNIFIED}
+    else:
+        output_dirs = {"en": args.output_en or CHROMA_PATHS_BY_LANG["en"], "ar": args.output_ar or CHROMA_PATHS_BY_LANG["ar"]}
+
+    result = build_index(
+        args.source, args.mode, output_dirs, args.batch_size,
+        full_rebuild=args.full, publish=args.publish, keep_versions=args.keep_versions
+    )
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
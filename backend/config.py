@@ -1,8 +1,16 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
 from dotenv import load_dotenv
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_chroma import Chroma
+from .decision_cache import DecisionCache
+from .embeddings import load_embeddings, CachedEmbeddings
+from .llm_gateway import LLMGateway, RateLimiter
+from .index_registry import IndexSnapshot, index_version_paths, read_current_index_version
+from .upload_store import UploadStore
+from typing import Any, Callable, Dict, Optional
+import logging
 import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables from a .env file (e.g., for API keys)
 load_dotenv()
@@ -10,48 +18,359 @@ load_dotenv()
 # Retrieve the API key explicitly
 google_api_key = os.getenv("GOOGLE_API_KEY")
 
-# Initialize the Google Gemini LLM
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.5-pro", 
-    temperature=0.0,
-    google_api_key=google_api_key)
-
 # Define paths to your persisted ChromaDB directories
-CHROMA_PATH_EN = r"backend\chroma_db_archive_en"
-CHROMA_PATH_AR = r"backend\chroma_db_archive_ar"
-
-# Initialize the embedding function
-embedding_function = HuggingFaceEmbeddings(model_name="sentence-transformers/paraphrase-multilingual-mpnet-base-v2")
-
-# Initialize the ChromaDB instance for English
-en_db = None
-try:
-    en_db = Chroma(persist_directory=CHROMA_PATH_EN, embedding_function=embedding_function)
-except Exception as e:
-    pass
-
-# Initialize the ChromaDB instance for Arabic
-ar_db = None
-try:
-    ar_db = Chroma(persist_directory=CHROMA_PATH_AR, embedding_function=embedding_function)
-except Exception as e:
-    pass
-    
-# Initialize retrievers
-en_retriever = None
-if en_db:
-    en_retriever = en_db.as_retriever(search_kwargs={"k": 3})
-else:
-    pass
-
-ar_retriever = None
-if ar_db:
-    ar_retriever = ar_db.as_retriever(search_kwargs={"k": 3})
-else:
-    pass
-
-
-retrievers_by_lang = {
-    "en": en_retriever,
-    "ar": ar_retriever
-}
\ No newline at end of file
+CHROMA_PATH_EN = os.getenv("CHROMA_PATH_EN", os.path.join("backend", "chroma_db_archive_en"))
+CHROMA_PATH_AR = os.getenv("CHROMA_PATH_AR", os.path.join("backend", "chroma_db_archive_ar"))
+CHROMA_PATHS_BY_LANG = {
+    "en": CHROMA_PATH_EN,
+    "ar": CHROMA_PATH_AR
+}
+
+# Index layout: "per_language" (one store per language, items routed by their detected language)
+# or "unified" (a single bilingual store holding each mandatory-list row once, queried for every item)
+INDEX_MODE = os.getenv("INDEX_MODE", "per_language").lower()
+if INDEX_MODE not in ("per_language", "unified"):
+    raise ValueError(f"INDEX_MODE must be 'per_language' or 'unified', got '{INDEX_MODE}'.")
+
+UNIFIED_INDEX = "unified"
+CHROMA_PATH_UNIFIED = os.getenv("CHROMA_PATH_UNIFIED", os.path.join("backend", "chroma_db_unified"))
+
+# Vector stores of the active index layout, by name
+VECTOR_STORE_PATHS = {UNIFIED_INDEX: CHROMA_PATH_UNIFIED} if INDEX_MODE == "unified" else CHROMA_PATHS_BY_LANG
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
+
+# Embedding backend: "torch" (full precision) or "onnx" (ONNX Runtime, falls back to torch if it cannot load).
+# The default ONNX file is the int8 dynamically quantized export for AVX2 CPUs shipped with the model.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+
+# In-process LRU cache of query embeddings shared by both stores (0 disables it);
+# set EMBEDDING_CACHE_DIR to keep the cached vectors on disk across restarts
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR") or None
+
+# Number of documents retrieved per product item
+RETRIEVAL_K = 3
+
+# Chat models: every call goes through the LLM gateway, which keeps within the RPM/TPM quota (0 = unlimited),
+# retries rate-limit and transient errors with jittered exponential backoff, and shares identical calls in flight.
+# With LLM_FALLBACK_MODEL, calls that would wait more than LLM_OVERFLOW_WAIT seconds for the quota,
+# or are still rate limited after their retries, go to that (cheaper) model instead
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.5-pro")
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL") or None
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))
+LLM_TPM = int(os.getenv("LLM_TPM", "0"))
+LLM_FALLBACK_RPM = int(os.getenv("LLM_FALLBACK_RPM", "0"))
+LLM_FALLBACK_TPM = int(os.getenv("LLM_FALLBACK_TPM", "0"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+LLM_OVERFLOW_WAIT = float(os.getenv("LLM_OVERFLOW_WAIT", "5"))
+LLM_DEDUP_ENABLED = os.getenv("LLM_DEDUP_ENABLED", "true").lower() == "true"
+
+# Load the models and vector stores in the background when the server starts
+WARM_UP_ON_STARTUP = os.getenv("WARM_UP_ON_STARTUP", "true").lower() == "true"
+
+# Seconds between checks of the published index version (INDEX_ROOT/CURRENT) by the server (0 disables the watcher)
+INDEX_WATCH_INTERVAL = float(os.getenv("INDEX_WATCH_INTERVAL", "30"))
+
+
+# --- Lazily initialized resources ---
+# Nothing heavy is loaded at import time: each resource is created by its getter on first use
+# (or by warm_up()), exactly once even when several threads ask for it at the same time.
+
+_resources: Dict[str, Any] = {}
+_resource_locks: Dict[str, threading.Lock] = {}
+_resource_locks_guard = threading.Lock()
+
+# Seconds spent creating each resource, reported by warm_up() and the readiness endpoint
+load_timings: Dict[str, float] = {}
+
+# Embedding backend actually in use once the model is loaded (differs from EMBEDDING_BACKEND after a fallback)
+loaded_embedding_backend: Optional[str] = None
+
+# The index snapshot served before the last swap, kept for the requests still using it
+_previous_index: Optional[IndexSnapshot] = None
+_index_swap_lock = threading.Lock()
+# Index version that last failed to load, so the watcher does not retry it on every check
+_failed_index_version: Optional[str] = None
+
+
+def _get_or_create(name: str, factory: Callable[[], Any]) -> Any:
+    """Returns the named resource, creating it with 'factory' on first use (thread-safe)."""
+    if name in _resources:
+        return _resources[name]
+
+    with _resource_locks_guard:
+        lock = _resource_locks.setdefault(name, threading.Lock())
+
+    with lock:
+        if name not in _resources:
+            started = time.perf_counter()
+            _resources[name] = factory()
+            load_timings[name] = round(time.perf_counter() - started, 3)
+            logger.info("Loaded %s in %.2fs", name, load_timings[name])
+    return _resources[name]
+
+
+def _create_chat_model(model_name: str):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    from .metrics import llm_metrics_callback
+    return ChatGoogleGenerativeAI(
+        model=model_name,
+        temperature=0.0,
+        google_api_key=google_api_key,
+        # Retries are left to the LLM gateway (a single attempt per call here)
+        max_retries=1,
+        callbacks=[llm_metrics_callback])
+
+
+def create_llm_gateway(model, fallback_model=None) -> LLMGateway:
+    """Wraps chat models (e.g. a local stub in tests and benchmarks) in an LLM gateway configured by the LLM_* settings."""
+    return LLMGateway(
+        model,
+        fallback_model,
+        limiter=RateLimiter(LLM_RPM, LLM_TPM),
+        fallback_limiter=RateLimiter(LLM_FALLBACK_RPM, LLM_FALLBACK_TPM),
+        max_retries=LLM_MAX_RETRIES,
+        backoff_base=LLM_BACKOFF_BASE,
+        backoff_max=LLM_BACKOFF_MAX,
+        overflow_wait=LLM_OVERFLOW_WAIT,
+        deduplicate=LLM_DEDUP_ENABLED
+    )
+
+
+def _create_llm():
+    fallback_model = _create_chat_model(LLM_FALLBACK_MODEL) if LLM_FALLBACK_MODEL else None
+    return create_llm_gateway(_create_chat_model(LLM_MODEL), fallback_model)
+
+
+def _create_embedding_function():
+    global loaded_embedding_backend
+    embeddings, loaded_embedding_backend = load_embeddings(EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND, EMBEDDING_ONNX_FILE)
+    if EMBEDDING_CACHE_SIZE > 0:
+        embeddings = CachedEmbeddings(
+            embeddings,
+            max_entries=EMBEDDING_CACHE_SIZE,
+            persist_dir=EMBEDDING_CACHE_DIR,
+            model_id=f"{EMBEDDING_MODEL_NAME}:{loaded_embedding_backend}"
+        )
+    return embeddings
+
+
+def get_llm():
+    """Returns the shared Google Gemini LLM, behind the LLM gateway."""
+    return _get_or_create("llm", _create_llm)
+
+
+def set_llm(llm) -> None:
+    """Replaces the shared LLM (e.g. with the gateway around the offline stub of the pipeline benchmark)."""
+    _resources["llm"] = llm
+
+
+def get_embedding_function():
+    """Returns the shared embedding model (loaded on first use)."""
+    return _get_or_create("embeddings", _create_embedding_function)
+
+
+def get_embedding_cache() -> Optional[CachedEmbeddings]:
+    """Returns the embedding cache if the embedding model is loaded and caching is enabled (does not load anything)."""
+    embeddings = _resources.get("embeddings")
+    return embeddings if isinstance(embeddings, CachedEmbeddings) else None
+
+
+def _load_index(version_name: Optional[str] = None) -> IndexSnapshot:
+    """
+    Loads an index version: 'version_name' from INDEX_ROOT, else the published version (INDEX_ROOT/CURRENT),
+    else the fixed stores of the active layout (CHROMA_PATH_*).
+    """
+    version_name = version_name or read_current_index_version()
+    if version_name:
+        paths = index_version_paths(version_name, VECTOR_STORE_PATHS)
+    else:
+        version_name, paths = "default", dict(VECTOR_STORE_PATHS)
+    return IndexSnapshot(version_name, paths, get_embedding_function())
+
+
+def get_index(dataset_version: Optional[str] = None) -> IndexSnapshot:
+    """
+    Returns the index snapshot being served (loaded on first use).
+    With 'dataset_version', returns the snapshot of that version if it is still loaded, so a request
+    that started before a swap finishes against the index it retrieved its documents from.
+    """
+    index = _get_or_create("index", _load_index)
+    if dataset_version and index.version != dataset_version:
+        previous_index = _previous_index
+        if previous_index is not None and previous_index.version == dataset_version:
+            return previous_index
+    return index
+
+
+def swap_index(version_name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Loads an index version next to the one being served (see _load_index), warms it, and then
+    atomically makes it the served index. Requests already running keep the snapshot they started with.
+    An index with a store that fails to load is not swapped in (raises RuntimeError).
+    Returns the name and dataset version of the new index.
+    """
+    global _previous_index, _failed_index_version
+
+    with _index_swap_lock:
+        started = time.perf_counter()
+        new_index = _load_index(version_name)
+        if new_index.errors:
+            new_index.close()
+            _failed_index_version = new_index.name
+            raise RuntimeError(f"Index '{new_index.name}' was not swapped in: {new_index.errors}")
+        if MATCH_FAST_PATH_ENABLED:
+            new_index.get_title_index()
+
+        retired_index = _previous_index
+        _previous_index = _resources.get("index")
+        _resources["index"] = new_index
+        _failed_index_version = None
+        load_timings["index"] = round(time.perf_counter() - started, 3)
+
+    # The snapshot from two swaps ago has no more requests to serve
+    if retired_index is not None:
+        retired_index.close()
+
+    logger.info(
+        "Now serving index '%s' (dataset version %s), loaded in %.2fs",
+        new_index.name, new_index.version, load_timings["index"]
+    )
+    return {"name": new_index.name, "dataset_version": new_index.version, "seconds": load_timings["index"]}
+
+
+def swap_to_published_index() -> bool:
+    """
+    Swaps in the published index version (INDEX_ROOT/CURRENT) if it differs from the one being served.
+    Does nothing before the index is first loaded, since it will load the published version anyway.
+    Returns whether the index was swapped.
+    """
+    index = _resources.get("index")
+    published_version = read_current_index_version()
+    if index is None or published_version in (None, index.name, _failed_index_version):
+        return False
+    swap_index(published_version)
+    return True
+
+
+# Concurrency settings for the per-item product analysis
+# (set ANALYSIS_MAX_CONCURRENCY=1 to analyze items one at a time)
+ANALYSIS_MAX_CONCURRENCY = max(1, int(os.getenv("ANALYSIS_MAX_CONCURRENCY", "8")))
+ANALYSIS_ITEM_TIMEOUT = float(os.getenv("ANALYSIS_ITEM_TIMEOUT", "120"))
+
+# Products analyzed together in one LLM call (1 analyzes every product with its own call);
+# products missing from a batched answer are re-analyzed one by one
+ANALYSIS_BATCH_SIZE = max(1, int(os.getenv("ANALYSIS_BATCH_SIZE", "10")))
+ANALYSIS_BATCH_TIMEOUT = float(os.getenv("ANALYSIS_BATCH_TIMEOUT", "180"))
+
+# Persistent cache of analysis decisions, stored next to the checkpoint database
+DECISION_CACHE_ENABLED = os.getenv("DECISION_CACHE_ENABLED", "true").lower() == "true"
+DECISION_CACHE_PATH = os.getenv("DECISION_CACHE_PATH", os.path.join("backend", "decision_cache.sqlite"))
+DECISION_CACHE_TTL = float(os.getenv("DECISION_CACHE_TTL", str(7 * 24 * 3600)))
+DECISION_CACHE_MAX_ENTRIES = int(os.getenv("DECISION_CACHE_MAX_ENTRIES", "50000"))
+
+decision_cache = DecisionCache(
+    db_path=DECISION_CACHE_PATH,
+    ttl_seconds=DECISION_CACHE_TTL,
+    max_entries=DECISION_CACHE_MAX_ENTRIES
+)
+
+# Uploaded file contents, stored once by content hash; chat messages only hold the reference.
+# Uploads not sent again within UPLOAD_RETENTION seconds are removed by the maintenance job
+UPLOAD_STORE_PATH = os.getenv("UPLOAD_STORE_PATH", os.path.join("backend", "uploads.sqlite"))
+UPLOAD_RETENTION = float(os.getenv("UPLOAD_RETENTION", str(30 * 24 * 3600)))
+
+upload_store = UploadStore(UPLOAD_STORE_PATH)
+
+
+# Batch jobs: products of uploaded spreadsheets are analyzed in the background, BATCH_CHUNK_SIZE at a time,
+# by BATCH_JOB_WORKERS concurrent jobs; jobs and their results are kept in their own SQLite database
+BATCH_JOBS_DB_PATH = os.getenv("BATCH_JOBS_DB_PATH", os.path.join("backend", "batch_jobs.sqlite"))
+BATCH_JOB_WORKERS = max(1, int(os.getenv("BATCH_JOB_WORKERS", "1")))
+BATCH_CHUNK_SIZE = max(1, int(os.getenv("BATCH_CHUNK_SIZE", "50")))
+BATCH_JOB_MAX_ITEMS = int(os.getenv("BATCH_JOB_MAX_ITEMS", "20000"))
+
+
+# Deterministic title-matching fast path in front of the LLM analysis
+MATCH_FAST_PATH_ENABLED = os.getenv("MATCH_FAST_PATH_ENABLED", "true").lower() == "true"
+MATCH_FUZZY_THRESHOLD = float(os.getenv("MATCH_FUZZY_THRESHOLD", "0.92"))
+
+def get_title_index():
+    """Returns the in-memory commodity title index of the served index, built once per index version."""
+    return get_index().get_title_index()
+
+# Split structured input (lists, quoted items, one product per line) without the LLM parser
+PARSE_FAST_PATH_ENABLED = os.getenv("PARSE_FAST_PATH_ENABLED", "true").lower() == "true"
+
+# Maximum number of messages kept in a conversation thread (0 keeps the full history)
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "20"))
+
+# Final answer: "table" (deterministic Markdown table, no LLM call), "summary" (the table plus a short
+# LLM overview for results of at most FINAL_SUMMARY_MAX_ITEMS products) or "llm" (LLM-written answer)
+FINAL_OUTPUT_MODE = os.getenv("FINAL_OUTPUT_MODE", "table").lower()
+if FINAL_OUTPUT_MODE not in ("table", "summary", "llm"):
+    raise ValueError(f"FINAL_OUTPUT_MODE must be 'table', 'summary' or 'llm', got '{FINAL_OUTPUT_MODE}'.")
+FINAL_SUMMARY_MAX_ITEMS = int(os.getenv("FINAL_SUMMARY_MAX_ITEMS", "20"))
+
+
+def warm_up() -> Dict[str, float]:
+    """
+    Loads every lazily initialized resource up front (meant to run in a worker thread at startup)
+    and logs how long each one took. Returns the per-resource load times in seconds.
+    """
+    started = time.perf_counter()
+
+    get_llm()
+    get_embedding_function()
+    get_index()
+    if MATCH_FAST_PATH_ENABLED:
+        get_title_index()
+
+    total = time.perf_counter() - started
+    logger.info(
+        "Warm-up finished in %.2fs (%s)",
+        total,
+        ", ".join(f"{name}: {seconds:.2f}s" for name, seconds in load_timings.items())
+    )
+    return dict(load_timings)
+
+
+def get_readiness() -> Dict[str, Any]:
+    """
+    Reports which resources are loaded, without loading anything.
+    The service is ready once the LLM and embedding model are loaded and every vector store holds documents.
+    """
+    index: Optional[IndexSnapshot] = _resources.get("index")
+    document_counts = index.document_counts() if index is not None else {}
+    stores = {}
+    for name, path in (index.paths if index is not None else VECTOR_STORE_PATHS).items():
+        manifest = (index.manifests.get(name) if index is not None else None) or {}
+        stores[name] = {
+            "path": path,
+            "version": manifest.get("version"),
+            "built_at": manifest.get("built_at"),
+            "loaded": index is not None and index.stores.get(name) is not None,
+            "documents": document_counts.get(name),
+            "error": index.errors.get(name) if index is not None else None
+        }
+
+    ready = (
+        "llm" in _resources
+        and "embeddings" in _resources
+        and all(store["loaded"] and store["documents"] for store in stores.values())
+    )
+    return {
+        "ready": ready,
+        "llm_loaded": "llm" in _resources,
+        "embeddings_loaded": "embeddings" in _resources,
+        "embedding_backend": loaded_embedding_backend,
+        "index_mode": INDEX_MODE,
+        "index_version": index.name if index is not None else None,
+        "dataset_version": index.version if index is not None else None,
+        "vector_stores": stores,
+        "load_timings": dict(load_timings)
+    }
@@ -1,29 +1,235 @@
+import os
 import sqlite3
+import threading
+import aiosqlite
 
-SQLITE_CHECKPOINT_PATH = r"backend\db.sqlite"
+SQLITE_CHECKPOINT_PATH = os.getenv("CHECKPOINT_DB_PATH", os.path.join("backend", "db.sqlite"))
 
+# How long a connection waits for a lock held by another writer before failing
+SQLITE_BUSY_TIMEOUT_MS = 5000
 
+# Checkpoint housekeeping: checkpoints kept per thread, and how often the server prunes and vacuums
+# (in seconds, 0 disables the periodic run)
+CHECKPOINT_KEEP_LAST = int(os.getenv("CHECKPOINT_KEEP_LAST", "5"))
+MAINTENANCE_INTERVAL = float(os.getenv("MAINTENANCE_INTERVAL", "3600"))
 
-def get_db_connection():
+# Pragmas applied to every connection to the checkpoint database:
+# WAL lets readers (history) run alongside the checkpointer's writes, NORMAL sync is safe under WAL,
+# and the busy timeout makes concurrent writers wait instead of failing with "database is locked".
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",
+)
 
-    """Establishes a connection to the SQLite database."""
+# Checkpoint IDs are time-ordered, so the latest checkpoints of a thread sort last
+_STALE_CHECKPOINTS_QUERY = """
+    SELECT thread_id, checkpoint_ns, checkpoint_id FROM (
+        SELECT thread_id, checkpoint_ns, checkpoint_id,
+               ROW_NUMBER() OVER (
+                   PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC
+               ) AS recency
+        FROM checkpoints
+    ) WHERE recency > ?
+"""
 
-    return sqlite3.connect(SQLITE_CHECKPOINT_PATH, check_same_thread=False)
 
+# Connections are opened once per thread (and database file) and reused for the life of the process
+_thread_local = threading.local()
+_open_connections = []
+_open_connections_lock = threading.Lock()
+# Bumped by close_db_connections: a thread's connections from an older generation have been closed
+_connections_generation = 0
+
+# The graph checkpointer's connection, shared by every request on the event loop
+_async_connection = None
+
+
+def configure_connection(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """Applies the shared pragmas to a sqlite3 connection."""
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+async def configure_async_connection(conn) -> None:
+    """Applies the shared pragmas to an aiosqlite connection (e.g. the graph checkpointer's)."""
+    for pragma in SQLITE_PRAGMAS:
+        await conn.execute(pragma)
+
+
+def get_db_connection(db_path: str = SQLITE_CHECKPOINT_PATH) -> sqlite3.Connection:
+
+    """
+    Returns the calling thread's connection to the SQLite database (the checkpoint database by default).
+    The connection is opened and configured on first use and reused afterwards, so callers must not close it.
+    """
+
+    connections = getattr(_thread_local, "connections", None)
+    if connections is None or _thread_local.generation != _connections_generation:
+        # First use in this thread, or its connections were closed by a shutdown: open fresh ones
+        connections = _thread_local.connections = {}
+        _thread_local.generation = _connections_generation
+
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        configure_connection(conn)
+        connections[db_path] = conn
+        with _open_connections_lock:
+            _open_connections.append(conn)
+    return conn
+
+
+async def get_async_db_connection() -> aiosqlite.Connection:
+    """
+    Returns the shared aiosqlite connection to the checkpoint database used by the graph checkpointer.
+    It is opened on first use, so call it from the event loop that serves the graph.
+    """
+    global _async_connection
+    if _async_connection is None:
+        _async_connection = await aiosqlite.connect(SQLITE_CHECKPOINT_PATH, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+        await configure_async_connection(_async_connection)
+    return _async_connection
+
+
+async def close_db_connections() -> None:
+    """Closes the shared async connection and every per-thread connection (on application shutdown)."""
+    global _async_connection, _connections_generation
+    if _async_connection is not None:
+        await _async_connection.close()
+        _async_connection = None
+
+    with _open_connections_lock:
+        for conn in _open_connections:
+            conn.close()
+        _open_connections.clear()
+        # Make threads that outlive the shutdown open fresh connections
+        _connections_generation += 1
+
+
+def _table_exists(cursor: sqlite3.Cursor, table_name: str) -> bool:
+    """Checks whether a table exists (the checkpointer creates its tables on first use)."""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,))
+    return cursor.fetchone() is not None
 
 
 def delete_conversation(thread_id: str) -> bool:
     """
     Deletes a conversation from its associated LangGraph checkpoint.
+    Removes both the checkpoints and their pending writes.
     """
     with get_db_connection() as conn:
 
         cursor = conn.cursor()
 
-        # Delete from LangGraph's checkpoints
+        if not _table_exists(cursor, "checkpoints"):
+            return False
+
+        # Delete from LangGraph's checkpoint writes and checkpoints
+        if _table_exists(cursor, "writes"):
+            cursor.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
         cursor.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
 
         rows_deleted = cursor.rowcount
         conn.commit()
 
-        return rows_deleted > 0
\ No newline at end of file
+        return rows_deleted > 0
+
+
+def prune_checkpoints(keep_last: int) -> dict:
+    """
+    Keeps only the latest 'keep_last' checkpoints of every thread (and checkpoint namespace).
+    Older checkpoints and their writes are deleted in a single transaction.
+
+    Returns the number of deleted checkpoints and writes.
+    """
+    if keep_last < 1:
+        raise ValueError("keep_last must be at least 1 to preserve the current state of each thread.")
+
+    with get_db_connection() as conn:
+
+        cursor = conn.cursor()
+
+        if not _table_exists(cursor, "checkpoints"):
+            return {"checkpoints_deleted": 0, "writes_deleted": 0}
+
+        writes_deleted = 0
+        if _table_exists(cursor, "writes"):
+            cursor.execute(
+                f"DELETE FROM writes WHERE (thread_id, checkpoint_ns, checkpoint_id) IN ({_STALE_CHECKPOINTS_QUERY})",
+                (keep_last,)
+            )
+            writes_deleted = cursor.rowcount
+
+        cursor.execute(
+            f"DELETE FROM checkpoints WHERE (thread_id, checkpoint_ns, checkpoint_id) IN ({_STALE_CHECKPOINTS_QUERY})",
+            (keep_last,)
+        )
+        checkpoints_deleted = cursor.rowcount
+        conn.commit()
+
+        return {"checkpoints_deleted": checkpoints_deleted, "writes_deleted": writes_deleted}
+
+
+def vacuum_database(full: bool = False) -> dict:
+    """
+    Reclaims free pages of the checkpoint database.
+
+    The first run switches the database to incremental auto-vacuum (which needs one full VACUUM).
+    Later runs release the free pages incrementally unless 'full' is set, which rebuilds the file.
+    The WAL file is truncated afterwards.
+
+    Returns the database file size before and after.
+    """
+    size_before = _database_size()
+
+    conn = get_db_connection()
+    auto_vacuum_mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if auto_vacuum_mode != 2:
+        # 2 = INCREMENTAL; the mode only takes effect after a full VACUUM
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        full = True
+
+    if full:
+        conn.execute("VACUUM")
+    else:
+        conn.execute("PRAGMA incremental_vacuum")
+        conn.commit()
+
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    return {"full_vacuum": full, "size_before": size_before, "size_after": _database_size()}
+
+
+def get_database_stats() -> dict:
+    """Returns the size of the checkpoint database and the number of stored threads, checkpoints and writes."""
+    with get_db_connection() as conn:
+
+        cursor = conn.cursor()
+        stats = {
+            "size_bytes": _database_size(),
+            "free_pages": cursor.execute("PRAGMA freelist_count").fetchone()[0],
+            "threads": 0,
+            "checkpoints": 0,
+            "writes": 0
+        }
+
+        if _table_exists(cursor, "checkpoints"):
+            stats["threads"] = cursor.execute("SELECT COUNT(DISTINCT thread_id) FROM checkpoints").fetchone()[0]
+            stats["checkpoints"] = cursor.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+        if _table_exists(cursor, "writes"):
+            stats["writes"] = cursor.execute("SELECT COUNT(*) FROM writes").fetchone()[0]
+
+        return stats
+
+
+def _database_size() -> int:
+    """Returns the size in bytes of the checkpoint database, including its WAL file."""
+    return sum(
+        os.path.getsize(path)
+        for path in (SQLITE_CHECKPOINT_PATH, SQLITE_CHECKPOINT_PATH + "-wal")
+        if os.path.exists(path)
+    )
@@ -0,0 +1,137 @@
+import sqlite3
+import threading
+import time
+from typing import Optional, Dict
+
+from .db_utils import get_db_connection
+from .state import Analyze
+from .text_utils import normalize_product_name
+
+
+class DecisionCache:
+    """
+    Persistent SQLite cache of 'Analyze' results.
+
+    Entries are keyed on (normalized product name, language, dataset version), so a change
+    of the mandatory list automatically stops old decisions from being served.
+    Entries older than 'ttl_seconds' are treated as misses, and the least recently used
+    entries are evicted once the cache holds more than 'max_entries' rows.
+    """
+
+    def __init__(self, db_path: str, ttl_seconds: float, max_entries: int):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._table_ready = False
+        self._lock = threading.Lock()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """Returns the calling thread's connection to the cache database, creating the table on first use."""
+        conn = get_db_connection(self.db_path)
+        if not self._table_ready:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS decision_cache (
+                    normalized_item TEXT NOT NULL,
+                    language TEXT NOT NULL,
+                    dataset_version TEXT NOT NULL,
+                    decision TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_accessed_at REAL NOT NULL,
+                    PRIMARY KEY (normalized_item, language, dataset_version)
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_decision_cache_last_accessed ON decision_cache (last_accessed_at)"
+            )
+            conn.commit()
+            self._table_ready = True
+        return conn
+
+    def get(self, item: str, language: str, dataset_version: str) -> Optional[Analyze]:
+        """
+        Returns the cached decision for the item, or None on a miss.
+        The returned decision carries the item name exactly as requested and the dataset version it was made against.
+        """
+        key = (normalize_product_name(item), language, dataset_version)
+        now = time.time()
+
+        with self._lock:
+            conn = self._get_connection()
+            row = conn.execute(
+                "SELECT decision, created_at FROM decision_cache "
+                "WHERE normalized_item = ? AND language = ? AND dataset_version = ?",
+                key
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            decision_json, created_at = row
+            if now - created_at > self.ttl_seconds:
+                # Expired entry: drop it and report a miss
+                conn.execute(
+                    "DELETE FROM decision_cache "
+                    "WHERE normalized_item = ? AND language = ? AND dataset_version = ?",
+                    key
+                )
+                conn.commit()
+                self.misses += 1
+                return None
+
+            conn.execute(
+                "UPDATE decision_cache SET last_accessed_at = ? "
+                "WHERE normalized_item = ? AND language = ? AND dataset_version = ?",
+                (now, *key)
+            )
+            conn.commit()
+            self.hits += 1
+
+        decision = Analyze.model_validate_json(decision_json)
+        decision.item = item
+        decision.dataset_version = dataset_version
+        return decision
+
+    def put(self, item: str, language: str, dataset_version: str, decision: Analyze) -> None:
+        """Stores a decision and evicts the least recently used entries beyond 'max_entries'."""
+        key = (normalize_product_name(item), language, dataset_version)
+        now = time.time()
+
+        with self._lock:
+            conn = self._get_connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO decision_cache "
+                "(normalized_item, language, dataset_version, decision, created_at, last_accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, decision.model_dump_json(), now, now)
+            )
+            conn.execute(
+                "DELETE FROM decision_cache WHERE rowid IN ("
+                "SELECT rowid FROM decision_cache ORDER BY last_accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            conn.commit()
+
+    def clear(self) -> int:
+        """Removes every cached decision and returns the number of deleted entries."""
+        with self._lock:
+            conn = self._get_connection()
+            cursor = conn.execute("DELETE FROM decision_cache")
+            conn.commit()
+            return cursor.rowcount
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the hit/miss counters of this process and the current number of entries."""
+        with self._lock:
+            entries = self._get_connection().execute("SELECT COUNT(*) FROM decision_cache").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries
+            }
@@ -0,0 +1,155 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from typing import Dict, List, Optional
+
+from .config import CHROMA_PATHS_BY_LANG, EMBEDDING_MODEL_NAME, EMBEDDING_ONNX_FILE, RETRIEVAL_K
+from .embeddings import EMBEDDING_BACKENDS, load_embeddings
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """Returns the peak resident memory of the current process in MB (None where it cannot be measured)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux and in bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _embed_with_backend(backend: str, onnx_file_name: Optional[str], titles: List[str], batch_size: int, repeats: int) -> Dict:
+    """Loads one backend and embeds the titles; runs in a fresh process so the RSS belongs to that backend alone."""
+    started = time.perf_counter()
+    embeddings, backend_used = load_embeddings(EMBEDDING_MODEL_NAME, backend, onnx_file_name)
+    load_seconds = time.perf_counter() - started
+
+    # Warm-up batch, not timed
+    embeddings.embed_documents(titles[:batch_size])
+
+    started = time.perf_counter()
+    for _ in range(repeats):
+        vectors = []
+        for start in range(0, len(titles), batch_size):
+            vectors.extend(embeddings.embed_documents(titles[start:start + batch_size]))
+    embed_seconds = (time.perf_counter() - started) / repeats
+
+    return {
+        "backend": backend,
+        "backend_used": backend_used,
+        "load_seconds": round(load_seconds, 2),
+        "items_per_second": round(len(titles) / embed_seconds, 1) if embed_seconds else None,
+        "peak_rss_mb": _peak_rss_mb(),
+        "vectors": vectors
+    }
+
+
+def _sample_titles(sample_size: int, seed: int) -> Dict[str, List[str]]:
+    """Samples commodity titles (the stored documents) from each language store."""
+    from langchain_chroma import Chroma
+
+    rng = random.Random(seed)
+    titles_by_lang = {}
+    for lang, path in CHROMA_PATHS_BY_LANG.items():
+        if not os.path.isfile(os.path.join(path, "chroma.sqlite3")):
+            raise FileNotFoundError(f"No ChromaDB store found in {path}")
+        documents = [doc for doc in Chroma(persist_directory=path).get(include=["documents"])["documents"] if doc]
+        titles_by_lang[lang] = rng.sample(documents, min(sample_size, len(documents)))
+    return titles_by_lang
+
+
+def _top_k_ids(lang: str, vectors: List[List[float]], k: int) -> List[List[str]]:
+    """Runs the same multi-query search as the retrieval node against a language store."""
+    from langchain_chroma import Chroma
+
+    collection = Chroma(persist_directory=CHROMA_PATHS_BY_LANG[lang])._collection
+    return collection.query(query_embeddings=vectors, n_results=k, include=[])["ids"]
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = (sum(x * x for x in a) * sum(y * y for y in b)) ** 0.5
+    return dot / norm if norm else 0.0
+
+
+def run_benchmark(backends: List[str], sample_size: int, k: int, batch_size: int, repeats: int, seed: int, onnx_file_name: Optional[str]) -> Dict:
+    """
+    Embeds a sample of commodity titles with each backend (each in its own process) and reports
+    throughput, load time and peak RSS per backend, and how closely the top-k retrieval over the
+    existing Chroma collections matches the first backend's.
+    """
+    titles_by_lang = _sample_titles(sample_size, seed)
+    titles = [title for lang_titles in titles_by_lang.values() for title in lang_titles]
+
+    results = {}
+    spawn_context = multiprocessing.get_context("spawn")
+    for backend in backends:
+        with spawn_context.Pool(1) as pool:
+            results[backend] = pool.apply(_embed_with_backend, (backend, onnx_file_name, titles, batch_size, repeats))
+
+    # Top-k ids per backend, per language
+    top_k = {}
+    for backend, result in results.items():
+        top_k[backend] = {}
+        offset = 0
+        for lang, lang_titles in titles_by_lang.items():
+            top_k[backend][lang] = _top_k_ids(lang, result["vectors"][offset:offset + len(lang_titles)], k)
+            offset += len(lang_titles)
+
+    reference = backends[0]
+    report = {
+        "model": EMBEDDING_MODEL_NAME,
+        "sample_sizes": {lang: len(lang_titles) for lang, lang_titles in titles_by_lang.items()},
+        "k": k,
+        "batch_size": batch_size,
+        "reference_backend": reference,
+        "backends": {}
+    }
+    for backend, result in results.items():
+        backend_report = {name: value for name, value in result.items() if name != "vectors"}
+        if backend != reference:
+            parity = {}
+            for lang in titles_by_lang:
+                pairs = list(zip(top_k[reference][lang], top_k[backend][lang]))
+                parity[lang] = {
+                    "top1_agreement": round(sum(ref[:1] == ids[:1] for ref, ids in pairs) / len(pairs), 4) if pairs else None,
+                    "same_top_k_rate": round(sum(set(ref) == set(ids) for ref, ids in pairs) / len(pairs), 4) if pairs else None,
+                    "mean_overlap_at_k": round(sum(len(set(ref) & set(ids)) / k for ref, ids in pairs) / len(pairs), 4) if pairs else None
+                }
+            backend_report["retrieval_parity"] = parity
+            backend_report["mean_cosine_to_reference"] = round(
+                sum(_cosine(a, b) for a, b in zip(results[reference]["vectors"], result["vectors"])) / len(titles), 6
+            ) if titles else None
+        report["backends"][backend] = backend_report
+    return report
+
+
+def main():
+    """Command-line entry point: python -m backend.embedding_benchmark [--backends torch onnx] [--sample N]"""
+    parser = argparse.ArgumentParser(description="Compare the embedding backends: retrieval parity, throughput and memory.")
+    parser.add_argument("--backends", nargs="+", choices=EMBEDDING_BACKENDS, default=list(EMBEDDING_BACKENDS),
+                        help="Backends to compare; the first one is the reference for the parity check.")
+    parser.add_argument("--onnx-file", default=EMBEDDING_ONNX_FILE, help="ONNX file of the model repository to load.")
+    parser.add_argument("--sample", type=int, default=200, help="Commodity titles sampled per language store.")
+    parser.add_argument("--k", type=int, default=RETRIEVAL_K, help="Top-k compared by the parity check.")
+    parser.add_argument("--batch-size", type=int, default=32, help="Titles embedded per call.")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed passes over the sample.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the title sample.")
+    parser.add_argument("--output", help="Also write the JSON report to this file.")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.backends, args.sample, args.k, args.batch_size, args.repeats, args.seed, args.onnx_file)
+
+    report_json = json.dumps(report, indent=2, ensure_ascii=False)
+    print(report_json)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(report_json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from .text_utils import normalize_embedding_text
+
+logger = logging.getLogger(__name__)
+
+# Supported embedding backends: full-precision PyTorch, or ONNX Runtime (int8 dynamically quantized by default)
+EMBEDDING_BACKENDS = ("torch", "onnx")
+
+
+def load_embeddings(model_name: str, backend: str = "torch", onnx_file_name: Optional[str] = None) -> Tuple[Embeddings, str]:
+    """
+    Loads the sentence-transformers model 'model_name' with the requested backend.
+
+    With 'onnx' the model runs through ONNX Runtime using 'onnx_file_name' from the model repository
+    (e.g. one of its int8 quantized exports). If the ONNX model cannot be loaded, the PyTorch backend is used instead.
+
+    Returns the embeddings and the backend actually in use.
+    """
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {EMBEDDING_BACKENDS}.")
+
+    if backend == "onnx":
+        model_kwargs = {"backend": "onnx"}
+        if onnx_file_name:
+            model_kwargs["model_kwargs"] = {"file_name": onnx_file_name}
+        try:
+            return HuggingFaceEmbeddings(model_name=model_name, model_kwargs=model_kwargs), "onnx"
+        except Exception:
+            logger.exception("Could not load the ONNX embedding model (%s); falling back to PyTorch", onnx_file_name or "default file")
+
+    return HuggingFaceEmbeddings(model_name=model_name), "torch"
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Bounded LRU cache of embeddings in front of another 'Embeddings'.
+
+    Texts are keyed (and embedded) after light normalization, repeated texts within a call are
+    embedded once, and only the misses are sent to the wrapped model in a single batch.
+    Query and document embeddings share the cache, which holds for symmetric models such as ours.
+
+    With 'persist_dir' the vectors live in a memory-mapped array on disk and survive restarts.
+    The key index is written by flush() (on shutdown and every 'flush_every' new entries), and
+    every slot also stores a hash of its key, so stale index entries are dropped on load.
+    A cache written for a different 'model_id' is discarded.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        max_entries: int,
+        persist_dir: Optional[str] = None,
+        model_id: str = "",
+        flush_every: int = 256
+    ):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.persist_dir = persist_dir
+        self.model_id = model_id
+        self.flush_every = flush_every
+        self.hits = 0
+        self.misses = 0
+
+        # key -> slot in the vector array, least recently used first
+        self._slots: "OrderedDict[str, int]" = OrderedDict()
+        self._free_slots: List[int] = []
+        self._vectors = None
+        self._key_hashes = None
+        self._unflushed = 0
+        self._lock = threading.Lock()
+
+        if persist_dir:
+            self._load()
+
+    # --- Embeddings interface ---
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [normalize_embedding_text(text) for text in texts]
+
+        with self._lock:
+            found = {}
+            for key in keys:
+                if key in found:
+                    continue
+                slot = self._slots.get(key)
+                if slot is not None:
+                    self._slots.move_to_end(key)
+                    found[key] = self._vectors[slot].tolist()
+            self.hits += sum(key in found for key in keys)
+            missing_keys = list(dict.fromkeys(key for key in keys if key not in found))
+            self.misses += len(keys) - sum(key in found for key in keys)
+
+        if missing_keys:
+            # Embed outside the lock so other threads keep being served from the cache
+            new_vectors = self.embeddings.embed_documents(missing_keys)
+            with self._lock:
+                for key, vector in zip(missing_keys, new_vectors):
+                    # Read back the stored (float32) vector so hits and misses return identical values
+                    slot = self._store(key, vector)
+                    found[key] = self._vectors[slot].tolist()
+                should_flush = self.persist_dir and self._unflushed >= self.flush_every
+            if should_flush:
+                self.flush()
+
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    # --- Cache management ---
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the hit/miss counters of this process and the current number of cached embeddings."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._slots),
+                "max_entries": self.max_entries,
+                "persistent": bool(self.persist_dir)
+            }
+
+    def flush(self) -> None:
+        """Writes the persisted vectors and the key index to disk (no-op without 'persist_dir')."""
+        if not self.persist_dir or self._vectors is None:
+            return
+        with self._lock:
+            self._vectors.flush()
+            self._key_hashes.flush()
+            index = {"model_id": self.model_id, "dimension": self._vectors.shape[1], "slots": dict(self._slots)}
+            self._unflushed = 0
+        index_path = os.path.join(self.persist_dir, "index.json")
+        with open(index_path + ".tmp", "w", encoding="utf-8") as index_file:
+            json.dump(index, index_file, ensure_ascii=False)
+        os.replace(index_path + ".tmp", index_path)
+
+    def _store(self, key: str, vector: List[float]) -> int:
+        """
+        Stores a vector, evicting the least recently used entry when the cache is full (lock held).
+        Returns the slot of the vector.
+        """
+        if self._vectors is None:
+            self._allocate(len(vector))
+        if key in self._slots:
+            # Another thread embedded the same text concurrently
+            slot = self._slots[key]
+            self._slots.move_to_end(key)
+        elif self._free_slots:
+            slot = self._free_slots.pop()
+        else:
+            _, slot = self._slots.popitem(last=False)
+        self._vectors[slot] = vector
+        self._key_hashes[slot] = _key_hash(key)
+        self._slots[key] = slot
+        self._unflushed += 1
+        return slot
+
+    def _allocate(self, dimension: int, mode: str = "w+") -> None:
+        """Creates the vector and key-hash arrays (memory-mapped when persisted)."""
+        if self.persist_dir:
+            os.makedirs(self.persist_dir, exist_ok=True)
+            self._vectors = np.memmap(
+                os.path.join(self.persist_dir, "vectors.f32"), dtype=np.float32, mode=mode, shape=(self.max_entries, dimension)
+            )
+            self._key_hashes = np.memmap(
+                os.path.join(self.persist_dir, "keys.i64"), dtype=np.int64, mode=mode, shape=(self.max_entries,)
+            )
+        else:
+            self._vectors = np.zeros((self.max_entries, dimension), dtype=np.float32)
+            self._key_hashes = np.zeros(self.max_entries, dtype=np.int64)
+        self._free_slots = list(range(self.max_entries - 1, -1, -1))
+
+    def _load(self) -> None:
+        """Reopens a persisted cache, keeping only the entries whose slot still holds their vector."""
+        index_path = os.path.join(self.persist_dir, "index.json")
+        if not os.path.isfile(index_path):
+            return
+        try:
+            with open(index_path, encoding="utf-8") as index_file:
+                index = json.load(index_file)
+            if index.get("model_id") != self.model_id:
+                logger.info("Discarding the embedding cache in %s (written for another model)", self.persist_dir)
+                return
+            self._allocate(index["dimension"], mode="r+")
+        except Exception:
+            logger.exception("Could not load the embedding cache from %s; starting empty", self.persist_dir)
+            self._vectors = self._key_hashes = None
+            return
+
+        used_slots = set()
+        for key, slot in index["slots"].items():
+            if 0 <= slot < self.max_entries and slot not in used_slots and self._key_hashes[slot] == _key_hash(key):
+                self._slots[key] = slot
+                used_slots.add(slot)
+        self._free_slots = [slot for slot in self._free_slots if slot not in used_slots]
+        logger.info("Loaded %d cached embeddings from %s", len(self._slots), self.persist_dir)
+
+
+def _key_hash(key: str) -> int:
+    """Stable 64-bit hash of a cache key, stored next to its vector."""
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
@@ -1,6 +1,6 @@
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.sqlite import SqliteSaver
-import sqlite3
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from .db_utils import get_async_db_connection
 from .nodes import (
     parse_input, 
     retrieve_documents_for_items, 
@@ -8,13 +8,15 @@ from .nodes import (
     prepare_final_output,
     AgentState
 )
+from .metrics import instrument_node
 
-# Define the path for the SQLite database for checkpointer
-SQLITE_CHECKPOINT_PATH = r"backend\db.sqlite"
-
-def create_agent_graph():
+async def create_agent_graph():
     """
     Creates and compiles the LangGraph agent workflow.
+    The nodes are async and the graph is checkpointed with an async SQLite checkpointer
+    on the shared connection from db_utils, so it must be run with ainvoke/astream.
+    Since that connection is bound to the event loop it was opened in, call this from
+    the loop that will run the graph.
 
     The graph defines the sequence of operations for processing product queries:
     1. Parse user input to extract product items.
@@ -28,11 +30,11 @@ def create_agent_graph():
     # Initialize the StateGraph with the defined AgentState
     graph = StateGraph(AgentState)
 
-    # Add nodes
-    graph.add_node("parse_input", parse_input)
-    graph.add_node("retrieve_documents", retrieve_documents_for_items)
-    graph.add_node("analyze_products", analyze_product_match)
-    graph.add_node("prepare_final_output", prepare_final_output)
+    # Add nodes (each one timed and error-counted by the metrics layer)
+    graph.add_node("parse_input", instrument_node("parse_input", parse_input))
+    graph.add_node("retrieve_documents", instrument_node("retrieve_documents", retrieve_documents_for_items))
+    graph.add_node("analyze_products", instrument_node("analyze_products", analyze_product_match))
+    graph.add_node("prepare_final_output", instrument_node("prepare_final_output", prepare_final_output))
 
     # Set the entry point
     graph.set_entry_point("parse_input")
@@ -43,12 +45,8 @@ def create_agent_graph():
     graph.add_edge("analyze_products", "prepare_final_output")
     graph.add_edge("prepare_final_output", END)
 
-    # Configure the checkpointer for state persistence
-    memory = SqliteSaver.from_conn_string(SQLITE_CHECKPOINT_PATH)
-
-    # Create connection and memory
-    sqlite_conn = sqlite3.connect(SQLITE_CHECKPOINT_PATH, check_same_thread=False)
-    memory = SqliteSaver(conn=sqlite_conn)
+    # Configure the async checkpointer for state persistence on the shared connection
+    memory = AsyncSqliteSaver(conn=await get_async_db_connection())
 
     # Compile the graph
     return graph.compile(checkpointer=memory)
@@ -0,0 +1,23 @@
+import json
+import os
+from typing import Any, Dict, Optional
+
+# Written by 'python -m backend.build_index' into every index directory it builds
+INDEX_MANIFEST_FILE = "index_manifest.json"
+
+
+def read_index_manifest(index_dir: str) -> Optional[Dict[str, Any]]:
+    """Returns the build manifest of an index directory, or None if it has none (e.g. built by the old notebook)."""
+    manifest_path = os.path.join(index_dir, INDEX_MANIFEST_FILE)
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path, encoding="utf-8") as manifest_file:
+        return json.load(manifest_file)
+
+
+def write_index_manifest(index_dir: str, manifest: Dict[str, Any]) -> None:
+    """Writes the build manifest of an index directory."""
+    manifest_path = os.path.join(index_dir, INDEX_MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, ensure_ascii=False)
+    os.replace(manifest_path + ".tmp", manifest_path)
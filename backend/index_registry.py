@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+from typing import Any, Dict, List, Optional
+
+from .index_manifest import read_index_manifest
+from .matcher import build_title_index
+
+logger = logging.getLogger(__name__)
+
+# Versioned index layout: INDEX_ROOT/<version name>/<store name>/, with INDEX_ROOT/CURRENT naming the active version.
+# Without a CURRENT file the fixed store paths (CHROMA_PATH_*) are used.
+INDEX_ROOT = os.getenv("INDEX_ROOT", os.path.join("backend", "indexes"))
+CURRENT_VERSION_FILE = "CURRENT"
+
+_VERSION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]*$")
+
+
+def _check_version_name(version_name: str) -> None:
+    """Rejects version names that are not a plain directory name inside INDEX_ROOT."""
+    if not _VERSION_NAME_PATTERN.match(version_name):
+        raise ValueError(f"Invalid index version name '{version_name}'")
+
+
+def read_current_index_version(index_root: str = INDEX_ROOT) -> Optional[str]:
+    """Returns the name of the published index version, or None if no version was published."""
+    current_path = os.path.join(index_root, CURRENT_VERSION_FILE)
+    if not os.path.isfile(current_path):
+        return None
+    with open(current_path, encoding="utf-8") as current_file:
+        return current_file.read().strip() or None
+
+
+def publish_index_version(version_name: str, index_root: str = INDEX_ROOT) -> None:
+    """Atomically makes 'version_name' the published index version (running servers pick it up)."""
+    _check_version_name(version_name)
+    if not os.path.isdir(os.path.join(index_root, version_name)):
+        raise FileNotFoundError(f"Index version '{version_name}' does not exist in {index_root}")
+    current_path = os.path.join(index_root, CURRENT_VERSION_FILE)
+    with open(current_path + ".tmp", "w", encoding="utf-8") as current_file:
+        current_file.write(version_name)
+    os.replace(current_path + ".tmp", current_path)
+
+
+def list_index_versions(index_root: str = INDEX_ROOT) -> List[str]:
+    """Returns the names of the index versions in 'index_root', oldest first."""
+    if not os.path.isdir(index_root):
+        return []
+    return sorted(
+        name for name in os.listdir(index_root)
+        if os.path.isdir(os.path.join(index_root, name)) and ".building" not in name
+    )
+
+
+def prune_index_versions(keep: int, index_root: str = INDEX_ROOT) -> List[str]:
+    """Deletes all but the newest 'keep' index versions (never the published one). Returns the deleted names."""
+    current = read_current_index_version(index_root)
+    versions = list_index_versions(index_root)
+    deleted = [name for name in versions[:max(len(versions) - keep, 0)] if name != current]
+    for name in deleted:
+        shutil.rmtree(os.path.join(index_root, name), ignore_errors=True)
+    return deleted
+
+
+def index_version_paths(version_name: str, store_names, index_root: str = INDEX_ROOT) -> Dict[str, str]:
+    """Returns the store directories of an index version."""
+    _check_version_name(version_name)
+    return {name: os.path.join(index_root, version_name, name) for name in store_names}
+
+
+class IndexSnapshot:
+    """
+    One loaded version of the vector indexes: its Chroma stores, their manifests, the dataset
+    version (fingerprint of their content) and, on first use, the commodity title index.
+
+    A snapshot never changes once loaded; a new index version is served by swapping in a new snapshot,
+    so requests that already hold the previous one finish against it.
+    """
+
+    def __init__(self, name: str, paths: Dict[str, str], embedding_function):
+        self.name = name
+        self.paths = paths
+        self.stores: Dict[str, Any] = {}
+        self.errors: Dict[str, str] = {}
+        self.manifests: Dict[str, Optional[Dict[str, Any]]] = {}
+        self.version: Optional[str] = None
+        self._title_index = None
+        self._title_index_lock = threading.Lock()
+
+        for store_name, path in paths.items():
+            self.stores[store_name] = self._open_store(store_name, path, embedding_function)
+            self.manifests[store_name] = self._read_manifest(store_name, path)
+        self.version = self._compute_version()
+
+    def _open_store(self, store_name: str, path: str, embedding_function):
+        """Opens a ChromaDB store; a store that fails to load is logged and left unavailable."""
+        from langchain_chroma import Chroma
+        try:
+            # Chroma would silently create an empty store in a missing directory
+            if not os.path.isfile(os.path.join(path, "chroma.sqlite3")):
+                raise FileNotFoundError(f"No ChromaDB store found in {path}")
+            return Chroma(persist_directory=path, embedding_function=embedding_function)
+        except Exception as e:
+            logger.exception("Could not load the '%s' vector store from %s", store_name, path)
+            self.errors[store_name] = str(e)
+            return None
+
+    def _read_manifest(self, store_name: str, path: str) -> Optional[Dict[str, Any]]:
+        try:
+            manifest = read_index_manifest(path)
+        except Exception:
+            logger.exception("Could not read the index manifest of the '%s' store in %s", store_name, path)
+            return None
+        if manifest is not None:
+            logger.info(
+                "Index '%s' (%s): version %s built at %s from %s (%s rows)",
+                store_name, self.name, manifest.get("version"), manifest.get("built_at"),
+                manifest.get("source"), manifest.get("rows")
+            )
+        else:
+            logger.info("Index '%s' (%s) has no build manifest; its version is computed from its content", store_name, self.name)
+        return manifest
+
+    def _compute_version(self) -> str:
+        # Stores built by 'backend.build_index' carry their content version in their manifest
+        if all(manifest and manifest.get("version") for manifest in self.manifests.values()):
+            return hashlib.sha256(
+                "|".join(f"{name}:{self.manifests[name]['version']}" for name in sorted(self.manifests)).encode("utf-8")
+            ).hexdigest()[:16]
+
+        digest = hashlib.sha256()
+        for name, vector_store in sorted(self.stores.items()):
+            digest.update(name.encode("utf-8"))
+            if vector_store is None:
+                continue
+            records = vector_store.get(include=["documents", "metadatas"])
+            rows = sorted(
+                json.dumps([content, metadata], sort_keys=True, ensure_ascii=False, default=str)
+                for content, metadata in zip(records["documents"], records["metadatas"])
+            )
+            for row in rows:
+                digest.update(row.encode("utf-8"))
+        return digest.hexdigest()[:16]
+
+    def get_title_index(self):
+        """Returns the commodity title index of this snapshot, built on first use."""
+        if self._title_index is None:
+            with self._title_index_lock:
+                if self._title_index is None:
+                    self._title_index = build_title_index(self.stores.values())
+        return self._title_index
+
+    def document_counts(self) -> Dict[str, Optional[int]]:
+        """Returns the number of documents of each store (None for unavailable stores)."""
+        counts = {}
+        for name, vector_store in self.stores.items():
+            counts[name] = None
+            if vector_store is not None:
+                try:
+                    counts[name] = vector_store._collection.count()
+                except Exception as e:
+                    logger.warning("Could not count the documents of the '%s' vector store: %s", name, e)
+        return counts
+
+    def close(self) -> None:
+        """Releases the Chroma clients of the snapshot (Client.close is only available in recent chromadb versions)."""
+        for vector_store in self.stores.values():
+            close_client = getattr(getattr(vector_store, "_client", None), "close", None)
+            if close_client is not None:
+                try:
+                    close_client()
+                except Exception:
+                    logger.warning("Could not close a Chroma client of index '%s'", self.name, exc_info=True)
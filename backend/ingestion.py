@@ -0,0 +1,193 @@
+import csv
+import io
+import os
+import tempfile
+from itertools import chain
+from typing import IO, Iterable, Iterator, List, Optional, Sequence
+
+from .input_parser import is_header
+
+# Uploads are spooled to a temporary file once they grow past this many bytes
+UPLOAD_SPOOL_MEMORY_BYTES = int(os.getenv("UPLOAD_SPOOL_MEMORY_BYTES", str(1024 * 1024)))
+# Largest accepted upload, and most product rows read from an upload sent with a chat message
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_MAX_ROWS = int(os.getenv("UPLOAD_MAX_ROWS", "5000"))
+
+SUPPORTED_UPLOAD_EXTENSIONS = (".xlsx", ".xls", ".csv", ".txt")
+
+# Rows inspected to find the product column of a sheet without a recognizable header
+_SAMPLE_ROWS = 50
+# Leading rows searched for a header row
+_HEADER_SEARCH_ROWS = 10
+# Words that mark a product column in longer headers (e.g. "Item Name", "Material Description"), by priority
+_HEADER_KEYWORDS = (
+    "product", "item", "description", "commodity", "material", "name",
+    "المنتج", "الصنف", "البند", "الوصف", "السلعة", "المادة", "اسم",
+)
+_HEADER_MAX_WORDS = 4
+
+_UPLOAD_CHUNK_BYTES = 64 * 1024
+
+
+class UploadLimitError(ValueError):
+    """Raised when an upload exceeds UPLOAD_MAX_BYTES or its row limit."""
+
+
+async def spool_upload(upload, max_bytes: int = UPLOAD_MAX_BYTES) -> IO[bytes]:
+    """
+    Copies an uploaded file chunk by chunk into a spooled temporary file (in memory while small,
+    on disk beyond UPLOAD_SPOOL_MEMORY_BYTES) and returns it rewound. The caller closes it.
+    Raises UploadLimitError once more than 'max_bytes' have been received.
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MEMORY_BYTES)
+    size = 0
+    try:
+        while chunk := await upload.read(_UPLOAD_CHUNK_BYTES):
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadLimitError(f"The file is larger than the {max_bytes // (1024 * 1024)} MB limit.")
+            spooled.write(chunk)
+    except BaseException:
+        spooled.close()
+        raise
+    spooled.seek(0)
+    return spooled
+
+
+def is_supported_upload(file_name: str) -> bool:
+    return file_name.lower().endswith(SUPPORTED_UPLOAD_EXTENSIONS)
+
+
+def iter_product_names(file: IO[bytes], file_name: str, max_rows: Optional[int] = None) -> Iterator[str]:
+    """
+    Yields the product names of an uploaded file one at a time, without loading the whole file:
+    .xlsx rows are read lazily (openpyxl read-only mode), .csv and .txt files line by line.
+    The product column is the one with a product header (e.g. 'Product', 'Item Name', 'الصنف'),
+    otherwise the column holding the most text in the first rows. Each line of a .txt file is one name.
+    Raises UploadLimitError after 'max_rows' names.
+    """
+    lower_name = file_name.lower()
+    if lower_name.endswith(".xlsx"):
+        names = _column_values(_xlsx_rows(file))
+    elif lower_name.endswith(".xls"):
+        names = _column_values(_xls_rows(file))
+    elif lower_name.endswith(".csv"):
+        names = _column_values(_csv_rows(file))
+    elif lower_name.endswith(".txt"):
+        names = _column_values([line] for line in _text_lines(file))
+    else:
+        raise ValueError(f"File type not supported for '{file_name}'")
+
+    for count, name in enumerate(names, start=1):
+        if max_rows is not None and count > max_rows:
+            raise UploadLimitError(f"The file lists more than {max_rows} products.")
+        yield name
+
+
+def _xlsx_rows(file: IO[bytes]) -> Iterator[Sequence]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _xls_rows(file: IO[bytes]) -> Iterator[Sequence]:
+    # The legacy binary format has no streaming reader; xlrd loads the sheet in one go
+    import xlrd
+
+    book = xlrd.open_workbook(file_contents=file.read(), on_demand=True)
+    try:
+        sheet = book.sheet_by_index(0)
+        for row_index in range(sheet.nrows):
+            yield sheet.row_values(row_index)
+    finally:
+        book.release_resources()
+
+
+def _text_lines(file: IO[bytes]) -> Iterator[str]:
+    """Decodes a UTF-8 (optionally BOM-prefixed) byte stream line by line."""
+    return io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+
+
+def _csv_rows(file: IO[bytes]) -> Iterator[List[str]]:
+    lines = _text_lines(file)
+    first_line = next(lines, "")
+    try:
+        dialect = csv.Sniffer().sniff(first_line, delimiters=",;\t|")
+    except csv.Error:
+        dialect = csv.excel
+    return csv.reader(chain([first_line], lines), dialect)
+
+
+def _cell_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _find_header_column(cells: Sequence[str], single_column: bool) -> Optional[int]:
+    """
+    Returns the product column of a header row: a known product header, otherwise (in multi-column sheets)
+    the short header containing the highest-priority product keyword. None if the row is not a header.
+    """
+    for column, value in enumerate(cells):
+        if value and is_header(value):
+            return column
+    if single_column:
+        return None
+    for keyword in _HEADER_KEYWORDS:
+        for column, value in enumerate(cells):
+            if 0 < len(value.split()) <= _HEADER_MAX_WORDS and keyword in value.casefold():
+                return column
+    return None
+
+
+def _text_score(values: Iterable[str]) -> int:
+    """Number of values that read like names (contain letters) rather than numbers or codes."""
+    return sum(1 for value in values if any(char.isalpha() for char in value))
+
+
+def _column_values(rows: Iterable[Sequence]) -> Iterator[str]:
+    """
+    Picks the product column from the first rows, then streams its non-empty values.
+    A header row, when recognized, is skipped.
+    """
+    rows = iter(rows)
+    sample = []
+    for row in rows:
+        cells = [_cell_text(value) for value in row]
+        if any(cells):
+            sample.append(cells)
+        if len(sample) >= _SAMPLE_ROWS:
+            break
+    if not sample:
+        return
+
+    width = max(len(cells) for cells in sample)
+    single_column = sum(1 for column in range(width) if any(column < len(cells) and cells[column] for cells in sample)) <= 1
+
+    def cell(cells: Sequence[str], column: int) -> str:
+        return cells[column] if column < len(cells) else ""
+
+    # Sheets often start with a title or a few notes above the header row
+    for header_row, cells in enumerate(sample[:1 if single_column else _HEADER_SEARCH_ROWS]):
+        header_column = _find_header_column(cells, single_column)
+        if header_column is not None:
+            product_column, first_row = header_column, header_row + 1
+            break
+    else:
+        product_column = max(range(width), key=lambda column: _text_score(cell(cells, column) for cells in sample))
+        first_row = 0
+
+    for cells in sample[first_row:]:
+        if cell(cells, product_column):
+            yield cell(cells, product_column)
+    for row in rows:
+        value = _cell_text(row[product_column]) if product_column < len(row) else ""
+        if value:
+            yield value
@@ -0,0 +1,111 @@
+import re
+from typing import List, Literal, Optional
+
+# Share of Arabic letters above which a product name is tagged 'ar'
+# (mixed names at or below the ratio default to 'en', like the LLM parser)
+ARABIC_SCRIPT_RATIO = 0.5
+
+# Lines longer than this are treated as prose rather than a product name
+MAX_ITEM_WORDS = 12
+MAX_ITEM_CHARS = 200
+
+# Column headers that commonly sit on top of a product list
+PRODUCT_HEADER_NAMES = {
+    "product", "products", "product name", "product names", "item", "items", "item name",
+    "name", "description", "commodity", "commodity title",
+    "المنتج", "المنتجات", "اسم المنتج", "الصنف", "الأصناف", "البند", "الوصف", "السلعة",
+}
+
+# Unicode blocks of the Arabic script
+_ARABIC_RANGES = (
+    ("\u0600", "\u06FF"),  # Arabic
+    ("\u0750", "\u077F"),  # Arabic Supplement
+    ("\u08A0", "\u08FF"),  # Arabic Extended-A
+    ("\uFB50", "\uFDFF"),  # Arabic Presentation Forms-A
+    ("\uFE70", "\uFEFF"),  # Arabic Presentation Forms-B
+)
+
+# Bullets and list numbering in front of an item ("- ", "* ", "• ", "1. ", "2) ")
+_LIST_MARKER = re.compile(r"^\s*(?:[-*\u2022\u00b7]|\d+[.)])\s+")
+
+# Text enclosed in double quotes, or in single quotes that are not apostrophes inside a word
+_QUOTED_ITEM = re.compile(
+    r"\"([^\"\n]+)\"|“([^”\n]+)”|«([^»\n]+)»|(?<![^\s,;(])'([^'\n]+)'(?![^\s,;.)])"
+)
+
+# What may remain between quoted items for the text to still count as a plain list
+_LIST_FILLER = re.compile(r"^(?:[\s,;.،؛]|\band\b|\bor\b|\bو\b|\bأو\b|\bاو\b)*$", re.IGNORECASE)
+
+
+def _is_arabic_char(char: str) -> bool:
+    return any(start <= char <= end for start, end in _ARABIC_RANGES)
+
+
+def detect_language(name: str) -> Literal["en", "ar"]:
+    """
+    Tags a product name as 'ar' or 'en' from the share of Arabic-script letters it contains.
+    Names without letters (e.g. model numbers) are tagged 'en'.
+    """
+    letters = [char for char in name if char.isalpha()]
+    if not letters:
+        return "en"
+    arabic_letters = sum(1 for char in letters if _is_arabic_char(char))
+    return "ar" if arabic_letters / len(letters) > ARABIC_SCRIPT_RATIO else "en"
+
+
+def _split_quoted(line: str) -> Optional[List[str]]:
+    """
+    Returns the quoted items of a line made only of quoted items and list filler
+    (e.g. '"steel pipes", "copper cables" and "valves"'), otherwise None.
+    """
+    quoted = [next(group for group in match.groups() if group) for match in _QUOTED_ITEM.finditer(line)]
+    if not quoted or not _LIST_FILLER.match(_QUOTED_ITEM.sub(" ", line)):
+        return None
+    return [item.strip() for item in quoted if item.strip()]
+
+
+def _looks_like_item(line: str) -> bool:
+    """Returns True if a line reads like a single product name rather than a sentence."""
+    return (
+        len(line) <= MAX_ITEM_CHARS
+        and len(line.split()) <= MAX_ITEM_WORDS
+        and not line.endswith(("?", "؟", ":"))
+    )
+
+
+def is_header(line: str) -> bool:
+    """Returns True if the line is a typical product-list column header."""
+    return line.strip().strip(":").casefold() in PRODUCT_HEADER_NAMES
+
+
+def split_product_list(text: str, from_file: bool = False) -> Optional[List[str]]:
+    """
+    Splits structured text into product names without calling the LLM.
+
+    Each non-empty line must be either a list of quoted items separated only by commas or
+    'and'/'or' (or their Arabic equivalents), or a single product name. An optional header
+    line (e.g. 'Product Name') is skipped. Chat messages only count as structured when every
+    bare line carries a bullet or list number, since plain short lines in a chat message are
+    often prose; uploaded files ('from_file') hold one product per line (the product column of the
+    upload), so each of their lines is kept as a product, however long its description.
+
+    Returns the product names in order, or None when the text needs the LLM parser.
+    """
+    lines = [line.strip() for line in (text or "").splitlines() if line.strip()]
+    if lines and is_header(lines[0]):
+        lines = lines[1:]
+
+    items: List[str] = []
+    for line in lines:
+        quoted_items = _split_quoted(line)
+        if quoted_items is not None:
+            items.extend(quoted_items)
+            continue
+
+        has_list_marker = bool(_LIST_MARKER.match(line))
+        line = _LIST_MARKER.sub("", line).strip()
+        if not from_file and not (has_list_marker and _looks_like_item(line)):
+            return None
+        items.append(line)
+
+    return items
@@ -0,0 +1,301 @@
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+from .metrics import record_llm_fallback, record_llm_deduplicated, record_llm_retry, record_llm_rate_limit_wait
+
+logger = logging.getLogger(__name__)
+
+# HTTP / RPC status codes worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+_RATE_LIMIT_ERROR_NAMES = {"ResourceExhausted", "TooManyRequests", "RateLimitError"}
+_TRANSIENT_ERROR_NAMES = {"ServiceUnavailable", "DeadlineExceeded", "InternalServerError", "APITimeoutError", "APIConnectionError"}
+# Only unambiguous markers: error texts may quote the model output (and so product names or numbers)
+_RATE_LIMIT_MARKERS = ("RESOURCE_EXHAUSTED", "Too Many Requests")
+
+
+def classify_llm_error(error: BaseException) -> Optional[str]:
+    """
+    Returns 'rate_limit' for quota errors (HTTP 429), 'transient' for timeouts, connection and 5xx errors,
+    or None for errors that a retry will not fix. The exception chain is inspected, since client
+    libraries wrap the errors of the underlying HTTP or gRPC call.
+    """
+    kind = None
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        status = getattr(error, "status_code", None) or getattr(error, "code", None)
+        name = type(error).__name__
+        if status == 429 or name in _RATE_LIMIT_ERROR_NAMES or any(marker in str(error) for marker in _RATE_LIMIT_MARKERS):
+            return "rate_limit"
+        if status in RETRYABLE_STATUS_CODES or name in _TRANSIENT_ERROR_NAMES or isinstance(error, (TimeoutError, ConnectionError)):
+            kind = "transient"
+        error = error.__cause__ or error.__context__
+    return kind
+
+
+class RateLimiter:
+    """
+    Token buckets for a requests-per-minute and a tokens-per-minute quota (0 disables a limit).
+
+    A reservation is taken from the buckets immediately, even when they run into debt, and the caller
+    waits the returned number of seconds before sending its request: callers are thus served in the
+    order they reserved, and the quota is never exceeded on average.
+    """
+
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def try_reserve(self, tokens: int, max_wait: Optional[float] = None) -> Optional[float]:
+        """
+        Reserves one request of 'tokens' tokens and returns the seconds to wait before sending it.
+        With 'max_wait', nothing is reserved (and None is returned) if the wait would be longer.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            requests_left = self._requests - 1
+            # A request larger than the whole per-minute quota waits for a full bucket, not forever
+            tokens_left = self._tokens - min(tokens, self.tokens_per_minute)
+
+            wait = 0.0
+            if self.requests_per_minute and requests_left < 0:
+                wait = max(wait, -requests_left * 60 / self.requests_per_minute)
+            if self.tokens_per_minute and tokens_left < 0:
+                wait = max(wait, -tokens_left * 60 / self.tokens_per_minute)
+            if max_wait is not None and wait > max_wait:
+                return None
+
+            if self.requests_per_minute:
+                self._requests = requests_left
+            if self.tokens_per_minute:
+                self._tokens = tokens_left
+            return wait
+
+    def reserve(self, tokens: int) -> float:
+        return self.try_reserve(tokens)
+
+
+def _prompt_text(prompt_input: Any) -> str:
+    """Serializes a chain input (prompt value, messages or text) for token estimates and deduplication keys."""
+    if hasattr(prompt_input, "to_messages"):
+        prompt_input = prompt_input.to_messages()
+    if isinstance(prompt_input, list):
+        return json.dumps([[getattr(message, "type", ""), getattr(message, "content", str(message))] for message in prompt_input],
+                          ensure_ascii=False, default=str)
+    return str(prompt_input)
+
+
+class _SharedCall:
+    """An async model call in flight and the number of callers waiting for its result."""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.callers = 0
+
+
+class LLMGateway(Runnable):
+    """
+    Shared entry point of every chat model call of the agent, used like the chat model itself
+    ('prompt | llm' and 'llm.with_structured_output(Schema)').
+
+    - Rate limiting: each call reserves its request and estimated tokens (prompt characters / 4 plus
+      'output_tokens_estimate') from the RateLimiter of its model before it is sent.
+    - Retries: rate-limit and transient errors are retried up to 'max_retries' times, with exponential
+      backoff ('backoff_base' doubling up to 'backoff_max' seconds) and random jitter.
+    - Deduplication: concurrent async calls with the same prompt and output schema share one model call;
+      the callers that joined it receive a copy of the result, and a caller that is cancelled does not
+      cancel the call for the others.
+    - Fallback: with a 'fallback_model', calls that would wait more than 'overflow_wait' seconds for the
+      primary quota, or that are still rate limited after their retries, go to the fallback model.
+    """
+
+    def __init__(
+        self,
+        model: Runnable,
+        fallback_model: Optional[Runnable] = None,
+        limiter: Optional[RateLimiter] = None,
+        fallback_limiter: Optional[RateLimiter] = None,
+        max_retries: int = 4,
+        backoff_base: float = 1.0,
+        backoff_max: float = 30.0,
+        overflow_wait: float = 5.0,
+        deduplicate: bool = True,
+        output_tokens_estimate: int = 500
+    ):
+        self.model = model
+        self.fallback_model = fallback_model
+        self.limiter = limiter or RateLimiter()
+        self.fallback_limiter = fallback_limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.overflow_wait = overflow_wait
+        self.deduplicate = deduplicate
+        self.output_tokens_estimate = output_tokens_estimate
+        # deduplication key -> call in flight
+        self._in_flight: Dict[Tuple[str, str], _SharedCall] = {}
+
+    # --- Runnable interface (plain chat calls) ---
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        return self._call(self.model, self.fallback_model, input, config)
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        return await self._acall("text", self.model, self.fallback_model, input, config)
+
+    def with_structured_output(self, schema, **kwargs) -> Runnable:
+        """Returns a runnable producing 'schema' instances through the gateway (and the fallback model, if any)."""
+        model = self.model.with_structured_output(schema, **kwargs)
+        fallback_model = self.fallback_model.with_structured_output(schema, **kwargs) if self.fallback_model is not None else None
+
+        def call(prompt_input, config: RunnableConfig):
+            return self._call(model, fallback_model, prompt_input, config)
+
+        async def acall(prompt_input, config: RunnableConfig):
+            return await self._acall(schema.__name__, model, fallback_model, prompt_input, config)
+
+        return RunnableLambda(call, afunc=acall, name=f"llm_gateway_{schema.__name__}")
+
+    # --- Call handling ---
+
+    def _backoff(self, attempt: int) -> float:
+        """Jittered exponential backoff: a random delay between half and all of base * 2^attempt (capped)."""
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _estimate_tokens(self, prompt_input: Any) -> int:
+        return len(_prompt_text(prompt_input)) // 4 + self.output_tokens_estimate
+
+    def _route(self, fallback_model: Optional[Runnable], tokens: int) -> Tuple[bool, float]:
+        """Reserves quota for a call; returns whether it goes to the fallback model and how long it must wait."""
+        if fallback_model is not None:
+            wait = self.limiter.try_reserve(tokens, self.overflow_wait)
+            if wait is None:
+                record_llm_fallback("overflow")
+                return True, self.fallback_limiter.reserve(tokens)
+            return False, wait
+        return False, self.limiter.reserve(tokens)
+
+    async def _acall(self, kind: str, model: Runnable, fallback_model: Optional[Runnable], prompt_input: Any, config) -> Any:
+        if not self.deduplicate:
+            return await self._acall_model(model, fallback_model, prompt_input, config)
+
+        key = (kind, hashlib.sha256(_prompt_text(prompt_input).encode("utf-8")).hexdigest())
+        loop = asyncio.get_running_loop()
+        shared = self._in_flight.get(key)
+        joined = shared is not None and shared.task.get_loop() is loop
+        if joined:
+            record_llm_deduplicated()
+        else:
+            # The model call runs in its own task, so a caller that is cancelled (timeout, client
+            # disconnect) leaves it running for the others; it is cancelled when its last caller leaves
+            shared = _SharedCall(loop.create_task(self._acall_model(model, fallback_model, prompt_input, config)))
+            self._in_flight[key] = shared
+            shared.task.add_done_callback(lambda task: self._release(key, shared))
+
+        shared.callers += 1
+        try:
+            result = await asyncio.shield(shared.task)
+        finally:
+            shared.callers -= 1
+            if not shared.callers and not shared.task.done():
+                self._release(key, shared)
+                shared.task.cancel()
+        # The callers that joined the call receive a copy of the result
+        return copy.deepcopy(result) if joined else result
+
+    def _release(self, key: Tuple[str, str], shared: "_SharedCall") -> None:
+        """Stops offering a call to new callers."""
+        if self._in_flight.get(key) is shared:
+            del self._in_flight[key]
+
+    async def _acall_model(self, model: Runnable, fallback_model: Optional[Runnable], prompt_input: Any, config) -> Any:
+        tokens = self._estimate_tokens(prompt_input)
+        use_fallback, wait = self._route(fallback_model, tokens)
+        if not use_fallback:
+            try:
+                return await self._ainvoke_with_retries(model, self.limiter, prompt_input, config, tokens, wait)
+            except Exception as e:
+                wait = self._fall_back_after(e, fallback_model, tokens)
+        return await self._ainvoke_with_retries(fallback_model, self.fallback_limiter, prompt_input, config, tokens, wait)
+
+    async def _ainvoke_with_retries(self, model: Runnable, limiter: RateLimiter, prompt_input: Any, config, tokens: int, wait: float) -> Any:
+        for attempt in range(self.max_retries + 1):
+            if wait > 0:
+                record_llm_rate_limit_wait(wait)
+                await asyncio.sleep(wait)
+            try:
+                return await model.ainvoke(prompt_input, config)
+            except Exception as e:
+                await asyncio.sleep(self._retry_delay(e, attempt))
+                wait = limiter.reserve(tokens)
+
+    def _call(self, model: Runnable, fallback_model: Optional[Runnable], prompt_input: Any, config) -> Any:
+        """Synchronous variant of _acall_model (no deduplication)."""
+        tokens = self._estimate_tokens(prompt_input)
+        use_fallback, wait = self._route(fallback_model, tokens)
+        if not use_fallback:
+            try:
+                return self._invoke_with_retries(model, self.limiter, prompt_input, config, tokens, wait)
+            except Exception as e:
+                wait = self._fall_back_after(e, fallback_model, tokens)
+        return self._invoke_with_retries(fallback_model, self.fallback_limiter, prompt_input, config, tokens, wait)
+
+    def _invoke_with_retries(self, model: Runnable, limiter: RateLimiter, prompt_input: Any, config, tokens: int, wait: float) -> Any:
+        for attempt in range(self.max_retries + 1):
+            if wait > 0:
+                record_llm_rate_limit_wait(wait)
+                time.sleep(wait)
+            try:
+                return model.invoke(prompt_input, config)
+            except Exception as e:
+                time.sleep(self._retry_delay(e, attempt))
+                wait = limiter.reserve(tokens)
+
+    # --- Retry and fallback decisions (shared by the sync and async paths) ---
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        """
+        Returns the backoff before retrying a call that failed on its 'attempt'-th try (counting from 0);
+        re-raises the error when it is not retryable or the retries are exhausted. Every retry then
+        reserves its quota again, since every attempt counts against it.
+        """
+        error_kind = classify_llm_error(error)
+        if attempt >= self.max_retries or error_kind is None:
+            raise error
+        delay = self._backoff(attempt)
+        logger.warning("LLM call failed (%s: %r); retry %d/%d in %.1fs", error_kind, error, attempt + 1, self.max_retries, delay)
+        record_llm_retry(error_kind)
+        return delay
+
+    def _fall_back_after(self, error: Exception, fallback_model: Optional[Runnable], tokens: int) -> float:
+        """
+        Sends a call that failed on the primary model to the fallback model if it is still rate limited,
+        and returns the wait reserved from the fallback quota; re-raises any other error.
+        """
+        if fallback_model is None or classify_llm_error(error) != "rate_limit":
+            raise error
+        logger.warning("LLM still rate limited after %d retries; using the fallback model", self.max_retries)
+        record_llm_fallback("rate_limit")
+        return self.fallback_limiter.reserve(tokens)
@@ -1,19 +1,122 @@
-from fastapi import FastAPI, Request, Form, File, UploadFile, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Request, Response, Depends, Form, File, UploadFile, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 import os
-from typing import Optional
-import pandas as pd
-from io import BytesIO
+import re
+import json
+import uuid
+import time
+import asyncio
+import logging
+from typing import List, Optional
+from urllib.parse import quote
+from contextlib import asynccontextmanager
 
 # Import your existing modules
 from .graph import create_agent_graph
 from .state import AgentState
-from langchain_core.messages import HumanMessage
-from .db_utils import delete_conversation
+from langchain_core.messages import HumanMessage, AIMessageChunk
+from .db_utils import (
+    delete_conversation,
+    close_db_connections,
+    prune_checkpoints,
+    vacuum_database,
+    get_database_stats,
+    CHECKPOINT_KEEP_LAST,
+    MAINTENANCE_INTERVAL
+)
+from .maintenance import run_periodic_maintenance
+from .config import (
+    decision_cache,
+    upload_store,
+    get_embedding_cache,
+    warm_up,
+    get_readiness,
+    get_index,
+    swap_index,
+    swap_to_published_index,
+    WARM_UP_ON_STARTUP,
+    INDEX_WATCH_INTERVAL,
+    BATCH_JOB_MAX_ITEMS
+)
+from .index_registry import list_index_versions, publish_index_version, read_current_index_version
+from .batch_jobs import batch_jobs, export_results, FINISHED_JOB_STATES
+from .ingestion import UPLOAD_MAX_ROWS, UploadLimitError, is_supported_upload, iter_product_names, spool_upload
+from .metrics import request_trace
 
-app = FastAPI()
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# The agent is created in the application lifespan, inside the event loop that runs it
+agent_app = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Create the agent on startup and close the database connections on shutdown.
+    The models and vector stores are loaded in the background (see /api/ready), so the server
+    accepts requests immediately. Also runs the periodic checkpoint maintenance, the watcher
+    of the published index version and the batch job workers in the background.
+    """
+    global agent_app
+    started = time.perf_counter()
+    agent_app = await create_agent_graph()
+    logger.info("Agent graph created in %.2fs", time.perf_counter() - started)
+
+    warm_up_task = None
+    if WARM_UP_ON_STARTUP:
+        warm_up_task = asyncio.create_task(asyncio.to_thread(warm_up))
+        warm_up_task.add_done_callback(_log_warm_up_failure)
+
+    maintenance_task = None
+    if MAINTENANCE_INTERVAL > 0:
+        maintenance_task = asyncio.create_task(run_periodic_maintenance(MAINTENANCE_INTERVAL))
+
+    index_watch_task = None
+    if INDEX_WATCH_INTERVAL > 0:
+        index_watch_task = asyncio.create_task(_watch_published_index(INDEX_WATCH_INTERVAL))
+
+    await batch_jobs.start()
+
+    yield
+
+    await batch_jobs.stop()
+
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+    if maintenance_task is not None:
+        maintenance_task.cancel()
+    if index_watch_task is not None:
+        index_watch_task.cancel()
+    embedding_cache = get_embedding_cache()
+    if embedding_cache is not None:
+        await asyncio.to_thread(embedding_cache.flush)
+    await close_db_connections()
+
+def _log_warm_up_failure(task: asyncio.Task):
+    """Logs an exception raised by the background warm-up (resources are then loaded on first use)."""
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Warm-up failed", exc_info=task.exception())
+
+async def _watch_published_index(interval_seconds: float):
+    """
+    Swaps in a newly published index version (see 'python -m backend.build_index --publish')
+    every 'interval_seconds', loading and warming it in a worker thread while requests keep being served.
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await asyncio.to_thread(swap_to_published_index)
+        except Exception:
+            logger.exception("Could not swap in the published index version")
+
+app = FastAPI(lifespan=lifespan)
 
 # Mount static files and templates
 app.mount("/static", StaticFiles(directory="frontend/static"), name="static")
@@ -22,28 +125,70 @@ templates = Jinja2Templates(directory="frontend/templates")
 # Create uploads directory if it doesn't exist (though not strictly used for saving here)
 os.makedirs("uploads", exist_ok=True)
 
-# Initialize the agent
-agent_app = create_agent_graph()
+# Each client session gets its own conversation thread, identified by a cookie
+# (or by the X-Session-ID header for API clients)
+SESSION_COOKIE_NAME = "session_id"
+SESSION_HEADER_NAME = "X-Session-ID"
+SESSION_COOKIE_MAX_AGE = 30 * 24 * 3600
+_SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+def _set_session_cookie(response: Response, session_id: str):
+    """Stores the session ID in the client's cookie."""
+    response.set_cookie(
+        SESSION_COOKIE_NAME,
+        session_id,
+        max_age=SESSION_COOKIE_MAX_AGE,
+        httponly=True,
+        samesite="lax"
+    )
+
+def get_session_id(request: Request, response: Response) -> str:
+    """
+    Returns the session ID of the request, taken from the X-Session-ID header or the session cookie.
+    A new session ID is generated when none (or an invalid one) is provided, and the cookie is refreshed.
+    """
+    session_id = request.headers.get(SESSION_HEADER_NAME) or request.cookies.get(SESSION_COOKIE_NAME)
+    if not session_id or not _SESSION_ID_PATTERN.match(session_id):
+        session_id = uuid.uuid4().hex
+    _set_session_cookie(response, session_id)
+    return session_id
 
-# Configuration for the agent
-invoke_config = {
-    "configurable": {
-        "thread_id": 1,
-        "recursion_limit": 50
+# Admin endpoints require this token in the X-Admin-Token header (they are disabled when it is not set)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+def require_admin(request: Request):
+    """Rejects requests to admin endpoints that do not carry the configured admin token."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN is not set).")
+    if request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+def get_invoke_config(session_id: str) -> dict:
+    """Configuration for the agent: one LangGraph thread per session."""
+    return {
+        "configurable": {
+            "thread_id": session_id,
+            "recursion_limit": 50
+        }
     }
-}
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     """Serve the main chat interface"""
     return templates.TemplateResponse("index.html", {"request": request})
 
+@app.get("/api/ready")
+async def readiness():
+    """Readiness probe: reports which models and vector stores are loaded (503 until all are)."""
+    readiness_report = await run_in_threadpool(get_readiness)
+    return JSONResponse(readiness_report, status_code=200 if readiness_report["ready"] else 503)
+
 @app.get("/api/history")
-async def get_chat_history():
-    """Get chat history from the agent"""
+async def get_chat_history(session_id: str = Depends(get_session_id)):
+    """Get the chat history of the current session from the agent"""
     try:
         # Get the current state/history
-        history = agent_app.get_state(invoke_config)
+        history = await agent_app.aget_state(get_invoke_config(session_id))
 
         # Check if there are messages in history
         if not history or not history.values:
@@ -72,93 +217,298 @@ async def get_chat_history():
                 })
 
         return {"messages": formatted_messages}
-    except Exception as e:
+    except Exception:
+        logger.exception("Could not load the chat history")
         return {"messages": []}
 
-@app.post("/api/send_message")
-async def send_message(message: str = Form(...), file: Optional[UploadFile] = File(None)):
-    """Process user message and file upload, storing file content in additional_kwargs."""
-    try:
-        user_input_message = message.strip() # This is the text from the input bar
-        
-        additional_kwargs = {}
-        file_processing_note = ""
+def _read_upload_products(spooled_file, file_name: str) -> str:
+    """Reads the product names of an uploaded file (see ingestion.iter_product_names), one per line."""
+    return "\n".join(iter_product_names(spooled_file, file_name, UPLOAD_MAX_ROWS))
 
-        if file:
-            file_name = file.filename if file.filename else "uploaded file"
-            additional_kwargs["file_name"] = file_name
-            
-            try:
-                file_content = await file.read()
-                
-                # Determine file type and process accordingly
-                if file_name.lower().endswith('.txt'):
-                    # Handle text files
-                    file_text = file_content.decode('utf-8')
-                    additional_kwargs["file_content"] = file_text
-                    
-                elif file_name.lower().endswith(('.xlsx', '.xls')):
-
-                    # Read Excel file into DataFrame
-                    df = pd.read_excel(BytesIO(file_content))
-                    
-                    # Convert DataFrame to readable text format
-                    file_text = df.to_string(index=False)  # or df.to_csv(index=False)
-                    additional_kwargs["file_content"] = file_text
-                    
-                else:
-                    file_processing_note = f"[Note: File type not supported for '{file_name}']"
-                    additional_kwargs["file_content"] = file_processing_note
-                
-            except Exception as file_read_e:
-                file_processing_note = f"[Note: Error reading uploaded file '{file_name}']"
-                additional_kwargs["file_content"] = file_processing_note
+async def _prepare_agent_input(message: str, file: Optional[UploadFile]):
+    """
+    Builds the agent input state from the user message and optional file upload,
+    storing the file content in the upload store and its reference in additional_kwargs.
 
-        # If only a file was uploaded and no message, or if message is empty and file failed processing
-        if not user_input_message and not additional_kwargs.get("file_content"):
-            raise HTTPException(status_code=400, detail="Cannot send empty message or unreadable file.")
+    Returns the input state, the user message to display (with any file processing note)
+    and the file info for the frontend.
+    """
+    user_input_message = message.strip() # This is the text from the input bar
+    
+    additional_kwargs = {}
+    file_processing_note = ""
+    file_content = None
+
+    if file:
+        file_name = file.filename if file.filename else "uploaded file"
+        additional_kwargs["file_name"] = file_name
         
-        # Create the HumanMessage with content only from the input bar, and file details in kwargs
-        current_state: AgentState = {
-            "messages": HumanMessage(content=user_input_message, additional_kwargs=additional_kwargs),
-            "product_items": [],
-            "items_retrieved_docs": {},
-            "items_decisions": {}
-        }
+        try:
+            if is_supported_upload(file_name):
+                # Stream the upload to a spooled file and read its product column in a worker thread,
+                # so large files neither sit in memory whole nor block the event loop
+                spooled_file = await spool_upload(file)
+                try:
+                    file_content = await run_in_threadpool(_read_upload_products, spooled_file, file_name)
+                finally:
+                    spooled_file.close()
+                # The message only references the content, so it is not serialized into every checkpoint
+                if file_content:
+                    additional_kwargs["file_ref"] = await run_in_threadpool(upload_store.put, file_content)
+            else:
+                file_processing_note = f"[Note: File type not supported for '{file_name}']"
+                additional_kwargs["file_note"] = file_processing_note
+
+        except UploadLimitError as limit_error:
+            raise HTTPException(status_code=413, detail=f"'{file_name}': {limit_error}")
+        except Exception as file_read_e:
+            file_processing_note = f"[Note: Error reading uploaded file '{file_name}']"
+            additional_kwargs["file_note"] = file_processing_note
+
+    # If only a file was uploaded and no message, or if message is empty and file failed processing
+    if not user_input_message and not file_content:
+        raise HTTPException(status_code=400, detail="Cannot send empty message or unreadable file.")
+    
+    # Create the HumanMessage with content only from the input bar, and file details in kwargs
+    current_state: AgentState = {
+        "messages": HumanMessage(content=user_input_message, additional_kwargs=additional_kwargs),
+        "product_items": [],
+        "items_retrieved_docs": {},
+        "items_decisions": {}
+    }
+
+    # The user_message returned to the frontend will only be the text from the input bar
+    # plus any file processing notes for immediate feedback to the user if needed.
+    display_user_message = user_input_message
+    if file_processing_note:
+        if display_user_message:
+            display_user_message = f"{display_user_message}\n\n{file_processing_note}"
+        else:
+            display_user_message = file_processing_note
+
+    file_info = {"file_name": additional_kwargs.get("file_name")} if "file_name" in additional_kwargs else None
+
+    return current_state, display_user_message, file_info
+
+@app.post("/api/send_message")
+async def send_message(
+    message: str = Form(...),
+    file: Optional[UploadFile] = File(None),
+    trace: bool = False,
+    session_id: str = Depends(get_session_id)
+):
+    """
+    Process user message and file upload; the file content goes to the upload store and additional_kwargs references it.
+    With ?trace=true the response also holds the request's per-node timings, LLM usage and decision sources.
+    """
+    try:
+        current_state, display_user_message, file_info = await _prepare_agent_input(message, file)
         
         # Process with the agent
-        final_state = agent_app.invoke(current_state, config=invoke_config)
+        with request_trace(trace) as request_metrics:
+            final_state = await agent_app.ainvoke(current_state, config=get_invoke_config(session_id))
         
         # Get the AI response
         ai_response = final_state['messages'][-1].content
-        
-        # The user_message returned to the frontend will only be the text from the input bar
-        # plus any file processing notes for immediate feedback to the user if needed.
-        display_user_message = user_input_message
-        if file_processing_note:
-            if display_user_message:
-                display_user_message = f"{display_user_message}\n\n{file_processing_note}"
-            else:
-                display_user_message = file_processing_note
 
-        return {
+        response = {
             "success": True,
             "user_message": display_user_message,
             "ai_response": ai_response,
-            "file_info": {"file_name": additional_kwargs.get("file_name")} if "file_name" in additional_kwargs else None
+            "file_info": file_info
         }
+        if request_metrics is not None:
+            response["trace"] = request_metrics.as_dict()
+        return response
         
     except HTTPException as http_e:
         raise http_e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
 
+def _sse_event(event: str, data: dict) -> str:
+    """Formats a Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/api/send_message/stream")
+async def send_message_stream(
+    message: str = Form(...),
+    file: Optional[UploadFile] = File(None),
+    trace: bool = False,
+    session_id: str = Depends(get_session_id)
+):
+    """
+    Streaming variant of /api/send_message, answering with Server-Sent Events:
+    - 'start': the user message to display and the file info;
+    - 'items': the parsed product items and their languages;
+    - 'decision': one 'Analyze' result per product, as soon as it is ready;
+    - 'token': chunks of the final answer while it is being generated;
+    - 'final': the complete final answer;
+    - 'error': the processing error, if any;
+    - 'trace': with ?trace=true, the request's per-node timings, LLM usage and decision sources (last event).
+    """
+    current_state, display_user_message, file_info = await _prepare_agent_input(message, file)
+
+    async def event_stream():
+        yield _sse_event("start", {"user_message": display_user_message, "file_info": file_info})
+        with request_trace(trace) as request_metrics:
+            try:
+                async for mode, chunk in agent_app.astream(
+                    current_state,
+                    config=get_invoke_config(session_id),
+                    stream_mode=["updates", "custom", "messages"]
+                ):
+                    if mode == "custom":
+                        yield _sse_event(chunk["event"], chunk)
+
+                    elif mode == "messages":
+                        # Only the final answer is streamed token by token
+                        # (the complete message emitted when the node finishes is sent as 'final')
+                        message_chunk, metadata = chunk
+                        if (
+                            metadata.get("langgraph_node") == "prepare_final_output"
+                            and isinstance(message_chunk, AIMessageChunk)
+                            and isinstance(message_chunk.content, str)
+                            and message_chunk.content
+                        ):
+                            yield _sse_event("token", {"content": message_chunk.content})
+
+                    elif mode == "updates":
+                        parsed = chunk.get("parse_input")
+                        if parsed is not None:
+                            items = [{"item": item, "language": lang} for item, lang in parsed.get("product_items", {}).items()]
+                            yield _sse_event("items", {"items": items})
+
+                        final_output = chunk.get("prepare_final_output")
+                        if final_output is not None:
+                            yield _sse_event("final", {"ai_response": final_output["messages"][-1].content})
+
+            except Exception as e:
+                yield _sse_event("error", {"detail": f"Error processing message: {str(e)}"})
+
+        if request_metrics is not None:
+            yield _sse_event("trace", request_metrics.as_dict())
+
+    streaming_response = StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # Returned responses do not inherit the cookies set on the dependency's response
+    _set_session_cookie(streaming_response, session_id)
+    return streaming_response
+
+def _get_session_job(job_id: str, session_id: str) -> dict:
+    """Returns the batch job if it belongs to the session, otherwise raises a 404."""
+    job = batch_jobs.store.get(job_id)
+    if job is None or job["session_id"] != session_id:
+        raise HTTPException(status_code=404, detail="Batch job not found.")
+    return job
+
+@app.post("/api/jobs", status_code=202)
+async def submit_batch_job(file: UploadFile = File(...), session_id: str = Depends(get_session_id)):
+    """
+    Submit a spreadsheet (or text/CSV file) of products for background analysis.
+    Returns the job; follow it with GET /api/jobs/{job_id} or /api/jobs/{job_id}/events.
+    """
+    file_name = file.filename or "uploaded file"
+    if not is_supported_upload(file_name):
+        raise HTTPException(status_code=400, detail=f"File type not supported for '{file_name}'.")
+
+    # The product names are streamed from the spooled upload straight into the job's rows
+    try:
+        spooled_file = await spool_upload(file)
+        try:
+            job = await batch_jobs.submit(session_id, file_name, iter_product_names(spooled_file, file_name, BATCH_JOB_MAX_ITEMS))
+        finally:
+            spooled_file.close()
+    except UploadLimitError as e:
+        raise HTTPException(status_code=413, detail=f"'{file_name}': {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error reading uploaded file '{file_name}': {str(e)}")
+    return {key: value for key, value in job.items() if key != "session_id"}
+
+@app.get("/api/jobs/{job_id}")
+async def get_batch_job(job_id: str, session_id: str = Depends(get_session_id)):
+    """Get the status and progress of a batch job."""
+    job = await run_in_threadpool(_get_session_job, job_id, session_id)
+    return {key: value for key, value in job.items() if key != "session_id"}
+
+@app.get("/api/jobs/{job_id}/events")
+async def batch_job_events(job_id: str, session_id: str = Depends(get_session_id)):
+    """
+    Follow a batch job with Server-Sent Events: a 'progress' event with the job's status
+    whenever a chunk of products is done, and a final 'completed' or 'failed' event.
+    """
+    await run_in_threadpool(_get_session_job, job_id, session_id)
+
+    async def event_stream():
+        while True:
+            update = batch_jobs.update_event(job_id)
+            job = await run_in_threadpool(_get_session_job, job_id, session_id)
+            job.pop("session_id")
+            if job["status"] in FINISHED_JOB_STATES:
+                yield _sse_event(job["status"], job)
+                return
+            yield _sse_event("progress", job)
+            try:
+                await asyncio.wait_for(update.wait(), timeout=15)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+
+    streaming_response = StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    _set_session_cookie(streaming_response, session_id)
+    return streaming_response
+
+@app.get("/api/jobs/{job_id}/results")
+async def download_batch_job_results(job_id: str, format: str = "xlsx", session_id: str = Depends(get_session_id)):
+    """Download the decisions of a completed batch job as .xlsx or .csv (Product, Language, Listed, Content_Certificate, reasoning)."""
+    job = await run_in_threadpool(_get_session_job, job_id, session_id)
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Batch job is {job['status']} ({job['processed']}/{job['total']} products).")
+    if format not in ("xlsx", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'xlsx' or 'csv'.")
+
+    results = await run_in_threadpool(batch_jobs.store.results, job_id)
+    content = await run_in_threadpool(export_results, results, format)
+    media_type = (
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" if format == "xlsx" else "text/csv; charset=utf-8"
+    )
+    download_name = f"{os.path.splitext(job['file_name'] or 'products')[0]}_results.{format}"
+    response = Response(content=content, media_type=media_type)
+    response.headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{quote(download_name)}"
+    _set_session_cookie(response, session_id)
+    return response
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics of this worker process: node latencies, items per request, embedding and Chroma times, LLM tokens, cache lookups and errors."""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/api/admin/cache/stats", dependencies=[Depends(require_admin)])
+async def get_cache_stats():
+    """Get hit/miss counters and size of the analysis decision cache"""
+    return await asyncio.to_thread(decision_cache.stats)
+
+@app.get("/api/admin/cache/embeddings/stats", dependencies=[Depends(require_admin)])
+async def get_embedding_cache_stats():
+    """Get hit/miss counters and size of the query embedding cache"""
+    embedding_cache = get_embedding_cache()
+    if embedding_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **embedding_cache.stats()}
+
 @app.post("/api/clear_history")
-async def clear_history():
-    """Clear chat history from the database."""
+async def clear_history(session_id: str = Depends(get_session_id)):
+    """Clear the chat history of the current session from the database."""
     try:
-        thread_id_to_clear = str(invoke_config['configurable']['thread_id'])
-        deleted = delete_conversation(thread_id_to_clear)
+        thread_id_to_clear = session_id
+        deleted = await run_in_threadpool(delete_conversation, thread_id_to_clear)
         if deleted:
             return {"success": True, "message": f"History for thread_id {thread_id_to_clear} cleared successfully."}
         else:
@@ -166,4 +516,48 @@ async def clear_history():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error clearing history: {str(e)}")
 
+@app.get("/api/admin/maintenance/stats", dependencies=[Depends(require_admin)])
+async def maintenance_stats():
+    """Get the size and row counts of the checkpoint database."""
+    return await run_in_threadpool(get_database_stats)
+
+@app.post("/api/admin/maintenance/prune", dependencies=[Depends(require_admin)])
+async def maintenance_prune(keep_last: int = CHECKPOINT_KEEP_LAST):
+    """Keep only the latest checkpoints of every thread."""
+    try:
+        return await run_in_threadpool(prune_checkpoints, keep_last)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/api/admin/maintenance/vacuum", dependencies=[Depends(require_admin)])
+async def maintenance_vacuum(full: bool = False):
+    """Reclaim free space in the checkpoint database."""
+    return await run_in_threadpool(vacuum_database, full)
+
+@app.get("/api/admin/index", dependencies=[Depends(require_admin)])
+async def index_status():
+    """Get the served, published and available index versions."""
+    index = await run_in_threadpool(get_index)
+    return {
+        "serving": index.name,
+        "dataset_version": index.version,
+        "published": read_current_index_version(),
+        "versions": list_index_versions()
+    }
 
+@app.post("/api/admin/index/swap", dependencies=[Depends(require_admin)])
+async def index_swap(version: Optional[str] = None):
+    """
+    Publish an index version (when given) and swap this worker to it without dropping in-flight requests.
+    Without a version, the published one is reloaded. Other workers follow the published version on their next check.
+    """
+    try:
+        if version:
+            await run_in_threadpool(publish_index_version, version)
+        return await run_in_threadpool(swap_index, version)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
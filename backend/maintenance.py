@@ -0,0 +1,66 @@
+import argparse
+import asyncio
+import json
+import logging
+
+from .config import UPLOAD_RETENTION, upload_store
+from .db_utils import CHECKPOINT_KEEP_LAST, prune_checkpoints, vacuum_database, get_database_stats
+
+logger = logging.getLogger(__name__)
+
+
+def run_maintenance(keep_last: int = CHECKPOINT_KEEP_LAST, full_vacuum: bool = False) -> dict:
+    """Prunes old checkpoints of every thread and expired uploads, then reclaims the freed space."""
+    pruned = prune_checkpoints(keep_last)
+    pruned["uploads_deleted"] = upload_store.prune(UPLOAD_RETENTION)
+    vacuumed = vacuum_database(full=full_vacuum)
+    return {**pruned, **vacuumed}
+
+
+async def run_periodic_maintenance(interval_seconds: float, keep_last: int = CHECKPOINT_KEEP_LAST):
+    """
+    Runs the checkpoint maintenance every 'interval_seconds' in a worker thread.
+    Meant to be started as a background task for the lifetime of the application.
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            result = await asyncio.to_thread(run_maintenance, keep_last)
+            logger.info("Checkpoint maintenance finished: %s", result)
+        except Exception:
+            logger.exception("Checkpoint maintenance failed")
+
+
+def main():
+    """Command-line entry point: python -m backend.maintenance {prune,vacuum,stats,run}"""
+    parser = argparse.ArgumentParser(description="Housekeeping for the LangGraph checkpoint database.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    prune_parser = subparsers.add_parser("prune", help="Keep only the latest checkpoints of every thread.")
+    prune_parser.add_argument("--keep", type=int, default=CHECKPOINT_KEEP_LAST, help="Checkpoints to keep per thread.")
+
+    vacuum_parser = subparsers.add_parser("vacuum", help="Reclaim free space in the database file.")
+    vacuum_parser.add_argument("--full", action="store_true", help="Rebuild the whole file instead of an incremental vacuum.")
+
+    subparsers.add_parser("stats", help="Show database size and row counts.")
+
+    run_parser = subparsers.add_parser("run", help="Prune, then vacuum.")
+    run_parser.add_argument("--keep", type=int, default=CHECKPOINT_KEEP_LAST, help="Checkpoints to keep per thread.")
+    run_parser.add_argument("--full", action="store_true", help="Rebuild the whole file instead of an incremental vacuum.")
+
+    args = parser.parse_args()
+
+    if args.command == "prune":
+        result = prune_checkpoints(args.keep)
+    elif args.command == "vacuum":
+        result = vacuum_database(full=args.full)
+    elif args.command == "stats":
+        result = get_database_stats()
+    else:
+        result = run_maintenance(args.keep, full_vacuum=args.full)
+
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
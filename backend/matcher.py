@@ -0,0 +1,179 @@
+import re
+from collections import Counter
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple, Any
+
+from .state import Analyze
+from .text_utils import normalize_product_name
+
+# Metadata field holding the certificate requirement of a mandatory-list row
+# (the per-language stores use the full bilingual column header, which ends with this name)
+BASELINE_FIELD = "Manufacturer Local Content Minimum Baseline"
+
+# Metadata fields holding the commodity titles of a row in the unified bilingual index
+TITLE_FIELDS = ("Commodity Title (English)", "Commodity Title (Arabic)")
+
+# Baseline values that explicitly state there is no certificate requirement
+# (checked first, since they contain the requirement markers; the workbook spells both 'لا يشترط' and 'لايشترط')
+_NO_REQUIREMENT_MARKERS = ("لا يوجد", "لايوجد", "لا يشترط", "لايشترط", "not required", "no")
+# Baseline values that explicitly state a certificate requirement
+_REQUIREMENT_MARKERS = ("يشترط", "نعم", "required", "yes")
+
+# Number of trigram-ranked candidates that get a full similarity score
+_FUZZY_CANDIDATES = 20
+
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)?")
+_PERCENTAGE = re.compile(r"(\d+(?:[.,]\d+)?)\s*[%٪]")
+
+
+def baseline_requires_certificate(value: Any) -> Optional[bool]:
+    """
+    Maps a 'Manufacturer Local Content Minimum Baseline' value to a certificate requirement.
+
+    Returns True for explicit requirements (e.g. 'يشترط', 'Yes', '30%' or a bare percentage
+    number), False for empty values, zero percentages or explicit non-requirements
+    (e.g. 'لا يوجد', 'لايشترط', 'No'), and None when the value does not follow any known pattern.
+    """
+    if value is None or (isinstance(value, float) and value != value):
+        return False
+    if isinstance(value, (int, float)):
+        return value > 0
+
+    # Collapse every run of whitespace (including non-breaking spaces) to a single space
+    text = " ".join(str(value).casefold().split())
+    if not text or text in ("nan", "none", "null", "-"):
+        return False
+    if any(text == marker or text.startswith(marker + " ") or (len(marker) > 2 and marker in text)
+           for marker in _NO_REQUIREMENT_MARKERS):
+        return False
+    percentages = _PERCENTAGE.findall(text)
+    if percentages:
+        return any(float(percentage.replace(",", ".")) > 0 for percentage in percentages)
+    if any(marker in text for marker in _REQUIREMENT_MARKERS):
+        return True
+    try:
+        return float(text) > 0
+    except ValueError:
+        return None
+
+
+def get_baseline(metadata: Dict[str, Any]) -> Any:
+    """Returns the 'Manufacturer Local Content Minimum Baseline' value of a row's metadata, or None."""
+    if BASELINE_FIELD in metadata:
+        return metadata[BASELINE_FIELD]
+    for field, value in metadata.items():
+        if field.endswith(BASELINE_FIELD):
+            return value
+    return None
+
+
+def _trigrams(text: str) -> List[str]:
+    """Returns the character trigrams of a normalized string, padded at the edges."""
+    padded = f"  {text} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+class CommodityTitleIndex:
+    """
+    In-memory index of the normalized commodity titles of the mandatory list.
+
+    Supports exact lookups on the normalized title and fuzzy lookups that rank candidates
+    by shared character trigrams and score them with an edit-distance based ratio.
+    """
+
+    def __init__(self, entries: List[Tuple[str, Dict[str, Any]]]):
+        # normalized title -> (original title, metadata)
+        self._titles: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        # trigram -> normalized titles containing it
+        self._trigram_index: Dict[str, List[str]] = {}
+
+        for title, metadata in entries:
+            normalized = normalize_product_name(title)
+            if not normalized or normalized in self._titles:
+                continue
+            self._titles[normalized] = (title, metadata or {})
+            for trigram in set(_trigrams(normalized)):
+                self._trigram_index.setdefault(trigram, []).append(normalized)
+
+    def __len__(self) -> int:
+        return len(self._titles)
+
+    def lookup(self, item: str) -> Optional[Tuple[str, Dict[str, Any], float]]:
+        """
+        Finds the closest commodity title for the item.
+        Returns (title, metadata, similarity) with similarity in [0, 1], or None if nothing is close.
+        """
+        normalized = normalize_product_name(item)
+        if not normalized:
+            return None
+
+        exact = self._titles.get(normalized)
+        if exact is not None:
+            return exact[0], exact[1], 1.0
+
+        # Rank candidates by the number of shared trigrams, then score the best ones
+        shared = Counter()
+        for trigram in set(_trigrams(normalized)):
+            for candidate in self._trigram_index.get(trigram, ()):
+                shared[candidate] += 1
+
+        # Sizes, ratings and model numbers must agree exactly for a fuzzy match
+        numbers = _NUMBER.findall(normalized)
+
+        best: Optional[Tuple[str, float]] = None
+        for candidate, _ in shared.most_common(_FUZZY_CANDIDATES):
+            if _NUMBER.findall(candidate) != numbers:
+                continue
+            score = SequenceMatcher(None, normalized, candidate).ratio()
+            if best is None or score > best[1]:
+                best = (candidate, score)
+
+        if best is None:
+            return None
+        title, metadata = self._titles[best[0]]
+        return title, metadata, best[1]
+
+    def match(self, item: str, threshold: float) -> Optional[Analyze]:
+        """
+        Builds an 'Analyze' result directly when the item matches a commodity title with at least
+        'threshold' similarity and the title's baseline value maps unambiguously to a certificate decision.
+        Returns None when the item needs the LLM analysis.
+        """
+        found = self.lookup(item)
+        if found is None:
+            return None
+
+        title, metadata, similarity = found
+        if similarity < threshold:
+            return None
+
+        baseline = get_baseline(metadata)
+        requires_certificate = baseline_requires_certificate(baseline)
+        if requires_certificate is None:
+            return None
+
+        match_kind = "Exact match" if similarity == 1.0 else f"Near-exact match (similarity {similarity:.2f})"
+        return Analyze(
+            item=item,
+            Listed=True,
+            Content_Certificate=requires_certificate,
+            reasoning=f"{match_kind} with the commodity title '{title}' in the mandatory list. "
+                      f"{BASELINE_FIELD}: {baseline if baseline not in (None, '') else 'not specified'}."
+        )
+
+
+def build_title_index(vector_stores) -> CommodityTitleIndex:
+    """
+    Builds the title index from every document stored in the given Chroma vector stores.
+    Rows of the unified index contribute both of their titles; other documents are their own title.
+    """
+    entries: List[Tuple[str, Dict[str, Any]]] = []
+    for vector_store in vector_stores:
+        if vector_store is None:
+            continue
+        records = vector_store.get(include=["documents", "metadatas"])
+        for document, metadata in zip(records["documents"], records["metadatas"]):
+            metadata = metadata or {}
+            titles = [metadata[field] for field in TITLE_FIELDS if metadata.get(field)] or [document]
+            entries.extend((title, metadata) for title in titles)
+    return CommodityTitleIndex(entries)
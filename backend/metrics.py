@@ -0,0 +1,296 @@
+import functools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY
+
+# --- Prometheus metrics (exported on /metrics; every worker process keeps its own) ---
+
+NODE_DURATION = Histogram(
+    "lcc_node_duration_seconds", "Duration of each agent graph node.", ["node"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+NODE_ERRORS = Counter(
+    "lcc_node_errors_total", "Errors raised or handled inside each agent graph node.", ["node"]
+)
+REQUEST_ITEMS = Histogram(
+    "lcc_request_items", "Product items parsed per request.",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+)
+EMBEDDING_DURATION = Histogram(
+    "lcc_embedding_duration_seconds", "Duration of each batch embedding call (cache lookups included).",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+VECTOR_QUERY_DURATION = Histogram(
+    "lcc_vector_query_duration_seconds", "Duration of each multi-query Chroma search.", ["store"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+LLM_DURATION = Histogram(
+    "lcc_llm_call_duration_seconds", "Duration of each chat model call.", ["node"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+)
+LLM_TOKENS = Counter(
+    "lcc_llm_tokens_total", "Chat model tokens, by node and direction (input/output).", ["node", "direction"]
+)
+LLM_RETRIES = Counter(
+    "lcc_llm_retries_total", "Chat model calls retried by the LLM gateway, by error kind (rate_limit, transient).", ["kind"]
+)
+LLM_FALLBACKS = Counter(
+    "lcc_llm_fallbacks_total", "Chat model calls sent to the fallback model, by reason (overflow, rate_limit).", ["reason"]
+)
+LLM_DEDUPLICATED = Counter(
+    "lcc_llm_deduplicated_total", "Chat model calls served by an identical call already in flight."
+)
+LLM_RATE_LIMIT_WAIT = Histogram(
+    "lcc_llm_rate_limit_wait_seconds", "Time chat model calls waited for the RPM/TPM quota.",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60)
+)
+DECISIONS = Counter(
+    "lcc_decisions_total", "Product decisions by source (cache, match, llm, error).", ["source"]
+)
+
+
+class _CacheCollector:
+    """Exports the decision and embedding cache counters, which the caches keep themselves."""
+
+    @staticmethod
+    def _families():
+        return (
+            CounterMetricFamily("lcc_cache_lookups", "Cache lookups by cache and result.", labels=["cache", "result"]),
+            GaugeMetricFamily("lcc_cache_entries", "Entries held by each cache.", labels=["cache"])
+        )
+
+    def describe(self):
+        # Lets the registry know the metric names without collecting (config is not imported yet at registration)
+        return list(self._families())
+
+    def collect(self):
+        from .config import decision_cache, get_embedding_cache
+
+        lookups, entries = self._families()
+
+        lookups.add_metric(["decision", "hit"], decision_cache.hits)
+        lookups.add_metric(["decision", "miss"], decision_cache.misses)
+        embedding_cache = get_embedding_cache()
+        if embedding_cache is not None:
+            stats = embedding_cache.stats()
+            lookups.add_metric(["embedding", "hit"], stats["hits"])
+            lookups.add_metric(["embedding", "miss"], stats["misses"])
+            entries.add_metric(["embedding"], stats["entries"])
+        yield lookups
+        yield entries
+
+
+REGISTRY.register(_CacheCollector())
+
+
+# --- Per-request trace ---
+# A request that asks for a trace sets a RequestTrace in this context variable; the graph nodes,
+# worker threads and LLM callbacks it spawns inherit the context and add their measurements to it.
+
+_current_trace: ContextVar[Optional["RequestTrace"]] = ContextVar("current_trace", default=None)
+_current_node: ContextVar[Optional[str]] = ContextVar("current_node", default=None)
+
+
+class RequestTrace:
+    """Timings, LLM usage and decision sources collected for a single request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.nodes = []
+        self.items = None
+        self.embedding_seconds = 0.0
+        self.vector_query_seconds = 0.0
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.llm_retries = 0
+        self.llm_fallbacks = 0
+        self.llm_deduplicated = 0
+        self.rate_limit_wait_seconds = 0.0
+        self.decisions: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "total_seconds": round(time.perf_counter() - self.started, 4),
+            "nodes": self.nodes,
+            "items": self.items,
+            "embedding_seconds": round(self.embedding_seconds, 4),
+            "vector_query_seconds": round(self.vector_query_seconds, 4),
+            "llm": {
+                "calls": self.llm_calls,
+                "seconds": round(self.llm_seconds, 4),
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "retries": self.llm_retries,
+                "fallbacks": self.llm_fallbacks,
+                "deduplicated": self.llm_deduplicated,
+                "rate_limit_wait_seconds": round(self.rate_limit_wait_seconds, 4)
+            },
+            "decisions": self.decisions,
+            "errors": self.errors
+        }
+
+
+@contextmanager
+def request_trace(enabled: bool = True):
+    """Collects a RequestTrace for the code run inside the block (yields None when disabled)."""
+    if not enabled:
+        yield None
+        return
+    trace = RequestTrace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+# --- Recording helpers ---
+
+def instrument_node(name: str, node):
+    """Wraps an async graph node to record its duration and errors (and mark LLM calls made inside it)."""
+
+    @functools.wraps(node)
+    async def instrumented_node(state):
+        token = _current_node.set(name)
+        started = time.perf_counter()
+        try:
+            return await node(state)
+        except Exception:
+            record_error(name)
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            _current_node.reset(token)
+            NODE_DURATION.labels(name).observe(seconds)
+            trace = _current_trace.get()
+            if trace is not None:
+                trace.nodes.append({"node": name, "seconds": round(seconds, 4)})
+
+    return instrumented_node
+
+
+def record_error(node: str) -> None:
+    NODE_ERRORS.labels(node).inc()
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.errors[node] = trace.errors.get(node, 0) + 1
+
+
+def record_items(count: int) -> None:
+    REQUEST_ITEMS.observe(count)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.items = count
+
+
+def record_decision_source(source: str) -> None:
+    DECISIONS.labels(source).inc()
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.decisions[source] = trace.decisions.get(source, 0) + 1
+
+
+def record_llm_retry(kind: str) -> None:
+    LLM_RETRIES.labels(kind).inc()
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.llm_retries += 1
+
+
+def record_llm_fallback(reason: str) -> None:
+    LLM_FALLBACKS.labels(reason).inc()
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.llm_fallbacks += 1
+
+
+def record_llm_deduplicated() -> None:
+    LLM_DEDUPLICATED.inc()
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.llm_deduplicated += 1
+
+
+def record_llm_rate_limit_wait(seconds: float) -> None:
+    LLM_RATE_LIMIT_WAIT.observe(seconds)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.rate_limit_wait_seconds += seconds
+
+
+@contextmanager
+def time_embedding():
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        EMBEDDING_DURATION.observe(seconds)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.embedding_seconds += seconds
+
+
+@contextmanager
+def time_vector_query(store: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        VECTOR_QUERY_DURATION.labels(store).observe(seconds)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.vector_query_seconds += seconds
+
+
+class LLMMetricsCallbackHandler(BaseCallbackHandler):
+    """Records the duration and token usage of every chat model call, by graph node."""
+
+    def __init__(self):
+        self._runs: Dict[UUID, tuple] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata=None, **kwargs) -> None:
+        node = _current_node.get() or (metadata or {}).get("langgraph_node") or "none"
+        self._runs[run_id] = (node, time.perf_counter(), _current_trace.get())
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        node, started, trace = run
+        seconds = time.perf_counter() - started
+        LLM_DURATION.labels(node).observe(seconds)
+
+        input_tokens = output_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+        LLM_TOKENS.labels(node, "input").inc(input_tokens)
+        LLM_TOKENS.labels(node, "output").inc(output_tokens)
+
+        if trace is not None:
+            trace.llm_calls += 1
+            trace.llm_seconds += seconds
+            trace.input_tokens += input_tokens
+            trace.output_tokens += output_tokens
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            LLM_DURATION.labels(run[0]).observe(time.perf_counter() - run[1])
+
+
+llm_metrics_callback = LLMMetricsCallbackHandler()
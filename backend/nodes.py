@@ -1,34 +1,97 @@
-from .state import AgentState, Items, Analyze
-from .config import llm, retrievers_by_lang
-from langchain_core.messages import AIMessage, HumanMessage
+from .state import AgentState, Items, Analyze, AnalyzeBatch
+from .input_parser import split_product_list, detect_language
+from .text_utils import normalize_product_name
+from .config import (
+    get_llm,
+    get_embedding_function,
+    get_index,
+    INDEX_MODE,
+    UNIFIED_INDEX,
+    RETRIEVAL_K,
+    ANALYSIS_MAX_CONCURRENCY,
+    ANALYSIS_ITEM_TIMEOUT,
+    ANALYSIS_BATCH_SIZE,
+    ANALYSIS_BATCH_TIMEOUT,
+    DECISION_CACHE_ENABLED,
+    decision_cache,
+    upload_store,
+    MATCH_FAST_PATH_ENABLED,
+    MATCH_FUZZY_THRESHOLD,
+    PARSE_FAST_PATH_ENABLED,
+    HISTORY_MAX_MESSAGES,
+    FINAL_OUTPUT_MODE,
+    FINAL_SUMMARY_MAX_ITEMS
+)
+from .report import render_decisions_report
+from .metrics import record_decision_source, record_error, record_items, time_embedding, time_vector_query
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from typing import List, Dict, Literal
+from typing import List, Dict, Literal, Optional
 from langchain_core.documents import Document
+from langgraph.config import get_stream_writer
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _get_stream_writer():
+    """Returns the LangGraph custom stream writer, or a no-op when the node runs outside a graph stream."""
+    try:
+        return get_stream_writer()
+    except Exception:
+        return lambda chunk: None
 
 # --- Node 1: Parse User Input ---
-def parse_input(state: AgentState) -> AgentState:
+async def parse_input(state: AgentState) -> AgentState:
     """
     Parses the last human message to extract a list of product items
-    and determine their language, solely using the LLM.
-    Uses an LLM with PydanticOutputParser for structured output.
-    Combines input bar text with file content if available in additional_kwargs.
+    and determine their language.
+    Structured input (one product per line in an uploaded file, bulleted or numbered lists,
+    quoted items) is split locally and each name is tagged by its share of Arabic script.
+    Only free-form prose is sent to the LLM, which uses PydanticOutputParser for structured output.
+    Considers the input bar text and the content of an uploaded file, which additional_kwargs
+    references by its key in the upload store ('file_ref').
     """
     last_message = state['messages'][-1]
 
-    # Initialize the query for the LLM
-    query_for_llm = last_message.content # Start with the text from the input bar
-
-    # Check for file content in additional_kwargs if the message is a HumanMessage
+    # The text from the input bar, and the file content if the message is a HumanMessage with a file
+    message_text = last_message.content
+    file_content = None
     if isinstance(last_message, HumanMessage) and last_message.additional_kwargs:
+        # Messages saved before uploads were stored by reference carry the content itself
         file_content = last_message.additional_kwargs.get("file_content")
-        
-        if file_content:
-            # Combine the input bar text with the file content for LLM processing
-            if query_for_llm:
-                query_for_llm = f"{query_for_llm}\n{file_content}"
-            else:
-                query_for_llm = f"\n{file_content}"
+        file_ref = last_message.additional_kwargs.get("file_ref")
+        if file_ref:
+            file_content = await asyncio.to_thread(upload_store.get, file_ref)
+            if file_content is None:
+                logger.warning("Uploaded file %s is no longer in the upload store", file_ref)
+                record_error("parse_input")
+
+    product_items_dict: Dict[str, Literal["en", "ar"]] = {}
+    prose_parts: List[str] = []
+
+    # Split structured parts locally and keep free-form prose for the LLM
+    for text, from_file in ((message_text, False), (file_content, True)):
+        if not text:
+            continue
+        local_items = split_product_list(text, from_file=from_file) if PARSE_FAST_PATH_ENABLED else None
+        if local_items is None:
+            prose_parts.append(text)
+            continue
+        for item in local_items:
+            product_items_dict.setdefault(item, detect_language(item))
+
+    if not prose_parts:
+        record_items(len(product_items_dict))
+        return {
+            'product_items': product_items_dict,
+            'items_retrieved_docs': {},
+            'items_decisions': {}
+        }
+
+    # Combine the prose parts (input bar text and/or file content) for LLM processing
+    query_for_llm = "\n".join(prose_parts)
 
     # Initialize PydanticOutputParser for the Items model
     parser = PydanticOutputParser(pydantic_object=Items)
@@ -47,31 +110,37 @@ def parse_input(state: AgentState) -> AgentState:
     ])
 
     # Create the parsing chain
-    parsing_chain = prompt | llm.with_structured_output(Items)
-
-    product_items_dict: Dict[str, Literal["en", "ar"]] = {}
+    parsing_chain = prompt | get_llm().with_structured_output(Items)
 
     try:
-        # Invoke the chain to parse the combined input message
-        parsed_items: Items = parsing_chain.invoke({"query": query_for_llm, "format_instructions": parser.get_format_instructions()})
+        # Invoke the chain to parse the combined prose
+        parsed_items: Items = await parsing_chain.ainvoke({"query": query_for_llm, "format_instructions": parser.get_format_instructions()})
         for item_with_lang in parsed_items.products:
-            product_items_dict[item_with_lang.name] = item_with_lang.language
+            product_items_dict.setdefault(item_with_lang.name, item_with_lang.language)
 
-    except Exception as e:
-        pass
+    except Exception:
+        logger.exception("LLM product extraction failed; keeping the %d locally split items", len(product_items_dict))
+        record_error("parse_input")
 
+    record_items(len(product_items_dict))
     return {
-        'product_items': product_items_dict, # This will be empty if LLM parsing failed
+        'product_items': product_items_dict, # Only the locally split items if LLM parsing failed
         'items_retrieved_docs': {},
         'items_decisions': {}
     }
 
 # --- Node 2: Retrieve Documents for All Items ---
-def retrieve_documents_for_items(state: AgentState) -> AgentState:
+async def retrieve_documents_for_items(state: AgentState) -> AgentState:
     """
     Retrieves relevant documents for ALL product items in the 'product_items' dictionary
     from the appropriate language-specific vector database.
-    Stores the retrieved documents in items_retrieved_docs.
+    Items are grouped by language: all names of a language are embedded in a single
+    batch and looked up with a single multi-query search against that language's store.
+    With INDEX_MODE=unified there is no language routing: every item is embedded and
+    searched once against the single bilingual store.
+    The blocking embedding and search work runs in worker threads, one per store.
+    Stores the retrieved documents in items_retrieved_docs, and the dataset version of the
+    index they come from in dataset_version (the index can be swapped while the graph runs).
     """
     product_items_dict = state['product_items']
     items_retrieved_docs = state['items_retrieved_docs']
@@ -79,29 +148,82 @@ def retrieve_documents_for_items(state: AgentState) -> AgentState:
     if not product_items_dict:
         return state
 
-    for item, lang in product_items_dict.items(): # Iterate over dict items
+    # Search a single index snapshot for the whole request
+    index = await asyncio.to_thread(get_index)
 
-        # Select the correct retriever based on detected language
-        current_retriever = retrievers_by_lang.get(lang)
+    # Group the items by the store they are searched in
+    items_by_store: Dict[str, List[str]] = {}
+    if INDEX_MODE == "unified":
+        items_by_store[UNIFIED_INDEX] = list(product_items_dict)
+    else:
+        for item, lang in product_items_dict.items():
+            items_by_store.setdefault(lang, []).append(item)
 
-        if current_retriever is None:
-            items_retrieved_docs[item] = []
-            continue
+    def retrieve_store_batch(store_name: str, items: List[str]) -> List[List[Document]]:
+
+        # Select the vector store of this group
+        vector_store = index.stores.get(store_name)
+
+        if vector_store is None:
+            return [[] for _ in items]
+
+        # Embed every item of this group in one forward pass
+        with time_embedding():
+            query_embeddings = get_embedding_function().embed_documents(items)
+
+        # Query the store once for all items
+        with time_vector_query(store_name):
+            return _search_by_vectors(vector_store, query_embeddings, RETRIEVAL_K)
+
+    docs_per_store = await asyncio.gather(*[
+        asyncio.to_thread(retrieve_store_batch, store_name, items)
+        for store_name, items in items_by_store.items()
+    ])
 
-        # Perform retrieval for the current item using the correct language retriever
-        semantic_docs: List[Document] = current_retriever.invoke(item)
-        items_retrieved_docs[item] = semantic_docs
+    # Fan the results back out per item
+    for items, docs_per_item in zip(items_by_store.values(), docs_per_store):
+        for item, semantic_docs in zip(items, docs_per_item):
+            items_retrieved_docs[item] = semantic_docs
 
     return {
-        'items_retrieved_docs': items_retrieved_docs
+        'items_retrieved_docs': items_retrieved_docs,
+        'dataset_version': index.version
     }
 
+def _search_by_vectors(vector_store, query_embeddings: List[List[float]], k: int) -> List[List[Document]]:
+    """
+    Runs a single multi-query similarity search against a Chroma store.
+    Returns, for each query embedding, the top-k documents ordered by similarity.
+    """
+    results = vector_store._collection.query(
+        query_embeddings=query_embeddings,
+        n_results=k,
+        include=["documents", "metadatas"]
+    )
+
+    docs_per_query: List[List[Document]] = []
+    for ids, contents, metadatas in zip(results["ids"], results["documents"], results["metadatas"]):
+        docs_per_query.append([
+            Document(id=doc_id, page_content=content, metadata=metadata or {})
+            for doc_id, content, metadata in zip(ids, contents, metadatas)
+        ])
+    return docs_per_query
+
 # --- Node 3: Analyze Product Match for All Items ---
-def analyze_product_match(state: AgentState) -> AgentState:
+async def analyze_product_match(state: AgentState) -> AgentState:
     """
     Analyzes whether each product item is listed and if it requires
     a Local Content Certificate, using an LLM and structured output.
-    This node processes all items in 'product_items'.
+    This node processes all items in 'product_items' concurrently, with at most
+    ANALYSIS_MAX_CONCURRENCY LLM calls in flight and a per-item timeout (ANALYSIS_ITEM_TIMEOUT).
+    Items are sent to the LLM ANALYSIS_BATCH_SIZE at a time in a single structured-output call;
+    items a batched answer misses, repeats or fails on are re-analyzed one by one.
+    Each item whose own analysis fails or times out gets the default "not listed" analysis, and
+    'items_decisions' keeps the order of 'product_items'.
+    Items with a decision in the persistent decision cache skip the LLM call entirely, and so do
+    items that match a commodity title exactly or near-exactly (MATCH_FUZZY_THRESHOLD).
+    Every decision is pushed to the custom graph stream as soon as it is ready, and carries
+    the dataset version of the index the documents were retrieved from.
     """
     product_items_dict = state['product_items'] # Still iterating over the dictionary keys
     items_retrieved_docs = state['items_retrieved_docs']
@@ -110,27 +232,54 @@ def analyze_product_match(state: AgentState) -> AgentState:
     if not product_items_dict:
         return state
 
+    results: Dict[str, Analyze] = {}
+    items_to_analyze = list(product_items_dict)
+
+    # Decide against the index snapshot the documents were retrieved from
+    index = await asyncio.to_thread(get_index, state.get('dataset_version'))
+    dataset_version = index.version
+
+    # Push each decision to streaming clients as soon as it is made
+    stream_writer = _get_stream_writer()
+
+    def record_decision(item: str, decision: Analyze, source: Literal["cache", "match", "llm", "error"]):
+        decision.dataset_version = dataset_version
+        results[item] = decision
+        record_decision_source(source)
+        stream_writer({"event": "decision", "source": source, **decision.model_dump()})
+
+    # Serve repeated items from the decision cache
+    if DECISION_CACHE_ENABLED:
+        cached_decisions = await asyncio.to_thread(lambda: {
+            item: _cached_decision(item, lang, dataset_version)
+            for item, lang in product_items_dict.items()
+        })
+        items_to_analyze = []
+        for item, cached_decision in cached_decisions.items():
+            if cached_decision is not None:
+                record_decision(item, cached_decision, "cache")
+            else:
+                items_to_analyze.append(item)
+
+    # Decide obvious title matches deterministically; only ambiguous items go to the LLM
+    if MATCH_FAST_PATH_ENABLED and items_to_analyze:
+        title_index = await asyncio.to_thread(index.get_title_index)
+        ambiguous_items = []
+        for item in items_to_analyze:
+            matched_decision = title_index.match(item, MATCH_FUZZY_THRESHOLD)
+            if matched_decision is not None:
+                record_decision(item, matched_decision, "match")
+            else:
+                ambiguous_items.append(item)
+        items_to_analyze = ambiguous_items
+
     # Initialize PydanticOutputParser for the Analyze model
     parser = PydanticOutputParser(pydantic_object=Analyze)
 
     # Prompt template for analyzing product match and certificate requirement
     prompt = ChatPromptTemplate.from_messages([
         ("system",
-         "You are an expert AI agent tasked with determining if a product is listed in a mandatory list "
-         "and if it requires a Local Content Certificate, based on provided documents. "
-         "Follow these strict rules:\n"
-         "1. **Listing Determination**: Carefully examine the 'Document Content' and 'Metadata' of the provided documents. "
-         "   Set 'Listed' to True ONLY if the 'item' (product name) is clearly and explicitly mentioned or a perfect semantic match is found "
-         "   in the 'Commodity Title (Arabic)' or 'Commodity Title (English)' from the documents. "
-         "   If there's no clear match or the product is not found, set 'Listed' to False.\n"
-         "2. **Local Content Certificate Determination**: "
-         "   - If 'Listed' is False, then 'Content_Certificate' MUST be False. A certificate is irrelevant if the product isn't listed.\n"
-         "   - If 'Listed' is True, then check the 'Manufacturer Local Content Minimum Baseline' field within the metadata of the matching document. "
-         "     Set 'Content_Certificate' to True if this field explicitly indicates a requirement (e.g. 'يشترط', 'نعم', 'Required', 'Yes', or a specific percentage value like '30%', '15%'). "
-         "     Set 'Content_Certificate' to False if the field indicates no requirement (e.g., 'لا يوجد', 'لا يشترط', 'No', 'Not Required', or is empty/null).\n"
-         "3. **Reasoning**: Provide a concise but clear explanation for both decisions. "
-         "   If 'Listed' is True, mention the exact matching commodity title from the document and the value of 'Manufacturer Local Content Minimum Baseline'. "
-         "   If 'Listed' is False, explain why (e.g., 'no clear match found').\n"
+         _ANALYSIS_INSTRUCTIONS +
          "4. **Output Format**: Strictly adhere to the JSON schema for the 'Analyze' model provided below. "
          "   Ensure the 'item' field in your output exactly matches the input product item."
         ),
@@ -143,55 +292,237 @@ def analyze_product_match(state: AgentState) -> AgentState:
     ])
 
     # Create the analysis chain
-    analysis_chain = prompt | llm.with_structured_output(Analyze)
+    analysis_chain = prompt | get_llm().with_structured_output(Analyze)
+    format_instructions = parser.get_format_instructions()
 
-    for item, lang in product_items_dict.items(): # Iterate over dict items. Lang is available but not used here.
-        current_item = item
-        retrieved_docs_for_item = items_retrieved_docs.get(current_item, [])
+    # Prompt for several products at once: the instructions are sent once per batch, and the
+    # schema is enforced by the structured output alone
+    batch_prompt = ChatPromptTemplate.from_messages([
+        ("system",
+         _ANALYSIS_INSTRUCTIONS +
+         "4. **Output Format**: Return exactly one analysis per product item, in the order given. "
+         "   Analyze each product only against its own retrieved documents, and copy its 'item' field exactly from the input."
+        ),
+        ("human",
+         "Analyze the following {count} products, each using its own retrieved documents:\n\n{products}"
+        )
+    ])
+    batch_chain = batch_prompt | get_llm().with_structured_output(AnalyzeBatch)
+
+    # Bound the number of LLM calls in flight; the timeout only counts the time an item
+    # actually spends in flight (not the time it waits for a free slot)
+    semaphore = asyncio.Semaphore(ANALYSIS_MAX_CONCURRENCY)
+
+    async def run_item(item: str):
+        async with semaphore:
+            formatted_docs = _format_documents(items_retrieved_docs.get(item, []))
+            try:
+                decision = await asyncio.wait_for(
+                    _analyze_single_item(analysis_chain, item, formatted_docs, format_instructions),
+                    timeout=ANALYSIS_ITEM_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                logger.warning("Analysis of %r timed out after %gs", item, ANALYSIS_ITEM_TIMEOUT)
+                record_error("analyze_products")
+                return item, _failed_analysis(item, TimeoutError(f"analysis timed out after {ANALYSIS_ITEM_TIMEOUT:g}s")), "error"
+            except Exception as e:
+                # Store a default/error analysis if LLM fails
+                logger.warning("Analysis of %r failed: %r", item, e)
+                record_error("analyze_products")
+                return item, _failed_analysis(item, e), "error"
+            return item, decision, "llm"
+
+    async def complete(item: str, decision: Analyze, source: Literal["llm", "error"]):
+        # Decisions are recorded as soon as they are made so streaming clients see them without delay
+        record_decision(item, decision, source)
+
+        # Only successful analyses are cached
+        if source == "llm" and DECISION_CACHE_ENABLED:
+            try:
+                await asyncio.to_thread(decision_cache.put, item, product_items_dict[item], dataset_version, decision)
+            except Exception as e:
+                # The decision is already made; it just won't be served from the cache next time
+                logger.warning("Caching the decision for %r failed: %r", item, e)
+                record_error("analyze_products")
+
+    async def analyze_item(item: str):
+        await complete(*await run_item(item))
+
+    async def analyze_batch(batch: List[str]):
+        async with semaphore:
+            try:
+                batch_decisions = await asyncio.wait_for(
+                    _analyze_item_batch(batch_chain, batch, items_retrieved_docs),
+                    timeout=ANALYSIS_BATCH_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                logger.warning("Batched analysis of %d items timed out after %gs; analyzing them one by one", len(batch), ANALYSIS_BATCH_TIMEOUT)
+                record_error("analyze_products")
+                batch_decisions = {}
+            except Exception as e:
+                logger.warning("Batched analysis of %d items failed (%r); analyzing them one by one", len(batch), e)
+                record_error("analyze_products")
+                batch_decisions = {}
+
+        for item, decision in batch_decisions.items():
+            await complete(item, decision, "llm")
+
+        # Re-run only the items the batched answer did not cover exactly once
+        missing_items = [item for item in batch if item not in batch_decisions]
+        if missing_items and batch_decisions:
+            logger.info("Batched analysis missed %d of %d items; analyzing them one by one", len(missing_items), len(batch))
+        await asyncio.gather(*[analyze_item(item) for item in missing_items])
+
+    batches = [items_to_analyze[start:start + ANALYSIS_BATCH_SIZE] for start in range(0, len(items_to_analyze), ANALYSIS_BATCH_SIZE)]
+    await asyncio.gather(*[
+        analyze_batch(batch) if len(batch) > 1 else analyze_item(batch[0])
+        for batch in batches
+    ])
 
-        # Format retrieved documents for the LLM prompt
-        formatted_docs = "\n---\n".join([
-            f"Document Content: {doc.page_content}\nMetadata: {doc.metadata}"
-            for doc in retrieved_docs_for_item
-        ])
-        if not formatted_docs:
-            formatted_docs = "No relevant documents were found for this product in the mandatory list."
-
-        try:
-            # Invoke the chain to analyze the current item
-            analysis_result: Analyze = analysis_chain.invoke({
-                "item": current_item,
-                "documents": formatted_docs,
-                "format_instructions": parser.get_format_instructions()
-            })
-
-            # Enforce the Content_Certificate logic explicitly after LLM generation
-            if not analysis_result.Listed:
-                analysis_result.Content_Certificate = False
-                analysis_result.reasoning += " (Content Certificate set to False because product is not listed)."
-
-            items_decisions[current_item] = analysis_result
-            
-        except Exception as e:
-            # Store a default/error analysis if LLM fails
-            items_decisions[current_item] = Analyze(
-                item=current_item,
-                Listed=False,
-                Content_Certificate=False,
-                reasoning=f"Analysis failed due to an internal error: {e}. Could not determine listing or certificate requirement."
-            )
+    # Keep the decisions in the same order as the parsed product items
+    for item in product_items_dict:
+        items_decisions[item] = results[item]
 
     return {
         'items_decisions': items_decisions
     }
 
+# Listing and certificate rules shared by the single-item and batched analysis prompts
+_ANALYSIS_INSTRUCTIONS = (
+    "You are an expert AI agent tasked with determining if a product is listed in a mandatory list "
+    "and if it requires a Local Content Certificate, based on provided documents. "
+    "Follow these strict rules:\n"
+    "1. **Listing Determination**: Carefully examine the 'Document Content' and 'Metadata' of the provided documents. "
+    "   Set 'Listed' to True ONLY if the 'item' (product name) is clearly and explicitly mentioned or a perfect semantic match is found "
+    "   in the 'Commodity Title (Arabic)' or 'Commodity Title (English)' from the documents. "
+    "   If there's no clear match or the product is not found, set 'Listed' to False.\n"
+    "2. **Local Content Certificate Determination**: "
+    "   - If 'Listed' is False, then 'Content_Certificate' MUST be False. A certificate is irrelevant if the product isn't listed.\n"
+    "   - If 'Listed' is True, then check the 'Manufacturer Local Content Minimum Baseline' field within the metadata of the matching document. "
+    "     Set 'Content_Certificate' to True if this field explicitly indicates a requirement (e.g. 'يشترط', 'نعم', 'Required', 'Yes', or a specific percentage value like '30%', '15%'). "
+    "     Set 'Content_Certificate' to False if the field indicates no requirement (e.g., 'لا يوجد', 'لا يشترط' or 'لايشترط', 'No', 'Not Required', or is empty/null).\n"
+    "3. **Reasoning**: Provide a concise but clear explanation for both decisions. "
+    "   If 'Listed' is True, mention the exact matching commodity title from the document and the value of 'Manufacturer Local Content Minimum Baseline'. "
+    "   If 'Listed' is False, explain why (e.g., 'no clear match found').\n"
+)
+
+def _cached_decision(item: str, lang: str, dataset_version: str) -> Optional[Analyze]:
+    """Looks the item up in the decision cache; a lookup that fails (e.g. a locked database) counts as a miss."""
+    try:
+        return decision_cache.get(item, lang, dataset_version)
+    except Exception as e:
+        logger.warning("Decision cache lookup for %r failed: %r", item, e)
+        record_error("analyze_products")
+        return None
+
+def _format_documents(retrieved_docs: List[Document]) -> str:
+    """Formats the retrieved documents of a single item for the analysis prompt."""
+    formatted_docs = "\n---\n".join([
+        f"Document Content: {doc.page_content}\nMetadata: {doc.metadata}"
+        for doc in retrieved_docs
+    ])
+    if not formatted_docs:
+        formatted_docs = "No relevant documents were found for this product in the mandatory list."
+    return formatted_docs
+
+async def _analyze_single_item(analysis_chain, item: str, formatted_docs: str, format_instructions: str) -> Analyze:
+    """Runs the analysis chain for one product item and enforces the certificate rule."""
+    # Invoke the chain to analyze the current item
+    analysis_result: Analyze = await analysis_chain.ainvoke({
+        "item": item,
+        "documents": formatted_docs,
+        "format_instructions": format_instructions
+    })
+
+    return _enforce_certificate_rule(analysis_result)
+
+async def _analyze_item_batch(batch_chain, items: List[str], items_retrieved_docs: Dict[str, List[Document]]) -> Dict[str, Analyze]:
+    """
+    Runs the batched analysis chain for several product items in one call.
+    Returns the decisions of the items that came back exactly once (matched on the exact or
+    normalized item name); the caller re-analyzes the others individually.
+    """
+    products = "\n\n".join(
+        f"### Product {number}\n"
+        f"Product Item: {item}\n"
+        f"Retrieved Documents:\n{_format_documents(items_retrieved_docs.get(item, []))}"
+        for number, item in enumerate(items, start=1)
+    )
+    batch_result: AnalyzeBatch = await batch_chain.ainvoke({"count": len(items), "products": products})
+
+    # The model may alter whitespace or letter case of an item; map its answers back to the input names
+    items_by_normalized_name: Dict[str, str] = {}
+    for item in items:
+        items_by_normalized_name.setdefault(normalize_product_name(item), item)
+
+    answers: Dict[str, List[Analyze]] = {}
+    for decision in batch_result.decisions:
+        item = decision.item if decision.item in items else items_by_normalized_name.get(normalize_product_name(decision.item))
+        if item is not None:
+            answers.setdefault(item, []).append(decision)
+
+    batch_decisions: Dict[str, Analyze] = {}
+    for item, item_answers in answers.items():
+        if len(item_answers) == 1:
+            decision = item_answers[0]
+            decision.item = item
+            batch_decisions[item] = _enforce_certificate_rule(decision)
+    return batch_decisions
+
+def _enforce_certificate_rule(analysis_result: Analyze) -> Analyze:
+    """Enforces the Content_Certificate logic explicitly after LLM generation."""
+    if not analysis_result.Listed:
+        analysis_result.Content_Certificate = False
+        analysis_result.reasoning += " (Content Certificate set to False because product is not listed)."
+    return analysis_result
+
+def _failed_analysis(item: str, error: Exception) -> Analyze:
+    """Builds the default analysis stored for an item whose analysis failed."""
+    return Analyze(
+        item=item,
+        Listed=False,
+        Content_Certificate=False,
+        reasoning=f"Analysis failed due to an internal error: {error}. Could not determine listing or certificate requirement."
+    )
+
 # --- Node 4: Prepare Final Output ---
-def prepare_final_output(state: AgentState) -> AgentState:
+async def prepare_final_output(state: AgentState) -> AgentState:
     """
     Aggregates all item decisions into a single, comprehensive, and user-friendly final answer.
+    With FINAL_OUTPUT_MODE=table (the default) the answer is rendered deterministically as a
+    bilingual Markdown table with counts, without an LLM call. With 'summary', results of at most
+    FINAL_SUMMARY_MAX_ITEMS products also get a short LLM overview, streamed after the table.
+    With 'llm', the LLM writes the whole answer from the decisions.
+    Also trims the conversation thread to the last HISTORY_MAX_MESSAGES messages.
     """
     items_decisions = state['items_decisions']
-    
+
+    report = render_decisions_report(items_decisions.values())
+    with_summary = FINAL_OUTPUT_MODE == "summary" and 0 < len(items_decisions) <= FINAL_SUMMARY_MAX_ITEMS
+
+    if FINAL_OUTPUT_MODE == "llm":
+        final_answer = await _llm_final_answer(items_decisions, summary_only=False)
+        if final_answer is None:
+            final_answer = "An error occurred while compiling the final report."
+    elif with_summary:
+        # Streaming clients get the table right away; the overview follows token by token
+        _get_stream_writer()({"event": "token", "content": report + "\n\n"})
+        summary = await _llm_final_answer(items_decisions, summary_only=True)
+        final_answer = f"{report}\n\n{summary}" if summary else report
+    else:
+        final_answer = report
+
+    final_message = AIMessage(content=final_answer)
+
+    return {
+        'messages': _trim_history(state['messages'], final_message) + [final_message]
+    }
+
+async def _llm_final_answer(items_decisions: Dict[str, Analyze], summary_only: bool):
+    """
+    Asks the LLM for the final answer from the decisions: a full write-up, or ('summary_only') a short
+    overview to show below the results table. Returns None if the call fails.
+    """
     # Format the decisions into a clear string for the LLM
     decisions_summary = []
     for item, decision in items_decisions.items():
@@ -208,6 +539,12 @@ def prepare_final_output(state: AgentState) -> AgentState:
     if not formatted_decisions:
         formatted_decisions = "No products were analyzed or processed."
 
+    if summary_only:
+        request = ("The user already sees these results in a table. Write a short overview (a few sentences) "
+                   "of what they mean for the user, without repeating the table.")
+    else:
+        request = "Please provide a final, comprehensive summary for the user."
+
     # Prompt template for generating the final answer
     prompt = ChatPromptTemplate.from_messages([
         ("system", 
@@ -219,19 +556,27 @@ def prepare_final_output(state: AgentState) -> AgentState:
         ),
         ("human", 
          "Here are the analysis results for the requested products:\n\n{decisions_summary}\n\n"
-         "Please provide a final, comprehensive summary for the user."
+         "{request}"
         )
     ])
 
     # Create the final answer generation chain
-    final_answer_chain = prompt | llm
+    final_answer_chain = prompt | get_llm()
 
     try:
-        final_answer_message = final_answer_chain.invoke({"decisions_summary": formatted_decisions})
-        final_answer = final_answer_message.content
-    except Exception as e:
-        final_answer = "An error occurred while compiling the final report."
-
-    return {
-        'messages': [AIMessage(content=final_answer)]
-    }
\ No newline at end of file
+        final_answer_message = await final_answer_chain.ainvoke({"decisions_summary": formatted_decisions, "request": request})
+        return final_answer_message.content
+    except Exception:
+        logger.exception("LLM final answer generation failed")
+        record_error("prepare_final_output")
+        return None
+
+def _trim_history(messages, new_message) -> List[RemoveMessage]:
+    """
+    Returns the removals that keep the conversation thread within HISTORY_MAX_MESSAGES
+    once 'new_message' is added, dropping the oldest messages first.
+    """
+    if HISTORY_MAX_MESSAGES <= 0:
+        return []
+    overflow = len(messages) + 1 - HISTORY_MAX_MESSAGES
+    return [RemoveMessage(id=message.id) for message in list(messages)[:max(overflow, 0)] if message.id]
\ No newline at end of file
@@ -0,0 +1,394 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+from .input_parser import detect_language
+from .state import Analyze, AnalyzeBatch, Items, ProductItemWithLanguage
+from .text_utils import normalize_product_name
+
+# The backend modules that read their settings from the environment at import time (config, db_utils,
+# nodes, graph) are imported by run_benchmark(), after main() has pointed the databases to a scratch directory.
+
+# Relative slowdown (p95 node latency, items/sec) and absolute recall drop reported as regressions;
+# node latencies that grew by less than MIN_LATENCY_DELTA seconds are timer noise
+DEFAULT_TOLERANCE = 0.2
+RECALL_TOLERANCE = 0.01
+MIN_LATENCY_DELTA = 0.005
+
+_NOISY_SUFFIX = {"en": "(assorted)", "ar": "(متنوع)"}
+
+
+# --- Offline LLM stub ---
+
+class BenchmarkChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for the Gemini chat model. Each call waits 'latency_seconds' plus a jitter
+    (up to 'jitter_seconds', seeded by the prompt, so runs are repeatable) and answers from the prompt alone:
+    a product is 'Listed' when one of its retrieved commodity titles contains its name or is contained in it.
+    Token usage is estimated at four characters per token.
+    """
+
+    latency_seconds: float = 1.0
+    jitter_seconds: float = 0.0
+    seed: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "benchmark-stub"
+
+    def with_structured_output(self, schema, **kwargs):
+        # The answer is the schema instance serialized as JSON, so the call still goes through the
+        # chat model callbacks (LLM timings and token counts)
+        return self.bind(response_schema=schema.__name__) | RunnableLambda(
+            lambda message: schema.model_validate_json(message.content)
+        )
+
+    def _delay(self, prompt: str) -> float:
+        return self.latency_seconds + random.Random(f"{self.seed}:{prompt}").uniform(0, self.jitter_seconds)
+
+    def _result(self, prompt: str, response_schema: Optional[str]) -> ChatResult:
+        content = _stub_answer(prompt, response_schema)
+        usage = {"input_tokens": len(prompt) // 4, "output_tokens": len(content) // 4}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content, usage_metadata=usage))])
+
+    def _generate(self, messages, stop=None, run_manager=None, response_schema: Optional[str] = None, **kwargs) -> ChatResult:
+        prompt = "\n".join(str(message.content) for message in messages)
+        time.sleep(self._delay(prompt))
+        return self._result(prompt, response_schema)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, response_schema: Optional[str] = None, **kwargs) -> ChatResult:
+        prompt = "\n".join(str(message.content) for message in messages)
+        await asyncio.sleep(self._delay(prompt))
+        return self._result(prompt, response_schema)
+
+
+def _stub_decision(item: str, documents_text: str) -> Analyze:
+    name = normalize_product_name(item)
+    titles = [normalize_product_name(title) for title in re.findall(r"Document Content: (.*)", documents_text)]
+    listed = any(title and name and (title in name or name in title) for title in titles)
+    return Analyze(
+        item=item,
+        Listed=listed,
+        Content_Certificate=listed,
+        reasoning="Benchmark stub: " + ("a retrieved title matches the product." if listed else "no retrieved title matches the product.")
+    )
+
+
+def _stub_answer(prompt: str, response_schema: Optional[str]) -> str:
+    """Builds the stub's answer to the analysis, parsing or final-answer prompts of the graph."""
+    if response_schema in ("Analyze", "AnalyzeBatch"):
+        # Each product of the prompt starts with 'Product Item: <name>', followed by its retrieved documents
+        decisions = []
+        for section in prompt.split("Product Item: ")[1:]:
+            item, _, documents_text = section.partition("\n")
+            decisions.append(_stub_decision(item.strip(), documents_text))
+        if response_schema == "Analyze":
+            return decisions[0].model_dump_json(exclude={"dataset_version"})
+        return AnalyzeBatch(decisions=decisions).model_dump_json(exclude={"decisions": {"__all__": {"dataset_version"}}})
+
+    if response_schema == "Items":
+        match = re.search(r"User query: (.*?)\n\n", prompt, re.DOTALL)
+        names = [line.strip() for line in (match.group(1) if match else "").splitlines() if line.strip()]
+        return Items(products=[ProductItemWithLanguage(name=name, language=detect_language(name)) for name in names]).model_dump_json()
+
+    return "Benchmark stub answer."
+
+
+# --- Labelled corpus ---
+
+def _noisy_name(title: str) -> str:
+    """A near miss of a commodity title (last word dropped, a qualifier added) that the title fast path does not decide."""
+    words = title.split()
+    if len(words) >= 3:
+        words = words[:-1]
+    return " ".join(words + [_NOISY_SUFFIX[detect_language(title)]])
+
+
+def sample_corpus(source: str, mode: str, sample_size: int, seed: int) -> List[Dict[str, str]]:
+    """
+    Samples up to 'sample_size' rows per store of the index layout from the mandatory-list workbook and labels
+    each product name with the document it should retrieve. Every title is used as is ('exact') and as a
+    near miss ('noisy').
+    """
+    from .build_index import load_mandatory_list, prepare_records
+
+    rng = random.Random(seed)
+    corpus = []
+    for store_name, records in sorted(prepare_records(load_mandatory_list(source), mode).items()):
+        for record in rng.sample(records, min(sample_size, len(records))):
+            for title in record["titles"]:
+                for variant, query in (("exact", title), ("noisy", _noisy_name(title))):
+                    corpus.append({
+                        "query": query,
+                        "language": detect_language(query),
+                        "variant": variant,
+                        "expected_document": record["document"]
+                    })
+    rng.shuffle(corpus)
+    return corpus
+
+
+# --- Benchmark run ---
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """p50, p95 and max of the values (nearest rank)."""
+    if not values:
+        return {"p50": None, "p95": None, "max": None}
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        return round(ordered[max(0, math.ceil(q * len(ordered)) - 1)], 4)
+
+    return {"p50": rank(0.50), "p95": rank(0.95), "max": round(ordered[-1], 4)}
+
+
+def _recall(hits: List[Dict[str, Any]], k: int) -> Dict[str, Any]:
+    def rate(rows, key):
+        return round(sum(row[key] for row in rows) / len(rows), 4) if rows else None
+
+    def summary(rows):
+        return {"queries": len(rows), "at_1": rate(rows, "hit_at_1"), f"at_{k}": rate(rows, "hit_at_k")}
+
+    report = summary(hits)
+    for group in ("variant", "language"):
+        report[f"by_{group}"] = {}
+        for value in sorted({hit[group] for hit in hits}):
+            report[f"by_{group}"][value] = summary([hit for hit in hits if hit[group] == value])
+    return report
+
+
+async def _run_requests(corpus: List[Dict[str, str]], items_per_request: int, concurrency: int, k: int):
+    from .db_utils import close_db_connections
+    from .graph import create_agent_graph
+    from .metrics import request_trace
+
+    graph = await create_agent_graph()
+    semaphore = asyncio.Semaphore(concurrency)
+    traces, hits = [], []
+
+    async def run_request(entries: List[Dict[str, str]]):
+        # The products are sent as an uploaded file's content: one name per line
+        state = {
+            "messages": HumanMessage(content="", additional_kwargs={"file_content": "\n".join(entry["query"] for entry in entries)}),
+            "product_items": {},
+            "items_retrieved_docs": {},
+            "items_decisions": {}
+        }
+        config = {"configurable": {"thread_id": f"benchmark-{uuid.uuid4().hex}"}}
+        async with semaphore:
+            with request_trace() as trace:
+                final_state = await graph.ainvoke(state, config=config)
+        traces.append(trace.as_dict())
+
+        for entry in entries:
+            documents = [
+                normalize_product_name(doc.page_content)
+                for doc in final_state["items_retrieved_docs"].get(entry["query"], [])
+            ]
+            expected = normalize_product_name(entry["expected_document"])
+            hits.append({
+                "variant": entry["variant"],
+                "language": entry["language"],
+                "hit_at_1": expected in documents[:1],
+                "hit_at_k": expected in documents[:k]
+            })
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*[
+            run_request(corpus[start:start + items_per_request])
+            for start in range(0, len(corpus), items_per_request)
+        ])
+    finally:
+        await close_db_connections()
+    return traces, hits, time.perf_counter() - started
+
+
+def run_benchmark(
+    corpus: List[Dict[str, str]],
+    items_per_request: int,
+    concurrency: int,
+    llm_latency: float,
+    llm_jitter: float,
+    seed: int = 0
+) -> Dict[str, Any]:
+    """
+    Runs a labelled corpus of product names through the compiled agent graph, with the LLM replaced by
+    BenchmarkChatModel and the real embedding model and local Chroma stores, and reports per-node
+    latency percentiles, throughput, LLM usage, decision sources, retrieval recall and peak RSS.
+    """
+    from . import config
+    from .embedding_benchmark import _peak_rss_mb
+    from .metrics import llm_metrics_callback
+
+    if not corpus:
+        raise ValueError("The benchmark corpus is empty.")
+
+    # The stub goes through the same LLM gateway (quota, retries, deduplication) as the real model
+    config.set_llm(config.create_llm_gateway(BenchmarkChatModel(
+        latency_seconds=llm_latency,
+        jitter_seconds=llm_jitter,
+        seed=seed,
+        callbacks=[llm_metrics_callback]
+    )))
+    load_timings = config.warm_up()
+    k = config.RETRIEVAL_K
+
+    traces, hits, wall_seconds = asyncio.run(_run_requests(corpus, items_per_request, concurrency, k))
+
+    nodes: Dict[str, List[float]] = {}
+    for trace in traces:
+        for node in trace["nodes"]:
+            nodes.setdefault(node["node"], []).append(node["seconds"])
+    decisions: Dict[str, int] = {}
+    errors: Dict[str, int] = {}
+    for trace in traces:
+        for source_name, count in trace["decisions"].items():
+            decisions[source_name] = decisions.get(source_name, 0) + count
+        for node, count in trace["errors"].items():
+            errors[node] = errors.get(node, 0) + count
+    items = sum(trace["items"] or 0 for trace in traces)
+
+    return {
+        "settings": {
+            "index_mode": config.INDEX_MODE,
+            "index_version": config.get_index().version,
+            "embedding_model": config.EMBEDDING_MODEL_NAME,
+            "embedding_backend": config.loaded_embedding_backend,
+            "corpus_size": len(corpus),
+            "items_per_request": items_per_request,
+            "concurrency": concurrency,
+            "llm_latency_seconds": llm_latency,
+            "llm_jitter_seconds": llm_jitter,
+            "llm_rpm": config.LLM_RPM,
+            "llm_tpm": config.LLM_TPM,
+            "analysis_batch_size": config.ANALYSIS_BATCH_SIZE,
+            "analysis_max_concurrency": config.ANALYSIS_MAX_CONCURRENCY,
+            "match_fast_path": config.MATCH_FAST_PATH_ENABLED,
+            "decision_cache": config.DECISION_CACHE_ENABLED,
+            "final_output_mode": config.FINAL_OUTPUT_MODE,
+            "k": k,
+            "seed": seed
+        },
+        "load_seconds": load_timings,
+        "requests": len(traces),
+        "items": items,
+        "wall_seconds": round(wall_seconds, 3),
+        "items_per_second": round(items / wall_seconds, 2) if wall_seconds else None,
+        "latency_seconds": {
+            "request": _percentiles([trace["total_seconds"] for trace in traces]),
+            "nodes": {node: _percentiles(seconds) for node, seconds in nodes.items()},
+            "embedding": _percentiles([trace["embedding_seconds"] for trace in traces]),
+            "vector_query": _percentiles([trace["vector_query_seconds"] for trace in traces])
+        },
+        "llm": {
+            "calls": sum(trace["llm"]["calls"] for trace in traces),
+            "input_tokens": sum(trace["llm"]["input_tokens"] for trace in traces),
+            "output_tokens": sum(trace["llm"]["output_tokens"] for trace in traces),
+            "retries": sum(trace["llm"]["retries"] for trace in traces),
+            "fallbacks": sum(trace["llm"]["fallbacks"] for trace in traces),
+            "deduplicated": sum(trace["llm"]["deduplicated"] for trace in traces),
+            "rate_limit_wait_seconds": round(sum(trace["llm"]["rate_limit_wait_seconds"] for trace in traces), 3)
+        },
+        "decisions": decisions,
+        "errors": errors,
+        "recall": _recall(hits, k),
+        "peak_rss_mb": _peak_rss_mb()
+    }
+
+
+def compare_reports(baseline: Dict[str, Any], report: Dict[str, Any], tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """
+    Lists the regressions of a report against a baseline report: a node p95 latency more than 'tolerance'
+    (and MIN_LATENCY_DELTA) slower, a throughput more than 'tolerance' lower, or a recall more than RECALL_TOLERANCE lower.
+    """
+    regressions = []
+    baseline_nodes = baseline.get("latency_seconds", {}).get("nodes", {})
+    for node, latency in report["latency_seconds"]["nodes"].items():
+        before, after = baseline_nodes.get(node, {}).get("p95"), latency["p95"]
+        if before and after is not None and after > before * (1 + tolerance) and after - before > MIN_LATENCY_DELTA:
+            regressions.append(f"{node} p95 latency {before}s -> {after}s")
+
+    before, after = baseline.get("items_per_second"), report["items_per_second"]
+    if before and after is not None and after < before * (1 - tolerance):
+        regressions.append(f"throughput {before} -> {after} items/s")
+
+    k = report["settings"]["k"]
+    for key in ("at_1", f"at_{k}"):
+        before, after = baseline.get("recall", {}).get(key), report["recall"][key]
+        if before is not None and after is not None and after < before - RECALL_TOLERANCE:
+            regressions.append(f"recall {key} {before} -> {after}")
+    return regressions
+
+
+def main():
+    """Command-line entry point: python -m backend.pipeline_benchmark [--sample N] [--llm-latency S] [--baseline JSON]"""
+    parser = argparse.ArgumentParser(description="Benchmark the agent graph offline: latency per node, throughput, memory and retrieval recall.")
+    parser.add_argument("--source", help="Mandatory-list .xlsx file the labelled corpus is sampled from (default: the bundled list).")
+    parser.add_argument("--sample", type=int, default=50, help="Rows sampled per store (each gives an exact and a noisy query per title).")
+    parser.add_argument("--corpus", help="Labelled corpus (JSON) to run instead of sampling one.")
+    parser.add_argument("--save-corpus", help="Write the sampled corpus to this file, to rerun the same queries later.")
+    parser.add_argument("--items-per-request", type=int, default=20, help="Product names sent per graph run.")
+    parser.add_argument("--concurrency", type=int, default=1, help="Graph runs in flight at once.")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="Seconds each stub LLM call takes.")
+    parser.add_argument("--llm-jitter", type=float, default=0.0, help="Extra random seconds (up to) per stub LLM call.")
+    parser.add_argument("--decision-cache", action="store_true", help="Keep the decision cache enabled (in a scratch database).")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the corpus sample and the stub latency jitter.")
+    parser.add_argument("--output", help="Also write the JSON report to this file.")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare with; exits with status 1 on a regression.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Relative slowdown reported as a regression.")
+    args = parser.parse_args()
+
+    # Keep the benchmark's checkpoints and stub decisions out of the service databases
+    scratch_dir = tempfile.mkdtemp(prefix="pipeline-benchmark-")
+    os.environ["CHECKPOINT_DB_PATH"] = os.path.join(scratch_dir, "db.sqlite")
+    os.environ["DECISION_CACHE_PATH"] = os.path.join(scratch_dir, "decision_cache.sqlite")
+    os.environ["DECISION_CACHE_ENABLED"] = "true" if args.decision_cache else "false"
+
+    from .build_index import DEFAULT_SOURCE
+    from .config import INDEX_MODE
+
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as corpus_file:
+            corpus = json.load(corpus_file)
+    else:
+        mode = "unified" if INDEX_MODE == "unified" else "per_language"
+        corpus = sample_corpus(args.source or DEFAULT_SOURCE, mode, args.sample, args.seed)
+    if args.save_corpus:
+        with open(args.save_corpus, "w", encoding="utf-8") as corpus_file:
+            json.dump(corpus, corpus_file, indent=2, ensure_ascii=False)
+
+    report = run_benchmark(corpus, args.items_per_request, args.concurrency, args.llm_latency, args.llm_jitter, args.seed)
+
+    regressions = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            regressions = compare_reports(json.load(baseline_file), report, args.tolerance)
+        report["regressions"] = regressions
+
+    report_json = json.dumps(report, indent=2, ensure_ascii=False)
+    print(report_json)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(report_json)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+from typing import Iterable, List
+
+from .state import Analyze
+
+# Bilingual labels of the final answer
+_TITLE = "### Product Analysis Results | نتائج تحليل المنتجات"
+_NO_PRODUCTS = "No products were analyzed or processed. | لم يتم تحليل أي منتجات."
+_COUNT_LABELS = (
+    "Products analyzed | المنتجات التي تم تحليلها",
+    "Listed in the mandatory list | مدرجة في القائمة الإلزامية",
+    "Local Content Certificate required | تتطلب شهادة المحتوى المحلي",
+)
+_COLUMNS = ("#", "Product / المنتج", "Listed / مدرج", "Certificate / الشهادة", "Reasoning / التوضيح")
+_LISTED = {True: "✅ Yes / نعم", False: "❌ No / لا"}
+_CERTIFICATE = {True: "⚠️ Required / مطلوبة", False: "Not required / غير مطلوبة"}
+
+
+def _table_cell(text: str) -> str:
+    """Keeps a value on one Markdown table cell (no line breaks, escaped pipes)."""
+    return " ".join(str(text).split()).replace("|", "\\|")
+
+
+def render_decisions_report(decisions: Iterable[Analyze]) -> str:
+    """
+    Renders the analysis decisions as the final answer without the LLM: bilingual counts of
+    analyzed, listed and certificate-requiring products, followed by a Markdown table with one
+    row per product (in the given order).
+    """
+    decisions = list(decisions)
+    if not decisions:
+        return _NO_PRODUCTS
+
+    listed = sum(1 for decision in decisions if decision.Listed)
+    certificate_required = sum(1 for decision in decisions if decision.Content_Certificate)
+
+    lines: List[str] = [_TITLE, ""]
+    for label, count in zip(_COUNT_LABELS, (len(decisions), listed, certificate_required)):
+        lines.append(f"- **{label}:** {count}")
+    lines.append("")
+
+    lines.append("| " + " | ".join(_COLUMNS) + " |")
+    lines.append("|" + "|".join("---" for _ in _COLUMNS) + "|")
+    for number, decision in enumerate(decisions, start=1):
+        cells = (
+            str(number),
+            _table_cell(decision.item),
+            _LISTED[decision.Listed],
+            _CERTIFICATE[decision.Content_Certificate],
+            _table_cell(decision.reasoning),
+        )
+        lines.append("| " + " | ".join(cells) + " |")
+
+    return "\n".join(lines)
@@ -1,5 +1,8 @@
 from pydantic import BaseModel, Field
-from typing import TypedDict, Annotated, Sequence, List, Dict, Literal # Added Literal
+from pydantic.json_schema import SkipJsonSchema
+from typing import TypedDict, Annotated, Sequence, List, Dict, Literal, Optional # Added Literal
+from typing_extensions import NotRequired
+from langgraph.channels.untracked_value import UntrackedValue
 from langgraph.graph.message import add_messages
 from langchain_core.documents import Document
 
@@ -21,11 +24,16 @@ class AgentState(TypedDict):
                                                 to its analysis result, structured by the Analyze BaseModel.
                                                 This includes whether it's listed and if a Local Content Certificate
                                                 is required.
+        dataset_version (str): Version of the mandatory-list index the documents were retrieved from;
+                               the items are analyzed against the same index version.
+        product_items, items_retrieved_docs and items_decisions only live for the duration of a run:
+        they are not written to the checkpoints (the final answer in 'messages' is what the conversation keeps).
     """
     messages: Annotated[Sequence, add_messages]
-    product_items: Dict[str, Literal["en", "ar"]] # Changed to Dict[str, Literal["en", "ar"]]
-    items_retrieved_docs: Dict[str, List[Document]]
-    items_decisions: Dict[str, 'Analyze']
+    product_items: Annotated[Dict[str, Literal["en", "ar"]], UntrackedValue]
+    items_retrieved_docs: Annotated[Dict[str, List[Document]], UntrackedValue]
+    items_decisions: Annotated[Dict[str, 'Analyze'], UntrackedValue]
+    dataset_version: NotRequired[Optional[str]]
 
 
 # Pydantic model for parsing user input into a structured list of product names and their languages
@@ -74,4 +82,18 @@ class Analyze(BaseModel):
                     "If listed, mention the matching product name from the document and the "
                     "exact value of 'Manufacturer Local Content Minimum Baseline'. "
                     "If not listed, explain why (e.g., 'no clear match found in the mandatory list')."
-    )
\ No newline at end of file
+    )
+    # Set by the agent, not the LLM: hidden from the schema given to the model
+    dataset_version: SkipJsonSchema[Optional[str]] = Field(
+        default=None,
+        description="Version of the mandatory-list dataset the decision was made against."
+    )
+
+class AnalyzeBatch(BaseModel):
+    """
+    Represents the analysis results for several product items analyzed in a single LLM call.
+    """
+    decisions: List[Analyze] = Field(
+        description="One analysis per product item given in the input, in the same order. "
+                    "Every input product item must appear exactly once, with its 'item' field copied exactly."
+    )
@@ -0,0 +1,44 @@
+import re
+import unicodedata
+
+# Arabic diacritics (tashkeel), superscript alef and tatweel carry no meaning for matching
+_ARABIC_DIACRITICS = re.compile(r"[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]")
+
+# Letter variants that are commonly written interchangeably
+_ARABIC_LETTER_VARIANTS = str.maketrans({
+    "\u0623": "\u0627",  # alef with hamza above -> alef
+    "\u0625": "\u0627",  # alef with hamza below -> alef
+    "\u0622": "\u0627",  # alef with madda -> alef
+    "\u0671": "\u0627",  # alef wasla -> alef
+    "\u0649": "\u064A",  # alef maksura -> yeh
+    "\u0629": "\u0647",  # teh marbuta -> heh
+})
+
+# Anything that is not a letter, digit, percent sign or whitespace is treated as a separator
+_PUNCTUATION = re.compile(r"[^\w\s%]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_product_name(name: str) -> str:
+    """
+    Normalizes a product name for exact comparisons (cache keys, title lookups).
+
+    Applies Unicode NFKC folding, case folding, Arabic diacritic/tatweel removal,
+    Arabic letter-variant unification, punctuation stripping and whitespace collapsing,
+    so that e.g. '"Steel  Pipes"' and 'steel pipes' normalize to the same string.
+    """
+    text = unicodedata.normalize("NFKC", name or "").casefold()
+    text = _ARABIC_DIACRITICS.sub("", text)
+    text = text.translate(_ARABIC_LETTER_VARIANTS)
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def normalize_embedding_text(text: str) -> str:
+    """
+    Lightly normalizes text before embedding (and for embedding cache keys).
+
+    Only applies Unicode NFKC folding and whitespace collapsing (no case folding or punctuation
+    stripping), so copies of a name that differ only in spacing share one embedding.
+    """
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text or "")).strip()
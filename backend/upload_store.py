@@ -0,0 +1,83 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Optional
+
+from .db_utils import get_db_connection
+
+
+class UploadStore:
+    """
+    Persistent SQLite store of uploaded file contents (the extracted product names), keyed on the
+    SHA-256 of the text and compressed with zlib.
+
+    Chat messages only carry the key ('file_ref'), so an upload is written once instead of being
+    serialized into every checkpoint of the conversation, and the same file uploaded again is stored once.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._table_ready = False
+        self._lock = threading.Lock()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """Returns the calling thread's connection to the upload database, creating the table on first use."""
+        conn = get_db_connection(self.db_path)
+        if not self._table_ready:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS uploads (
+                    content_hash TEXT PRIMARY KEY,
+                    content BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_uploads_last_used ON uploads (last_used_at)")
+            conn.commit()
+            self._table_ready = True
+        return conn
+
+    def put(self, content: str) -> str:
+        """Stores the content (once per distinct content) and returns its reference."""
+        data = content.encode("utf-8")
+        content_hash = hashlib.sha256(data).hexdigest()
+        now = time.time()
+
+        with self._lock:
+            conn = self._get_connection()
+            conn.execute(
+                "INSERT INTO uploads (content_hash, content, size, created_at, last_used_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (content_hash) DO UPDATE SET last_used_at = excluded.last_used_at",
+                (content_hash, zlib.compress(data), len(data), now, now)
+            )
+            conn.commit()
+        return content_hash
+
+    def get(self, content_hash: str) -> Optional[str]:
+        """Returns the stored content, or None if it is unknown or was pruned."""
+        with self._lock:
+            row = self._get_connection().execute(
+                "SELECT content FROM uploads WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+        return zlib.decompress(row[0]).decode("utf-8") if row else None
+
+    def prune(self, max_age_seconds: float) -> int:
+        """Removes the uploads not stored again for 'max_age_seconds' and returns how many were deleted."""
+        with self._lock:
+            conn = self._get_connection()
+            cursor = conn.execute("DELETE FROM uploads WHERE last_used_at < ?", (time.time() - max_age_seconds,))
+            conn.commit()
+            return cursor.rowcount
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of stored uploads, their total size and the space they take compressed (bytes)."""
+        with self._lock:
+            entries, size, stored = self._get_connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(content)), 0) FROM uploads"
+            ).fetchone()
+        return {"entries": entries, "bytes": size, "stored_bytes": stored}
@@ -10,12 +10,62 @@ document.addEventListener('DOMContentLoaded', () => {
     let isSending = false; // Flag to prevent multiple sends
     let typingIndicatorElement = null; // To keep track of the typing indicator
 
+    // Escapes text inserted into generated HTML
+    function escapeHtml(text) {
+        return text
+            .replace(/&/g, '&amp;')
+            .replace(/</g, '&lt;')
+            .replace(/>/g, '&gt;')
+            .replace(/"/g, '&quot;');
+    }
+
+    // Splits a Markdown table row into its cells (pipes escaped as \| stay inside a cell)
+    function splitTableRow(line) {
+        return line.trim()
+            .replace(/^\|/, '')
+            .replace(/(?<!\\)\|$/, '')
+            .split(/(?<!\\)\|/)
+            .map(cell => cell.trim().replace(/\\\|/g, '|'));
+    }
+
+    // Converts Markdown tables (header row, |---| separator row, body rows) into single-line HTML tables
+    function formatTables(text) {
+        const isTableRow = line => /^\s*\|.*\|\s*$/.test(line);
+        const isSeparatorRow = line => /^\s*\|(\s*:?-{3,}:?\s*\|)+\s*$/.test(line);
+
+        const lines = text.split('\n');
+        const output = [];
+        let i = 0;
+        while (i < lines.length) {
+            if (isTableRow(lines[i]) && i + 1 < lines.length && isSeparatorRow(lines[i + 1])) {
+                const headerCells = splitTableRow(lines[i]);
+                i += 2;
+                const bodyRows = [];
+                while (i < lines.length && isTableRow(lines[i])) {
+                    bodyRows.push(splitTableRow(lines[i]));
+                    i++;
+                }
+                output.push(
+                    '<div class="table-wrapper"><table class="message-table"><thead><tr>' +
+                    headerCells.map(cell => `<th>${escapeHtml(cell)}</th>`).join('') +
+                    '</tr></thead><tbody>' +
+                    bodyRows.map(row => '<tr>' + row.map(cell => `<td>${escapeHtml(cell)}</td>`).join('') + '</tr>').join('') +
+                    '</tbody></table></div>'
+                );
+            } else {
+                output.push(lines[i]);
+                i++;
+            }
+        }
+        return output.join('\n');
+    }
+
     // Function to format text with basic markdown-like formatting
     function formatText(text) {
         if (!text) return '';
         
-        // Convert the text to HTML with formatting
-        let formattedText = text
+        // Convert the text to HTML with formatting (Markdown tables first)
+        let formattedText = formatTables(text)
             // Convert multiple *** to horizontal separators (3 or more asterisks)
             .replace(/^\*{3,}$/gm, '<hr class="text-separator">')
             // Convert ---+ to horizontal rule
@@ -175,6 +225,111 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Read a Server-Sent Events response and call onEvent(eventName, data) for each event
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            // Events are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let eventName = 'message';
+                const dataLines = [];
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) {
+                        eventName = line.slice(6).trim();
+                    } else if (line.startsWith('data:')) {
+                        dataLines.push(line.slice(5).trim());
+                    }
+                });
+                if (dataLines.length > 0) {
+                    onEvent(eventName, JSON.parse(dataLines.join('\n')));
+                }
+            }
+        }
+    }
+
+    // Create the handler that renders a streamed agent response into a single AI bubble:
+    // a live list of per-product decisions first, replaced by the final answer once it starts
+    function createLiveResponse() {
+        let bubble = null;
+        let resultsHeader = null;
+        let resultsList = null;
+        let totalItems = 0;
+        let analyzedItems = 0;
+        let finalText = '';
+        let complete = false;
+
+        function ensureBubble() {
+            if (!bubble) {
+                removeTypingIndicator();
+                bubble = addMessage('ai', '');
+            }
+            return bubble;
+        }
+
+        function updateHeader() {
+            resultsHeader.textContent = `Analyzed ${analyzedItems} of ${totalItems} products...`;
+        }
+
+        function handleEvent(eventName, data) {
+            if (eventName === 'items') {
+                totalItems = data.items.length;
+                if (totalItems === 0) return;
+
+                ensureBubble().innerHTML = '';
+                resultsHeader = document.createElement('div');
+                resultsHeader.classList.add('live-results-header');
+                resultsList = document.createElement('div');
+                resultsList.classList.add('live-results');
+                bubble.appendChild(resultsHeader);
+                bubble.appendChild(resultsList);
+                updateHeader();
+
+            } else if (eventName === 'decision') {
+                if (!resultsList) return;
+                analyzedItems += 1;
+
+                const row = document.createElement('div');
+                row.classList.add('live-result-row', data.Listed ? 'listed' : 'not-listed');
+                const status = data.Listed
+                    ? (data.Content_Certificate ? 'Listed · Certificate required' : 'Listed · No certificate')
+                    : 'Not listed';
+                row.textContent = `${data.item}: ${status}`;
+                row.title = data.reasoning;
+                resultsList.appendChild(row);
+                updateHeader();
+
+            } else if (eventName === 'token') {
+                finalText += data.content;
+                ensureBubble().innerHTML = formatText(finalText);
+
+            } else if (eventName === 'final') {
+                ensureBubble().innerHTML = formatText(data.ai_response);
+                complete = true;
+
+            } else if (eventName === 'error') {
+                throw new Error(data.detail);
+            }
+
+            chatContainer.scrollTop = chatContainer.scrollHeight;
+        }
+
+        return {
+            handleEvent,
+            isComplete: () => complete
+        };
+    }
+
     // Send message function
     async function sendMessage() {
         if (isSending) return; // Prevent sending if already in progress
@@ -201,7 +356,7 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         try {
-            const response = await fetch('/api/send_message', {
+            const response = await fetch('/api/send_message/stream', {
                 method: 'POST',
                 body: formData
             });
@@ -211,9 +366,12 @@ document.addEventListener('DOMContentLoaded', () => {
                 throw new Error(errorData.detail || `HTTP error! status: ${response.status}`);
             }
 
-            const data = await response.json();
-            // Display AI response directly
-            addMessage('ai', data.ai_response);
+            // Render per-product decisions as they arrive, then the final answer token by token
+            const liveResponse = createLiveResponse();
+            await readEventStream(response, liveResponse.handleEvent);
+            if (!liveResponse.isComplete()) {
+                throw new Error("The response stream ended unexpectedly.");
+            }
 
             // Clear input and file after successful send
             userInput.value = '';
@@ -0,0 +1,26 @@
+import asyncio
+import threading
+
+from backend import db_utils
+
+
+def test_threads_outliving_shutdown_reopen_their_connections(tmp_path):
+    db_path = str(tmp_path / "test.sqlite")
+    connected, closed = threading.Event(), threading.Event()
+    results = []
+
+    def worker():
+        first = db_utils.get_db_connection(db_path)
+        connected.set()
+        closed.wait()
+        second = db_utils.get_db_connection(db_path)
+        results.append((first is second, second.execute("SELECT 1").fetchone()))
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    connected.wait()
+    asyncio.run(db_utils.close_db_connections())
+    closed.set()
+    thread.join()
+
+    assert results == [(False, (1,))]
@@ -0,0 +1,30 @@
+from backend.input_parser import MAX_ITEM_CHARS, MAX_ITEM_WORDS, split_product_list
+
+LONG_DESCRIPTION = (
+    "Three phase dry type distribution transformer 1000 kVA 13.8 kV / 400 V with aluminium windings, "
+    "IP23 enclosure and off-circuit tap changer"
+)
+
+
+def test_long_description_is_longer_than_an_item():
+    assert len(LONG_DESCRIPTION.split()) > MAX_ITEM_WORDS or len(LONG_DESCRIPTION) > MAX_ITEM_CHARS
+
+
+def test_uploaded_file_keeps_long_lines_as_single_items():
+    text = "Product Name\nLED flood light 100W\n" + LONG_DESCRIPTION + "\nمحول كهربائي"
+    assert split_product_list(text, from_file=True) == ["LED flood light 100W", LONG_DESCRIPTION, "محول كهربائي"]
+
+
+def test_uploaded_file_splits_quoted_lists():
+    assert split_product_list('"steel pipes", "copper cables"\nwater pumps', from_file=True) == [
+        "steel pipes", "copper cables", "water pumps"
+    ]
+
+
+def test_chat_message_needs_list_markers():
+    assert split_product_list("- LED flood light\n- water pumps") == ["LED flood light", "water pumps"]
+    assert split_product_list("LED flood light\nwater pumps") is None
+
+
+def test_chat_message_with_long_line_goes_to_the_llm():
+    assert split_product_list("- LED flood light\n- " + LONG_DESCRIPTION) is None
@@ -0,0 +1,253 @@
+import asyncio
+
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+from backend.llm_gateway import LLMGateway, RateLimiter, classify_llm_error
+
+
+class ApiError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _rate_limit_error():
+    return ApiError("quota exceeded", status_code=429)
+
+
+def _scripted_model(calls, outcomes, answer="primary"):
+    """A model whose calls raise the given errors in turn, then answer."""
+
+    def respond(prompt):
+        calls.append(prompt)
+        if len(calls) <= len(outcomes):
+            raise outcomes[len(calls) - 1]
+        return answer
+
+    async def arespond(prompt):
+        return respond(prompt)
+
+    return RunnableLambda(respond, afunc=arespond)
+
+
+def _invoke(gateway, prompt, mode):
+    if mode == "async":
+        return asyncio.run(gateway.ainvoke(prompt))
+    return gateway.invoke(prompt)
+
+
+def _slow_model(calls, delay=0.05):
+    async def answer(prompt):
+        calls.append(prompt)
+        await asyncio.sleep(delay)
+        return {"answer": prompt}
+
+    return RunnableLambda(lambda prompt: None, afunc=answer)
+
+
+def test_concurrent_identical_calls_share_one_model_call():
+    calls = []
+    gateway = LLMGateway(_slow_model(calls))
+
+    async def run():
+        return await asyncio.gather(gateway.ainvoke("prompt"), gateway.ainvoke("prompt"))
+
+    first, second = asyncio.run(run())
+    assert first == second == {"answer": "prompt"}
+    assert first is not second
+    assert calls == ["prompt"]
+
+
+def test_cancelled_owner_does_not_cancel_joined_callers():
+    calls = []
+    gateway = LLMGateway(_slow_model(calls))
+
+    async def run():
+        owner = asyncio.create_task(asyncio.wait_for(gateway.ainvoke("prompt"), timeout=0.01))
+        await asyncio.sleep(0)
+        joiner = asyncio.create_task(gateway.ainvoke("prompt"))
+        return await asyncio.gather(owner, joiner, return_exceptions=True)
+
+    owner_result, joiner_result = asyncio.run(run())
+    assert isinstance(owner_result, asyncio.TimeoutError)
+    assert joiner_result == {"answer": "prompt"}
+    assert calls == ["prompt"]
+
+
+def test_call_is_cancelled_when_every_caller_left():
+    calls = []
+    gateway = LLMGateway(_slow_model(calls, delay=1.0))
+
+    async def run():
+        callers = [asyncio.create_task(gateway.ainvoke("prompt")) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        shared_task = next(iter(gateway._in_flight.values())).task
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        return shared_task
+
+    shared_task = asyncio.run(run())
+    assert shared_task.cancelled()
+    assert not gateway._in_flight
+
+
+# --- Rate limiter ---
+
+def test_rate_limiter_request_bucket():
+    limiter = RateLimiter(requests_per_minute=2)
+    assert limiter.reserve(0) == 0
+    assert limiter.reserve(0) == 0
+    # The bucket is empty: one request refills in 30 seconds
+    assert limiter.reserve(0) == pytest.approx(30, abs=0.1)
+    assert limiter.reserve(0) == pytest.approx(60, abs=0.1)
+
+
+def test_rate_limiter_token_bucket():
+    limiter = RateLimiter(tokens_per_minute=600)
+    assert limiter.reserve(600) == 0
+    assert limiter.reserve(300) == pytest.approx(30, abs=0.1)
+
+
+def test_rate_limiter_caps_oversized_requests_at_a_full_bucket():
+    limiter = RateLimiter(tokens_per_minute=600)
+    assert limiter.reserve(6000) == 0
+    assert limiter.reserve(6000) == pytest.approx(60, abs=0.1)
+
+
+def test_rate_limiter_try_reserve_does_not_reserve_beyond_max_wait():
+    limiter = RateLimiter(requests_per_minute=1)
+    assert limiter.try_reserve(0, max_wait=5) == 0
+    assert limiter.try_reserve(0, max_wait=5) is None
+    # The refused reservation was not taken from the bucket
+    assert limiter.reserve(0) == pytest.approx(60, abs=0.1)
+
+
+def test_unlimited_rate_limiter_never_waits():
+    limiter = RateLimiter()
+    assert all(limiter.reserve(10 ** 6) == 0 for _ in range(100))
+
+
+# --- Error classification ---
+
+def _chained(error, cause):
+    error.__cause__ = cause
+    return error
+
+
+@pytest.mark.parametrize("error, expected", [
+    (ApiError("quota", status_code=429), "rate_limit"),
+    (Exception("429 RESOURCE_EXHAUSTED: quota exceeded"), "rate_limit"),
+    (type("ResourceExhausted", (Exception,), {})("quota"), "rate_limit"),
+    (_chained(RuntimeError("call failed"), ApiError("quota", status_code=429)), "rate_limit"),
+    (ApiError("unavailable", status_code=503), "transient"),
+    (TimeoutError("read timed out"), "transient"),
+    (ConnectionError("reset"), "transient"),
+    (_chained(RuntimeError("call failed"), ConnectionError("reset")), "transient"),
+    (ApiError("bad request", status_code=400), None),
+    (ValueError("invalid output: 429 items"), None),
+])
+def test_classify_llm_error(error, expected):
+    assert classify_llm_error(error) == expected
+
+
+# --- Retries and fallback (sync and async paths) ---
+
+def test_backoff_is_jittered_and_capped():
+    gateway = LLMGateway(RunnableLambda(lambda prompt: prompt), backoff_base=1.0, backoff_max=4.0)
+    for attempt, full_delay in ((0, 1.0), (1, 2.0), (2, 4.0), (5, 4.0)):
+        delays = [gateway._backoff(attempt) for _ in range(50)]
+        assert all(full_delay / 2 <= delay <= full_delay for delay in delays)
+        assert len(set(delays)) > 1
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_retryable_errors_are_retried(mode):
+    calls = []
+    model = _scripted_model(calls, [_rate_limit_error(), ApiError("unavailable", status_code=503)])
+    gateway = LLMGateway(model, max_retries=2, backoff_base=0)
+    assert _invoke(gateway, "prompt", mode) == "primary"
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_retries_are_bounded(mode):
+    calls = []
+    model = _scripted_model(calls, [_rate_limit_error()] * 5)
+    gateway = LLMGateway(model, max_retries=2, backoff_base=0)
+    with pytest.raises(ApiError):
+        _invoke(gateway, "prompt", mode)
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_other_errors_are_not_retried(mode):
+    calls = []
+    model = _scripted_model(calls, [ValueError("invalid output")])
+    gateway = LLMGateway(model, max_retries=2, backoff_base=0)
+    with pytest.raises(ValueError):
+        _invoke(gateway, "prompt", mode)
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_still_rate_limited_calls_go_to_the_fallback_model(mode):
+    primary_calls, fallback_calls = [], []
+    gateway = LLMGateway(
+        _scripted_model(primary_calls, [_rate_limit_error()] * 5),
+        fallback_model=_scripted_model(fallback_calls, [], answer="fallback"),
+        max_retries=1,
+        backoff_base=0
+    )
+    assert _invoke(gateway, "prompt", mode) == "fallback"
+    assert len(primary_calls) == 2
+    assert len(fallback_calls) == 1
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_failed_calls_without_rate_limit_do_not_fall_back(mode):
+    primary_calls, fallback_calls = [], []
+    gateway = LLMGateway(
+        _scripted_model(primary_calls, [ValueError("invalid output")]),
+        fallback_model=_scripted_model(fallback_calls, [], answer="fallback"),
+        backoff_base=0
+    )
+    with pytest.raises(ValueError):
+        _invoke(gateway, "prompt", mode)
+    assert fallback_calls == []
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_overflow_goes_to_the_fallback_model(mode):
+    primary_calls, fallback_calls = [], []
+    limiter = RateLimiter(requests_per_minute=1)
+    gateway = LLMGateway(
+        _scripted_model(primary_calls, []),
+        fallback_model=_scripted_model(fallback_calls, [], answer="fallback"),
+        limiter=limiter,
+        overflow_wait=5
+    )
+    assert _invoke(gateway, "first", mode) == "primary"
+    # The primary quota is used up for the next 60 seconds
+    assert _invoke(gateway, "second", mode) == "fallback"
+    assert primary_calls == ["first"]
+    assert fallback_calls == ["second"]
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_overflow_waits_without_a_fallback_model(mode, monkeypatch):
+    waits = []
+    monkeypatch.setattr("backend.llm_gateway.time.sleep", waits.append)
+
+    async def record_wait(seconds):
+        waits.append(seconds)
+
+    monkeypatch.setattr("backend.llm_gateway.asyncio.sleep", record_wait)
+    calls = []
+    gateway = LLMGateway(_scripted_model(calls, []), limiter=RateLimiter(requests_per_minute=1))
+    _invoke(gateway, "first", mode)
+    _invoke(gateway, "second", mode)
+    assert calls == ["first", "second"]
+    assert waits == [pytest.approx(60, abs=0.1)]
@@ -0,0 +1,58 @@
+import pytest
+
+from backend.build_index import DEFAULT_SOURCE, load_mandatory_list
+from backend.matcher import BASELINE_FIELD, CommodityTitleIndex, baseline_requires_certificate
+
+# Baseline values of the shipped workbook that state there is no certificate requirement
+NO_REQUIREMENT_BASELINES = {
+    "لا يشترط وجود شهادة المحتوى المحلي ",
+    "لايشترط وجود شهادة المحتوى المحلي",
+}
+
+
+@pytest.fixture(scope="module")
+def workbook_baselines():
+    df = load_mandatory_list(DEFAULT_SOURCE)
+    column = next(column for column in df.columns if column.endswith(BASELINE_FIELD))
+    return df[column]
+
+
+def test_workbook_no_requirement_baselines(workbook_baselines):
+    found = set(workbook_baselines) & NO_REQUIREMENT_BASELINES
+    assert found == NO_REQUIREMENT_BASELINES
+    for baseline in found:
+        assert baseline_requires_certificate(baseline) is False
+
+
+def test_workbook_requirement_baselines(workbook_baselines):
+    for baseline in set(workbook_baselines) - NO_REQUIREMENT_BASELINES:
+        assert baseline_requires_certificate(baseline) is True, baseline
+
+
+@pytest.mark.parametrize("baseline, expected", [
+    ("لا يشترط وجود شهادة", False),
+    ("لا  يوجد", False),
+    ("No", False),
+    ("Not required", False),
+    ("0%", False),
+    ("0.0 %", False),
+    ("30%", True),
+    ("15 ٪", True),
+    ("Yes", True),
+    (0, False),
+    (30, True),
+    (None, False),
+    ("", False),
+    ("see annex", None),
+])
+def test_baseline_requires_certificate(baseline, expected):
+    assert baseline_requires_certificate(baseline) is expected
+
+
+def test_exact_title_without_requirement_is_not_certified():
+    index = CommodityTitleIndex([
+        ("Telecommunication terminal", {BASELINE_FIELD: "لايشترط وجود شهادة المحتوى المحلي"}),
+    ])
+    decision = index.match("Telecommunication terminal", threshold=0.9)
+    assert decision.Listed is True
+    assert decision.Content_Certificate is False